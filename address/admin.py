@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 
 from address.models import Country, State, Locality, Address
+from address.search import search_backend
 
 
 class UnidentifiedListFilter(SimpleListFilter):
@@ -24,14 +25,28 @@ class CountryAdmin(admin.ModelAdmin):
 @admin.register(State)
 class StateAdmin(admin.ModelAdmin):
     search_fields = ("name", "code")
+    list_select_related = ("country",)
 
 
 @admin.register(Locality)
 class LocalityAdmin(admin.ModelAdmin):
     search_fields = ("name", "postal_code")
+    list_select_related = ("state__country",)
 
 
 @admin.register(Address)
 class AddressAdmin(admin.ModelAdmin):
     search_fields = ("street_number", "route", "raw")
     list_filter = (UnidentifiedListFilter,)
+    list_select_related = ("locality__state__country",)
+
+    # How many of the closest misspelt matches the search box adds to the
+    # usual ones when addresses can be searched by similarity.
+    similar_search_limit = 200
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super(AddressAdmin, self).get_search_results(request, queryset, search_term)
+        if search_term and search_backend(queryset.db) is not None:
+            pks = [a.pk for a in queryset.search(search_term, limit=self.similar_search_limit)]
+            results |= queryset.filter(pk__in=pks)
+        return results, may_have_duplicates
@@ -8,3 +8,6 @@ class AddressConfig(AppConfig):
 
     name = "address"
     default_auto_field = "django.db.models.AutoField"
+
+    def ready(self):
+        from . import signals  # noqa: F401
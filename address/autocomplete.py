@@ -0,0 +1,362 @@
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import models, transaction
+
+from .cache import address_cache
+from .models import Address, Locality, _locality_strings
+from .normalize import fold
+
+__all__ = ["PrefixIndex", "AutocompleteIndex", "autocomplete_index", "autocomplete_hints", "prefix_key"]
+
+# Suggestions are only looked up once a query is this many characters long.
+DEFAULT_MIN_LENGTH = 3
+
+# How long, in milliseconds, clients should wait after a keystroke before
+# asking for suggestions.
+DEFAULT_DEBOUNCE = 250
+
+# How many queries' suggestions are remembered.
+DEFAULT_CACHE_SIZE = 1024
+
+# How long, in seconds, an index is used before it is built again, picking
+# up changes made by other processes.
+DEFAULT_MAX_AGE = 600
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+
+def prefix_key(text):
+    """
+    The form of `text` that prefixes are matched against: folded words
+    separated by single spaces, without punctuation.
+    """
+    return " ".join(_WORD.findall(fold(text)))
+
+
+def autocomplete_hints():
+    """
+    How clients should pace their requests: `debounce` milliseconds after
+    the last keystroke, once at least `min_length` characters are typed.
+    """
+    return {
+        "debounce": getattr(settings, "ADDRESS_AUTOCOMPLETE_DEBOUNCE", DEFAULT_DEBOUNCE),
+        "min_length": getattr(settings, "ADDRESS_AUTOCOMPLETE_MIN_LENGTH", DEFAULT_MIN_LENGTH),
+    }
+
+
+def _keys(label):
+    """
+    The keys a label is found under: the whole label, and the label from
+    its first word without digits, so that "12 Collins Street" is found by
+    typing "colli" as well as "12 col".
+    """
+    key = prefix_key(label)
+    keys = [key]
+    words = key.split(" ")
+    for index, word in enumerate(words):
+        if not any(ch.isdigit() for ch in word):
+            if index:
+                keys.append(" ".join(words[index:]))
+            break
+    return keys
+
+
+##
+# Sorted prefix indexes of labels, the process-wide index of localities
+# they make up, and the query suggesting addresses.
+##
+
+
+class PrefixIndex(object):
+    """
+    Labels of rows found by the start of any of their keys. Keys are kept
+    in one sorted list with the row ids alongside in a compact array, so
+    a lookup is a binary search followed by a scan over the matching run.
+    """
+
+    def __init__(self, entries=()):
+        self.labels = {}
+        pairs = []
+        for pk, label in entries:
+            self.labels[pk] = label
+            pairs.extend((key, pk) for key in _keys(label))
+        pairs.sort()
+        self._keys = [key for key, _ in pairs]
+        self._pks = array("q", [pk for _, pk in pairs])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, pk, label):
+        self.discard(pk)
+        self.labels[pk] = label
+        for key in _keys(label):
+            index = bisect_left(self._keys, key)
+            while index < len(self._keys) and self._keys[index] == key and self._pks[index] < pk:
+                index += 1
+            self._keys.insert(index, key)
+            self._pks.insert(index, pk)
+
+    def discard(self, pk):
+        label = self.labels.pop(pk, None)
+        if label is None:
+            return
+        for key in _keys(label):
+            index = bisect_left(self._keys, key)
+            while index < len(self._keys) and self._keys[index] == key:
+                if self._pks[index] == pk:
+                    del self._keys[index]
+                    del self._pks[index]
+                    break
+                index += 1
+
+    def lookup(self, prefix, limit):
+        """
+        Ids of up to `limit` rows with a key starting with `prefix`, which
+        must already be a `prefix_key`, in order of their keys.
+        """
+        found = []
+        index = bisect_left(self._keys, prefix)
+        while index < len(self._keys) and len(found) < limit and self._keys[index].startswith(prefix):
+            pk = self._pks[index]
+            if pk not in found:
+                found.append(pk)
+            index += 1
+        return found
+
+
+def _address_text(q):
+    """
+    What was typed, as the start of an address: single spaced, without
+    punctuation trailing the last word.
+    """
+    return " ".join(q.split()).strip(" .,")
+
+
+def _address_matches(text):
+    """
+    Addresses whose raw string starts with `text`, or whose route does when
+    `text` doesn't start with a number, so that "12 Collins Street" is found
+    by typing "colli" as well as "12 col". On PostgreSQL both are served by
+    the trigram indexes `0004_address_indexes` adds for the admin's search.
+    """
+    matches = models.Q(raw__istartswith=text)
+    if not any(ch.isdigit() for ch in text.split(" ")[0]):
+        matches |= models.Q(route__istartswith=text)
+    return matches
+
+
+class AutocompleteIndex(object):
+    """
+    A prefix index of every locality, built on first use and rebuilt after
+    `max_age` seconds, and a query for addresses, with the suggestions for
+    the last `cache_size` queries remembered. Localities this process saves
+    or inserts are updated in place, changes to countries, states or
+    localities rebuild the index, and any address saved or deleted forgets
+    the remembered suggestions, by the signals in `address.signals`. Only
+    one thread builds the index at a time; others are served the previous
+    one meanwhile, or wait if there is none.
+    """
+
+    def __init__(self, max_age=None, cache_size=None):
+        self._max_age = max_age
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._localities = None
+        self._built = 0
+        self._stale = False
+        self._pending = None
+        self._results = OrderedDict()
+        self._generation = 0
+
+    @property
+    def max_age(self):
+        if self._max_age is not None:
+            return self._max_age
+        return getattr(settings, "ADDRESS_AUTOCOMPLETE_MAX_AGE", DEFAULT_MAX_AGE)
+
+    @property
+    def cache_size(self):
+        if self._cache_size is not None:
+            return self._cache_size
+        return getattr(settings, "ADDRESS_AUTOCOMPLETE_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+
+    @property
+    def loaded(self):
+        return self._localities is not None or self._pending is not None
+
+    def _fresh(self):
+        return self._localities is not None and not self._stale and time.monotonic() - self._built < self.max_age
+
+    def _load(self):
+        with self._lock:
+            if self._fresh():
+                return self._localities
+            previous = self._localities
+        if not self._build_lock.acquire(blocking=previous is None):
+            return previous
+        try:
+            with self._lock:
+                # Built by another thread while this one waited.
+                if self._fresh():
+                    return self._localities
+                self._stale = False
+                self._pending = []
+            try:
+                localities = PrefixIndex(_locality_strings(Locality.objects.all()).items())
+            except BaseException:
+                self._pending = None
+                raise
+            with self._lock:
+                # Apply anything changed while the rows were being read.
+                for pk, label in self._pending:
+                    self._apply(localities, pk, label)
+                self._pending = None
+                self._localities = localities
+                self._built = time.monotonic()
+                self._generation += 1
+                self._results.clear()
+                return self._localities
+        finally:
+            self._build_lock.release()
+
+    def suggest(self, q, limit=10, addresses=True):
+        """
+        Suggestions for a partly typed address, localities first and then
+        addresses when `addresses` is true, each a dictionary with the
+        `type` and `id` of the row, its `label` and the `components` to
+        submit for it.
+        """
+        prefix = prefix_key(q)
+        if not prefix:
+            return []
+        text = _address_text(q)
+        localities = self._load()
+        cache_key = (prefix, text.casefold() if addresses else None, limit)
+        with self._lock:
+            results = self._results.get(cache_key)
+            if results is not None:
+                self._results.move_to_end(cache_key)
+                return results
+            locality_labels = OrderedDict((pk, localities.labels[pk]) for pk in localities.lookup(prefix, limit))
+            generation = self._generation
+
+        address_labels = OrderedDict()
+        if addresses and text and len(locality_labels) < limit:
+            matches = Address.objects.filter(_address_matches(text)).order_by()
+            address_labels.update(matches[: limit - len(locality_labels)].as_strings(with_id=True))
+        results = _locality_suggestions(locality_labels) + _address_suggestions(address_labels)
+        with self._lock:
+            # Suggestions fetched while anything changed may already be stale.
+            if generation == self._generation and self.cache_size:
+                self._results[cache_key] = results
+                while len(self._results) > self.cache_size:
+                    self._results.popitem(last=False)
+        return results
+
+    def addresses_changed(self, using=None):
+        """
+        Forget the suggestions remembered so far once the current
+        transaction commits, as addresses have been saved or deleted.
+        """
+        if self.loaded:
+            transaction.on_commit(self._forget, using=using)
+
+    def localities_saved(self, localities, using=None):
+        """
+        Add or update the entries for `localities` once the current
+        transaction commits.
+        """
+        if self.loaded:
+            pks = [obj.pk for obj in localities if obj.pk is not None]
+            transaction.on_commit(lambda: self._update_localities(pks, using), using=using)
+
+    def _update_localities(self, pks, using):
+        strings = _locality_strings(Locality.objects.using(using).filter(pk__in=pks))
+        self._update(list(strings.items()))
+
+    @staticmethod
+    def _apply(index, pk, label):
+        if label is None:
+            index.discard(pk)
+        else:
+            index.add(pk, label)
+
+    def _update(self, labels):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.extend(labels)
+            if self._localities is None:
+                return
+            for pk, label in labels:
+                self._apply(self._localities, pk, label)
+            self._generation += 1
+            self._results.clear()
+
+    def _forget(self):
+        with self._lock:
+            self._generation += 1
+            self._results.clear()
+
+    def invalidate(self):
+        """
+        Mark the index out of date, so it is built again on the next lookup
+        while concurrent lookups are still served from it.
+        """
+        with self._lock:
+            self._stale = True
+            self._generation += 1
+            self._results.clear()
+
+    def clear(self):
+        """
+        Drop the index, so it is built again on the next lookup.
+        """
+        with self._lock:
+            self._localities = None
+            self._stale = True
+            self._generation += 1
+            self._results.clear()
+
+
+def _locality_suggestions(labels):
+    if not labels:
+        return []
+    rows = Locality.objects.filter(pk__in=list(labels)).values_list(
+        "pk", "name", "postal_code", "state__name", "state__code", "state__country__name", "state__country__code"
+    )
+    components = {}
+    for row in rows:
+        components[row[0]] = dict(
+            zip(("locality", "postal_code", "state", "state_code", "country", "country_code"), row[1:])
+        )
+    return [
+        {"type": "locality", "id": pk, "label": label, "components": dict(components[pk], formatted=label)}
+        for pk, label in labels.items()
+        if pk in components
+    ]
+
+
+def _address_suggestions(labels):
+    if not labels:
+        return []
+    components = address_cache.dicts(list(labels))
+    results = []
+    for pk, label in labels.items():
+        if pk not in components:
+            continue
+        ad = components[pk]
+        ad["formatted"] = ad["formatted"] or label
+        del ad["raw"]
+        results.append({"type": "address", "id": pk, "label": label, "components": ad})
+    return results
+
+
+autocomplete_index = AutocompleteIndex()
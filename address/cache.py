@@ -0,0 +1,298 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+
+__all__ = ["HierarchyCache", "hierarchy_cache", "AddressCache", "address_cache"]
+
+DEFAULT_HIERARCHY_CACHE_SIZE = 4096
+DEFAULT_HIERARCHY_CACHE_MAX_AGE = 300
+DEFAULT_ADDRESS_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+##
+# A bounded cache of countries, states and localities, keyed by the natural
+# keys used to look them up when converting address components.
+##
+
+
+class HierarchyCache(object):
+    """
+    Thread safe LRU of Country, State and Locality rows. Only concrete field
+    values are kept, so each hit returns a fresh instance that callers are
+    free to modify. Lookups never touch the database, so `get` is also safe
+    to call from an event loop. Entries are dropped by the model signals registered in
+    `address.signals`; bulk changes that bypass signals (`QuerySet.update`,
+    raw SQL) should be followed by a call to `clear`. Signals only reach
+    the process that sent them, so entries also expire after `max_age`
+    seconds to pick up changes made by other processes.
+    """
+
+    def __init__(self, maxsize=None, max_age=None):
+        self._maxsize = maxsize
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._generation = 0
+
+    @property
+    def maxsize(self):
+        if self._maxsize is not None:
+            return self._maxsize
+        return getattr(settings, "ADDRESS_HIERARCHY_CACHE_SIZE", DEFAULT_HIERARCHY_CACHE_SIZE)
+
+    @property
+    def max_age(self):
+        if self._max_age is not None:
+            return self._max_age
+        return getattr(settings, "ADDRESS_HIERARCHY_CACHE_MAX_AGE", DEFAULT_HIERARCHY_CACHE_MAX_AGE)
+
+    def get(self, model, key):
+        if not self.maxsize:
+            return None
+        entry_key = (model._meta.label, key)
+        max_age = self.max_age
+        with self._lock:
+            try:
+                pk, db, values, stored = self._entries[entry_key]
+            except KeyError:
+                return None
+            if max_age is not None and time.monotonic() - stored >= max_age:
+                del self._entries[entry_key]
+                self._discard_key((entry_key[0], pk), entry_key)
+                return None
+            self._entries.move_to_end(entry_key)
+        return model.from_db(db, [f.attname for f in model._meta.concrete_fields], values)
+
+    def add(self, model, key, obj):
+        """
+        Remember `obj` under `key` once the current transaction commits, so
+        rows from rolled back transactions never become visible. Anything
+        evicted in the meantime invalidates the pending entry.
+        """
+        if not self.maxsize or obj.pk is None:
+            return
+        entry = (obj.pk, obj._state.db, tuple(getattr(obj, f.attname) for f in model._meta.concrete_fields))
+        generation = self._generation
+        transaction.on_commit(
+            lambda: self._store((model._meta.label, key), entry, generation),
+            using=obj._state.db,
+        )
+
+    def _store(self, entry_key, entry, generation):
+        maxsize = self.maxsize
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[entry_key] = entry + (time.monotonic(),)
+            self._entries.move_to_end(entry_key)
+            self._keys.setdefault((entry_key[0], entry[0]), set()).add(entry_key)
+            while len(self._entries) > maxsize:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._discard_key((old_key[0], old_entry[0]), old_key)
+
+    def _discard_key(self, pk_key, entry_key):
+        keys = self._keys.get(pk_key)
+        if keys is not None:
+            keys.discard(entry_key)
+            if not keys:
+                del self._keys[pk_key]
+
+    def evict(self, model, pk):
+        with self._lock:
+            self._generation += 1
+            for entry_key in self._keys.pop((model._meta.label, pk), ()):
+                self._entries.pop(entry_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+hierarchy_cache = HierarchyCache()
+
+
+##
+# Resolved addresses and their dictionaries, shared between processes
+# through one of Django's CACHES.
+##
+
+
+def _values(obj):
+    return tuple(getattr(obj, f.attname) for f in obj._meta.concrete_fields)
+
+
+class AddressCache(object):
+    """
+    Addresses resolved from dictionaries of components, keyed by their
+    fingerprint, and `Address.as_dict` payloads, keyed by primary key, kept
+    in the cache named by `ADDRESS_CACHE_ALIAS` so every process shares
+    them. Saving or deleting an address drops its entries. Saving or
+    deleting a country, state or locality moves every key to a new version
+    instead, as these change rarely and finding the affected addresses
+    would cost more than resolving them again. Bulk changes that bypass
+    signals should be followed by a call to `clear`.
+    """
+
+    version_key = "address.version"
+
+    def __init__(self, alias=None, timeout=None):
+        self._alias = alias
+        self._timeout = timeout
+
+    @property
+    def alias(self):
+        if self._alias is not None:
+            return self._alias
+        return getattr(settings, "ADDRESS_CACHE_ALIAS", None)
+
+    @property
+    def timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        return getattr(settings, "ADDRESS_CACHE_TIMEOUT", DEFAULT_ADDRESS_CACHE_TIMEOUT)
+
+    @property
+    def enabled(self):
+        return bool(self.alias)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _version(self):
+        # A version key lost to eviction restarts from the clock, so keys
+        # from before can't come back into use.
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, int(time.time() * 1000), None)
+            version = self.cache.get(self.version_key)
+        return version
+
+    def _resolved_key(self, version, fingerprint):
+        return "address.resolved:%s:%s" % (version, hashlib.sha1(repr(fingerprint).encode("utf-8")).hexdigest())
+
+    def _keys_key(self, version, pk):
+        return "address.keys:%s:%s" % (version, pk)
+
+    def _dict_key(self, version, pk):
+        return "address.dict:%s:%s" % (version, pk)
+
+    @staticmethod
+    def _models():
+        from .models import Address, Country, Locality, State
+
+        return [
+            (model, [f.attname for f in model._meta.concrete_fields]) for model in (Address, Locality, State, Country)
+        ]
+
+    def resolve(self, fingerprint, resolve):
+        """
+        The address a dictionary with `fingerprint` resolves to, with its
+        locality, state and country linked, from the cache if it is there
+        and otherwise from `resolve()`. What `resolve` returns is remembered
+        once the current transaction commits, provided its hierarchy is
+        already loaded.
+        """
+        version = self._version()
+        key = self._resolved_key(version, fingerprint)
+        entry = self.cache.get(key)
+        if entry is not None:
+            db, rows = entry
+            objs = [model.from_db(db, fields, values) for (model, fields), values in zip(self._models(), rows)]
+            for obj, parent, name in zip(objs, objs[1:], ("locality", "state", "country")):
+                setattr(obj, name, parent)
+            return objs[0]
+
+        address = resolve()
+        if address is None or address.pk is None:
+            return address
+
+        # Don't load the hierarchy just to cache it.
+        rows = []
+        obj = address
+        for name in ("locality", "state", "country", None):
+            rows.append(_values(obj))
+            if name is None:
+                break
+            field = obj._meta.get_field(name)
+            if getattr(obj, field.attname) is None:
+                break
+            if not field.is_cached(obj):
+                return address
+            obj = getattr(obj, name)
+        entry = (address._state.db, rows)
+        transaction.on_commit(lambda: self._store(version, key, address.pk, entry), using=address._state.db)
+        return address
+
+    def _store(self, version, key, pk, entry):
+        self.cache.set(key, entry, self.timeout)
+        keys_key = self._keys_key(version, pk)
+        keys = self.cache.get(keys_key) or []
+        if key not in keys:
+            self.cache.set(keys_key, keys + [key], self.timeout)
+
+    def dicts(self, pks, using=None):
+        """
+        Map each of `pks` that exists to its address's `as_dict` payload
+        with its `id`, as `AddressQuerySet.as_dicts(with_id=True)` gives,
+        reading only the addresses missing from the cache from the
+        database. Works, without the cache, even when it isn't configured.
+        """
+        from .models import Address
+
+        pks = set(pks)
+        if not pks:
+            return {}
+        using = using or router.db_for_read(Address)
+        if not self.enabled:
+            return dict(
+                (ad["id"], ad) for ad in Address.objects.using(using).filter(pk__in=pks).as_dicts(with_id=True)
+            )
+
+        version = self._version()
+        keys = dict((self._dict_key(version, pk), pk) for pk in pks)
+        found = dict((keys[key], ad) for key, ad in self.cache.get_many(list(keys)).items())
+        missing = pks - set(found)
+        if missing:
+            read = dict(
+                (ad["id"], ad) for ad in Address.objects.using(using).filter(pk__in=missing).as_dicts(with_id=True)
+            )
+            # Copied, as callers are free to modify what they are given.
+            entries = dict((self._dict_key(version, pk), dict(ad)) for pk, ad in read.items())
+            transaction.on_commit(lambda: self.cache.set_many(entries, self.timeout), using=using)
+            found.update(read)
+        return found
+
+    def evict(self, pks):
+        """
+        Drop everything cached for the addresses with primary keys `pks`.
+        """
+        version = self._version()
+        keys_keys = [self._keys_key(version, pk) for pk in pks]
+        keys = keys_keys + [self._dict_key(version, pk) for pk in pks]
+        for resolved in self.cache.get_many(keys_keys).values():
+            keys.extend(resolved)
+        self.cache.delete_many(keys)
+
+    def clear(self):
+        """
+        Move to a new version, leaving every entry cached so far to expire.
+        """
+        try:
+            self.cache.incr(self.version_key)
+        except ValueError:
+            self.cache.add(self.version_key, int(time.time() * 1000), None)
+
+
+address_cache = AddressCache()
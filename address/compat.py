@@ -1,13 +1,39 @@
 import django
 from django.db.models.fields.related import ForeignObject
 
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+
 django_version = django.VERSION
 
 is_django2 = django_version >= (2, 0)
 
+# Django 4.1 added asynchronous queryset methods such as `acreate`.
+is_django41 = django_version >= (4, 1)
+
+# Django 5.0 sets the primary keys of rows upserted with
+# `bulk_create(update_conflicts=True)`.
+is_django5 = django_version >= (5, 0)
+
 
 def compat_contribute_to_class(self, cls, name, virtual_only=False):
     if is_django2:
         super(ForeignObject, self).contribute_to_class(cls, name, private_only=virtual_only)
     else:
         super(ForeignObject, self).contribute_to_class(cls, name, virtual_only=virtual_only)
+
+
+def can_return_rows_from_bulk_insert(connection):
+    features = connection.features
+    if hasattr(features, "can_return_rows_from_bulk_insert"):
+        return features.can_return_rows_from_bulk_insert
+    return features.can_return_ids_from_bulk_insert
+
+
+def can_upsert_returning_rows(connection):
+    features = connection.features
+    return (
+        is_django5 and features.supports_update_conflicts_with_target and can_return_rows_from_bulk_insert(connection)
+    )
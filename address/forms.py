@@ -2,12 +2,12 @@ import logging
 
 from django import forms
 
-from .models import Address, to_python
+from .models import Address, _fingerprint, to_python, to_python_many
 from .widgets import AddressWidget
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["AddressWidget", "AddressField"]
+__all__ = ["AddressWidget", "AddressField", "AddressFormSetMixin"]
 
 
 class AddressField(forms.ModelChoiceField):
@@ -16,6 +16,9 @@ class AddressField(forms.ModelChoiceField):
     def __init__(self, *args, **kwargs):
         kwargs["queryset"] = Address.objects.none()
         super(AddressField, self).__init__(*args, **kwargs)
+        # A submitted value and the address or error it resolved to, when
+        # resolved in advance by `AddressFormSetMixin`.
+        self.resolved = None
 
     def to_python(self, value):
 
@@ -23,6 +26,21 @@ class AddressField(forms.ModelChoiceField):
         if value is None or value == "":
             return None
 
+        self.clean_coordinates(value)
+
+        if self.resolved is not None and self.resolved[0] == value:
+            if isinstance(self.resolved[1], forms.ValidationError):
+                raise self.resolved[1]
+            return self.resolved[1]
+
+        # Reuse the address the form was rendered with if it hasn't changed.
+        current = self._rendered_address(value)
+        if current is not None and current.fingerprint() == _fingerprint(value):
+            return current
+
+        return to_python(value)
+
+    def clean_coordinates(self, value):
         # Check for garbage in the lat/lng components.
         for field in ["latitude", "longitude"]:
             if field in value:
@@ -38,4 +56,79 @@ class AddressField(forms.ModelChoiceField):
                 else:
                     value[field] = None
 
-        return to_python(value)
+    def _rendered_address(self, value):
+        pk = _rendered_pk(value)
+        if pk is None:
+            return None
+        return Address.objects.with_hierarchy().filter(pk=pk).first()
+
+
+def _rendered_pk(value):
+    try:
+        return int(value.get("id") or "")
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class AddressFormSetMixin(object):
+    """
+    Resolve the addresses submitted to every `AddressField` in a formset
+    together before the forms are cleaned, using `to_python_many`. This
+    takes a fixed number of queries however many forms there are, where
+    cleaning each field on its own costs several queries apiece. Use it
+    ahead of the formset class:
+
+        class PersonFormSet(AddressFormSetMixin, BaseModelFormSet):
+            ...
+
+    Each field still reports its own errors for invalid coordinates, and an
+    address that can't be stored, such as one with an overlong country
+    code, becomes an error on its field.
+    """
+
+    def full_clean(self):
+        if self.is_bound:
+            self.resolve_addresses()
+        super(AddressFormSetMixin, self).full_clean()
+
+    def resolve_addresses(self):
+        pending = []
+        for form in self.forms:
+            for name, field in form.fields.items():
+                if not isinstance(field, AddressField) or field.disabled:
+                    continue
+                value = form[name].data
+                if not isinstance(value, dict):
+                    continue
+                try:
+                    field.clean_coordinates(value)
+                except forms.ValidationError:
+                    # Left for the field to report when the form is cleaned.
+                    continue
+                pending.append((field, value))
+        if not pending:
+            return
+
+        # Reuse addresses the forms were rendered with, as the field would.
+        pks = set(_rendered_pk(value) for _, value in pending)
+        pks.discard(None)
+        rendered = Address.objects.with_hierarchy().in_bulk(pks) if pks else {}
+        unresolved = []
+        for field, value in pending:
+            current = rendered.get(_rendered_pk(value))
+            if current is not None and current.fingerprint() == _fingerprint(value):
+                field.resolved = (value, current)
+            else:
+                unresolved.append((field, value))
+
+        def on_error(index, exc):
+            field, value = unresolved[index]
+            field.resolved = (
+                value,
+                forms.ValidationError("Invalid address: %(error)s", code="invalid", params={"error": exc}),
+            )
+
+        addresses = to_python_many([value for _, value in unresolved], on_error=on_error)
+        for (field, value), address in zip(unresolved, addresses):
+            if address is not None:
+                field.resolved = (value, address)
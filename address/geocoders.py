@@ -0,0 +1,343 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+__all__ = [
+    "GeocoderError",
+    "BaseGeocoder",
+    "FakeGeocoder",
+    "GoogleGeocoder",
+    "CachedGeocoder",
+    "RateLimitedGeocoder",
+    "get_geocoder",
+    "normalize_raw",
+]
+
+# Results are kept in the persistent cache for 30 days by default.
+DEFAULT_TIMEOUT = 30 * 24 * 60 * 60
+
+
+class GeocoderError(Exception):
+    pass
+
+
+def normalize_raw(raw):
+    """
+    Reduce a raw address string to the form used to cache its geocoding:
+    case folded, with runs of whitespace and commas collapsed.
+    """
+    return re.sub(r"\s*,\s*", ", ", re.sub(r"\s+", " ", raw)).strip(" ,").casefold()
+
+
+def _with_raw(components, raw):
+    # Addresses keep the string that was geocoded as their raw value.
+    return None if components is None else dict(components, raw=raw)
+
+
+##
+# Geocoders turn raw address strings into the dictionaries of components
+# accepted by `to_python`, or `None` when nothing matches.
+##
+
+
+class BaseGeocoder(object):
+    def geocode(self, raw):
+        raise NotImplementedError("Geocoders must implement geocode.")
+
+    def geocode_many(self, raws, on_error=None):
+        """
+        Geocode each of `raws`, returning results in input order. Failures
+        are passed to `on_error(index, exception)` and come back as `None`;
+        without `on_error` the first one is raised.
+        """
+        results = []
+        for index, raw in enumerate(raws):
+            try:
+                results.append(self.geocode(raw))
+            except GeocoderError as e:
+                if on_error is None:
+                    raise
+                on_error(index, e)
+                results.append(None)
+        return results
+
+
+class FakeGeocoder(BaseGeocoder):
+    """
+    Answers from a dictionary of raw strings to components, for tests and
+    development. Lookups are made on normalized strings, and each call is
+    recorded in `calls`. `delay` seconds are slept per call to stand in for
+    a remote service.
+    """
+
+    def __init__(self, results=None, delay=0):
+        self.results = {normalize_raw(raw): components for raw, components in (results or {}).items()}
+        self.delay = delay
+        self.calls = []
+
+    def geocode(self, raw):
+        self.calls.append(raw)
+        if self.delay:
+            time.sleep(self.delay)
+        return _with_raw(self.results.get(normalize_raw(raw)), raw)
+
+
+# Components taken from each Google address component type, by the long or
+# short form of its name.
+GOOGLE_COMPONENTS = (
+    ("street_number", "street_number", "long_name"),
+    ("route", "route", "long_name"),
+    ("locality", "locality", "long_name"),
+    ("sublocality", "sublocality", "long_name"),
+    ("postal_town", "postal_town", "long_name"),
+    ("postal_code", "postal_code", "long_name"),
+    ("state", "administrative_area_level_1", "long_name"),
+    ("state_code", "administrative_area_level_1", "short_name"),
+    ("country", "country", "long_name"),
+    ("country_code", "country", "short_name"),
+)
+
+
+class GoogleGeocoder(BaseGeocoder):
+    """
+    The Google Geocoding API, using `GOOGLE_API_KEY` unless another key is
+    given. Only the best match for each string is used.
+    """
+
+    url = "https://maps.googleapis.com/maps/api/geocode/json"
+
+    def __init__(self, api_key=None, timeout=10, region=None, language=None):
+        self.api_key = api_key if api_key is not None else getattr(settings, "GOOGLE_API_KEY", "")
+        self.timeout = timeout
+        self.region = region
+        self.language = language
+
+    def geocode(self, raw):
+        params = {"address": raw, "key": self.api_key}
+        if self.region:
+            params["region"] = self.region
+        if self.language:
+            params["language"] = self.language
+        try:
+            with urlopen("%s?%s" % (self.url, urlencode(params)), timeout=self.timeout) as response:
+                data = json.loads(response.read().decode("utf-8"))
+        except (URLError, OSError, ValueError) as e:
+            raise GeocoderError("Geocoding request failed: %s" % e)
+        status = data.get("status")
+        if status == "ZERO_RESULTS":
+            return None
+        if status != "OK":
+            raise GeocoderError("Geocoding failed: %s %s" % (status, data.get("error_message", "")))
+        return _with_raw(self.parse(data["results"][0]), raw)
+
+    def parse(self, result):
+        types = {}
+        for component in result.get("address_components", []):
+            for type_ in component.get("types", []):
+                types.setdefault(type_, component)
+        components = {}
+        for key, type_, name in GOOGLE_COMPONENTS:
+            if type_ in types:
+                components[key] = types[type_][name]
+        components["formatted"] = result.get("formatted_address", "")
+        location = result.get("geometry", {}).get("location")
+        if location:
+            components["latitude"] = location["lat"]
+            components["longitude"] = location["lng"]
+        return components
+
+
+class RateLimitedGeocoder(BaseGeocoder):
+    """
+    Wraps another geocoder so that calls from any number of threads start
+    no more than `rate` times a second.
+    """
+
+    def __init__(self, geocoder, rate):
+        self.geocoder = geocoder
+        self.rate = rate
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def geocode(self, raw):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return self.geocoder.geocode(raw)
+
+
+##
+# Caching, coalescing and batching around any geocoder.
+##
+
+
+_NOT_FOUND = object()
+
+
+class CachedGeocoder(BaseGeocoder):
+    """
+    Wraps another geocoder with an in-process LRU of `maxsize` results and,
+    if `cache` names one of `CACHES`, a persistent cache shared between
+    processes. Both are keyed by the normalized raw string, and strings
+    that match nothing are remembered too. Concurrent requests for the same
+    string wait for a single call to the wrapped geocoder, and
+    `geocode_many` spreads its strings over at most `workers` threads.
+    """
+
+    def __init__(self, geocoder, maxsize=1024, cache=None, timeout=DEFAULT_TIMEOUT, workers=4):
+        self.geocoder = geocoder
+        self.maxsize = maxsize
+        self.cache = cache
+        self.timeout = timeout
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def _cache_key(self, key):
+        return "address.geocode:%s" % hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def geocode(self, raw):
+        key = normalize_raw(raw)
+        if not key:
+            return None
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+            else:
+                future = self._pending.get(key)
+                owner = future is None
+                if owner:
+                    future = self._pending[key] = Future()
+        if result is None:
+            if owner:
+                try:
+                    result = self._fetch(key, raw)
+                except BaseException as e:
+                    future.set_exception(e)
+                    raise
+                else:
+                    future.set_result(result)
+                finally:
+                    with self._lock:
+                        del self._pending[key]
+            else:
+                result = future.result()
+        return None if result is _NOT_FOUND else _with_raw(result, raw)
+
+    def _fetch(self, key, raw):
+        result = None
+        if self.cache:
+            stored = caches[self.cache].get(self._cache_key(key))
+            if stored is not None:
+                result = stored or _NOT_FOUND
+        if result is None:
+            result = self.geocoder.geocode(raw)
+            if result is None:
+                result = _NOT_FOUND
+            else:
+                result = {k: v for k, v in result.items() if k != "raw"}
+            if self.cache:
+                caches[self.cache].set(self._cache_key(key), {} if result is _NOT_FOUND else result, self.timeout)
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    def geocode_many(self, raws, on_error=None):
+        raws = list(raws)
+        if self.workers <= 1 or len(raws) <= 1:
+            return super(CachedGeocoder, self).geocode_many(raws, on_error)
+
+        def geocode(raw):
+            try:
+                return self.geocode(raw), None
+            except GeocoderError as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(raws))) as pool:
+            outcomes = list(pool.map(geocode, raws))
+        results = []
+        for index, (result, error) in enumerate(outcomes):
+            if error is not None:
+                if on_error is None:
+                    raise error
+                on_error(index, error)
+            results.append(result)
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+##
+# The geocoder configured in `ADDRESS_GEOCODER`.
+##
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    """
+    The geocoder described by the `ADDRESS_GEOCODER` setting, created on
+    first use and shared by the process:
+
+        ADDRESS_GEOCODER = {
+            "BACKEND": "address.geocoders.GoogleGeocoder",
+            "OPTIONS": {"region": "au"},
+            "CACHE": "default",
+        }
+
+    `MAX_SIZE`, `TIMEOUT` and `WORKERS` configure the `CachedGeocoder`
+    wrapped around the backend, and `RATE` limits the backend to that many
+    requests a second.
+    """
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None:
+            config = getattr(settings, "ADDRESS_GEOCODER", None)
+            if not config or "BACKEND" not in config:
+                raise ImproperlyConfigured("ADDRESS_GEOCODER must name a geocoder BACKEND.")
+            backend = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+            if config.get("RATE"):
+                backend = RateLimitedGeocoder(backend, config["RATE"])
+            _geocoder = CachedGeocoder(
+                backend,
+                maxsize=config.get("MAX_SIZE", 1024),
+                cache=config.get("CACHE"),
+                timeout=config.get("TIMEOUT", DEFAULT_TIMEOUT),
+                workers=config.get("WORKERS", 4),
+            )
+        return _geocoder
+
+
+@receiver(setting_changed, dispatch_uid="address_geocoder_setting_changed")
+def reset_geocoder(setting, **kwargs):
+    global _geocoder
+    if setting == "ADDRESS_GEOCODER":
+        with _geocoder_lock:
+            _geocoder = None
@@ -0,0 +1,94 @@
+##
+# Geohash encoding of coordinates. A geohash names a cell of a grid
+# covering the Earth, and every character added to it narrows the cell
+# down by a factor of 32, so addresses sharing a prefix are close together.
+##
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Number of characters stored for each address, a cell of a few centimetres.
+PRECISION = 12
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def bbox(geohash):
+    """
+    The cell named by `geohash`, as `(south, west, north, east)`.
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def neighbours(geohash):
+    """
+    The cells surrounding `geohash` at the same precision. Cells wrap around
+    the antimeridian; there are none beyond the poles.
+    """
+    south, west, north, east = bbox(geohash)
+    height = north - south
+    width = east - west
+    latitude = (south + north) / 2
+    longitude = (west + east) / 2
+    cells = []
+    for dlat in (-1, 0, 1):
+        lat = latitude + dlat * height
+        if not -90 < lat < 90:
+            continue
+        for dlng in (-1, 0, 1):
+            if dlat or dlng:
+                lng = (longitude + dlng * width + 180) % 360 - 180
+                cells.append(encode(lat, lng, len(geohash)))
+    return cells
+
+
+def prefix_range(prefix):
+    """
+    Bounds `(low, high)` such that `low <= geohash < high` exactly when
+    `geohash` starts with `prefix`. `high` is `None` if there is no upper
+    bound. Only geohash characters are used, so the bounds compare the same
+    way under any collation.
+    """
+    chars = list(prefix)
+    while chars:
+        index = BASE32.index(chars[-1])
+        if index + 1 < len(BASE32):
+            chars[-1] = BASE32[index + 1]
+            return prefix, "".join(chars)
+        chars.pop()
+    return prefix, None
@@ -0,0 +1,281 @@
+import sys
+import threading
+from array import array
+from collections import namedtuple
+
+from django.db import transaction
+
+from .models import Country, Locality, State
+from .normalize import fold
+
+__all__ = ["LocalityIndex", "LocalityRow", "get_locality_index", "postal_code_key"]
+
+# A locality with its state and country, as returned by `LocalityIndex`.
+LocalityRow = namedtuple(
+    "LocalityRow",
+    "id name postal_code state_id state_name state_code country_id country_name country_code",
+)
+
+
+def postal_code_key(postal_code):
+    """
+    The form postal codes are looked up by: folded and without spaces, so
+    that "sw1a 1aa" finds "SW1A 1AA".
+    """
+    return "".join(fold(postal_code).split())
+
+
+def _add(mapping, key, row):
+    # Most keys have a single row, which is stored on its own rather than
+    # in a tuple to save memory.
+    rows = mapping.get(key)
+    if rows is None:
+        mapping[key] = row
+    elif isinstance(rows, tuple):
+        mapping[key] = rows + (row,)
+    else:
+        mapping[key] = (rows, row)
+
+
+def _remove(mapping, key, row):
+    rows = mapping.get(key)
+    if rows == row:
+        del mapping[key]
+    elif isinstance(rows, tuple):
+        rows = tuple(r for r in rows if r != row)
+        mapping[key] = rows[0] if len(rows) == 1 else rows
+
+
+def _rows(mapping, key):
+    rows = mapping.get(key, ())
+    return rows if isinstance(rows, tuple) else (rows,)
+
+
+##
+# Every locality held in memory, for code that looks localities up by postal
+# code or name far more often than they change.
+##
+
+
+class LocalityIndex(object):
+    """
+    Localities held column-wise: ids and state ids in arrays of integers,
+    and names and postal codes in lists of interned strings, so repeated
+    values are stored once and no model instances are kept. Dictionaries
+    from each postal code, and from each state and name, to row numbers
+    make every lookup a constant time operation. States and countries are
+    kept as small tuples by id.
+
+    Build one with `LocalityIndex.load`, or use the shared index from
+    `get_locality_index`, which signals and address conversions keep up
+    to date.
+    """
+
+    def __init__(self, localities=(), states=(), countries=()):
+        self._lock = threading.RLock()
+        self._ids = array("q")
+        self._state_ids = array("q")
+        self._names = []
+        self._postal_codes = []
+        self._rows = {}
+        self._free = []
+        self._by_postal_code = {}
+        self._by_name = {}
+        self._states = {}
+        self._state_keys = {}
+        self._countries = {}
+        for row in countries:
+            self.put_country(*row)
+        for row in states:
+            self.put_state(*row)
+        for row in localities:
+            self.put_locality(*row)
+
+    @classmethod
+    def load(cls, using=None, chunk_size=10000):
+        """
+        Index every locality, state and country in the database.
+        """
+        countries = Country.objects.using(using).values_list("pk", "name", "code")
+        states = State.objects.using(using).values_list("pk", "name", "code", "country_id")
+        localities = Locality.objects.using(using).order_by().values_list("pk", "name", "postal_code", "state_id")
+        return cls(localities.iterator(chunk_size=chunk_size), states, countries)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _row(self, row):
+        pk = self._ids[row]
+        state_id = self._state_ids[row]
+        state_name, state_code, country_id = self._states.get(state_id, ("", "", None))
+        country_name, country_code = self._countries.get(country_id, ("", ""))
+        return LocalityRow(
+            pk,
+            self._names[row],
+            self._postal_codes[row],
+            state_id,
+            state_name,
+            state_code,
+            country_id,
+            country_name,
+            country_code,
+        )
+
+    def _state_ids_for(self, state):
+        if isinstance(state, State):
+            return (state.pk,)
+        if isinstance(state, int):
+            return (state,)
+        return self._state_keys.get(fold(state), ())
+
+    def get(self, pk):
+        """
+        The locality with primary key `pk`, or `None`.
+        """
+        with self._lock:
+            row = self._rows.get(pk)
+            return None if row is None else self._row(row)
+
+    def by_postal_code(self, postal_code, state=None):
+        """
+        The localities with `postal_code`, in any state or only in `state`,
+        which may be a `State`, its primary key, or its name or code.
+        """
+        with self._lock:
+            rows = _rows(self._by_postal_code, postal_code_key(postal_code))
+            if state is not None:
+                state_ids = self._state_ids_for(state)
+                rows = [row for row in rows if self._state_ids[row] in state_ids]
+            return [self._row(row) for row in rows]
+
+    def by_name_state(self, name, state):
+        """
+        The localities called `name`, ignoring case and accents, in `state`,
+        which may be a `State`, its primary key, or its name or code. There
+        is more than one when the name is shared by several postal codes.
+        """
+        key = fold(name)
+        with self._lock:
+            rows = []
+            for state_id in self._state_ids_for(state):
+                rows.extend(_rows(self._by_name.get(state_id, {}), key))
+            return [self._row(row) for row in rows]
+
+    def put_locality(self, pk, name, postal_code, state_id):
+        """
+        Add a locality, or replace the one with the same primary key.
+        """
+        with self._lock:
+            self.remove_locality(pk)
+            name = sys.intern(name)
+            postal_code = sys.intern(postal_code)
+            if self._free:
+                row = self._free.pop()
+                self._ids[row] = pk
+                self._state_ids[row] = state_id
+                self._names[row] = name
+                self._postal_codes[row] = postal_code
+            else:
+                row = len(self._ids)
+                self._ids.append(pk)
+                self._state_ids.append(state_id)
+                self._names.append(name)
+                self._postal_codes.append(postal_code)
+            self._rows[pk] = row
+            _add(self._by_postal_code, sys.intern(postal_code_key(postal_code)), row)
+            _add(self._by_name.setdefault(state_id, {}), sys.intern(fold(name)), row)
+
+    def remove_locality(self, pk):
+        with self._lock:
+            row = self._rows.pop(pk, None)
+            if row is None:
+                return
+            _remove(self._by_postal_code, postal_code_key(self._postal_codes[row]), row)
+            _remove(self._by_name.get(self._state_ids[row], {}), fold(self._names[row]), row)
+            # Emptied rows are reused by the next locality added.
+            self._names[row] = self._postal_codes[row] = ""
+            self._free.append(row)
+
+    def put_state(self, pk, name, code, country_id):
+        with self._lock:
+            self.remove_state(pk, localities=False)
+            self._states[pk] = (sys.intern(name), sys.intern(code), country_id)
+            for key in {fold(name), fold(code)} - {""}:
+                self._state_keys[key] = self._state_keys.get(key, ()) + (pk,)
+
+    def remove_state(self, pk, localities=True):
+        with self._lock:
+            old = self._states.pop(pk, None)
+            if old is not None:
+                for key in {fold(old[0]), fold(old[1])} - {""}:
+                    ids = tuple(i for i in self._state_keys.get(key, ()) if i != pk)
+                    if ids:
+                        self._state_keys[key] = ids
+                    else:
+                        self._state_keys.pop(key, None)
+            if localities:
+                names = self._by_name.get(pk, {})
+                for locality_pk in [self._ids[row] for key in list(names) for row in _rows(names, key)]:
+                    self.remove_locality(locality_pk)
+                self._by_name.pop(pk, None)
+
+    def put_country(self, pk, name, code):
+        with self._lock:
+            self._countries[pk] = (sys.intern(name), sys.intern(code))
+
+    def remove_country(self, pk):
+        with self._lock:
+            self._countries.pop(pk, None)
+            for state_id in [i for i, state in self._states.items() if state[2] == pk]:
+                self.remove_state(state_id)
+
+
+##
+# The index shared by the process.
+##
+
+
+_locality_index = None
+_locality_index_lock = threading.Lock()
+
+
+def get_locality_index():
+    """
+    The shared `LocalityIndex`, loaded on first use and kept up to date by
+    the signals in `address.signals` as localities, states and countries
+    are saved and deleted in this process, and as address conversions
+    insert them in bulk. Call it while starting up, for
+    instance in `wsgi.py`, to load it ahead of the first request.
+    """
+    global _locality_index
+    with _locality_index_lock:
+        if _locality_index is None:
+            _locality_index = LocalityIndex.load()
+        return _locality_index
+
+
+def loaded_locality_index():
+    """
+    The shared index if it has been loaded, or `None`.
+    """
+    return _locality_index
+
+
+def reset_locality_index():
+    """
+    Drop the shared index, so the next use loads it again, for instance
+    after localities were changed with `QuerySet.update`.
+    """
+    global _locality_index
+    with _locality_index_lock:
+        _locality_index = None
+
+
+def _update_locality_index(using, method, *args):
+    """
+    Call `method` of the shared index with `args` once the current
+    transaction commits, if the index has been loaded.
+    """
+    index = _locality_index
+    if index is not None:
+        transaction.on_commit(lambda: getattr(index, method)(*args), using=using)
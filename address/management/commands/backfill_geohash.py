@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from address.models import Address, _geohash
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in the geohash of addresses with coordinates, as used by `Address.objects.nearest`. "
+        "Addresses are updated in chunks in primary key order, so the command can be interrupted "
+        "and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Number of rows updated at a time.")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute every geohash, not just missing ones. Use after changing coordinates "
+            "with `QuerySet.update`.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        addresses = (
+            Address.objects.exclude(latitude=None)
+            .exclude(longitude=None)
+            .only("pk", "latitude", "longitude", "geohash")
+            .order_by("pk")
+        )
+        if not options["all"]:
+            addresses = addresses.filter(geohash="")
+
+        updated = 0
+        last_pk = None
+        while True:
+            batch = list((addresses if last_pk is None else addresses.filter(pk__gt=last_pk))[:chunk_size])
+            if not batch:
+                break
+            changed = []
+            for address in batch:
+                value = _geohash(address.latitude, address.longitude)
+                if value != address.geohash:
+                    address.geohash = value
+                    changed.append(address)
+            Address.objects.bulk_update(changed, ["geohash"])
+            updated += len(changed)
+            last_pk = batch[-1].pk
+
+        self.stdout.write("Updated the geohash of %d addresses." % updated)
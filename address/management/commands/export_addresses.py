@@ -0,0 +1,56 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from address.models import Address, AddressQuerySet
+
+
+class Command(BaseCommand):
+    help = (
+        "Export all addresses as CSV or JSON-lines, one row per address with the keys of "
+        "`Address.as_dict`. Rows are streamed, so memory use doesn't grow with the table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("-o", "--output", help="File to write to. Defaults to standard output.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "jsonl"),
+            help="Output format. Defaults to the output file extension, or jsonl.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Number of rows fetched at a time.")
+
+    def handle(self, *args, **options):
+        path = options["output"]
+        fmt = options["format"] or ("csv" if path and path.lower().endswith(".csv") else "jsonl")
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        if path:
+            try:
+                outfile = open(path, "w", encoding="utf-8", newline="")
+            except OSError as e:
+                raise CommandError("Unable to open %s: %s" % (path, e))
+        else:
+            outfile = self.stdout
+
+        # Export in primary key order to avoid sorting by the default
+        # ordering, which needs the whole hierarchy.
+        rows = Address.objects.order_by("pk").as_dicts(chunk_size=options["chunk_size"])
+        count = 0
+        try:
+            if fmt == "csv":
+                writer = csv.DictWriter(outfile, fieldnames=[k for k, _ in AddressQuerySet.dict_fields])
+                writer.writeheader()
+                for count, ad in enumerate(rows, 1):
+                    writer.writerow(ad)
+            else:
+                for count, ad in enumerate(rows, 1):
+                    outfile.write(json.dumps(ad) + "\n")
+        finally:
+            if path:
+                outfile.close()
+
+        if path:
+            self.stdout.write("Exported %d addresses to %s." % (count, path))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+
+from address.models import Address, Locality, _addresses_changed, _formatted_expression, _locality_strings
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in the `formatted` value of addresses that have a locality but no formatted value, "
+        "as `str()` would build it. Run once after enabling ADDRESS_SYNC_FORMATTED."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=500, help="Number of localities, or addresses, handled at a time."
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        pks = sorted(
+            Address.objects.filter(formatted="")
+            .exclude(locality=None)
+            .order_by()
+            .values_list("locality_id", flat=True)
+            .distinct()
+        )
+        db = router.db_for_write(Address)
+        updated = 0
+        for start in range(0, len(pks), chunk_size):
+            end = start + chunk_size
+            with transaction.atomic(using=db):
+                localities = _locality_strings(Locality.objects.filter(pk__in=pks[start:end]))
+                changed = []
+                for pk, locality in localities.items():
+                    addresses = Address.objects.filter(locality_id=pk, formatted="")
+                    changed.extend(addresses.values_list("pk", flat=True))
+                    updated += addresses.update(formatted=_formatted_expression(locality))
+                # Updating sends no signals, so bring the search index, the
+                # autocomplete suggestions and the shared cache up to date.
+                for i in range(0, len(changed), chunk_size):
+                    addresses = Address.objects.filter(pk__in=changed[i:][:chunk_size])
+                    _addresses_changed(list(addresses.only("pk", "raw", "formatted")), db)
+
+        self.stdout.write("Filled in the formatted value of %d addresses." % updated)
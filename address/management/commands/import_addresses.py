@@ -0,0 +1,199 @@
+import csv
+import io
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+
+from address.geocoders import get_geocoder
+from address.models import to_python_many
+
+PROGRESS_INTERVAL = 5
+
+# Rows with any of these are imported as they are, even with `--geocode`.
+GEOCODED_FIELDS = ("street_number", "route", "locality", "sublocality", "postal_town", "state", "country")
+
+
+class Command(BaseCommand):
+    help = (
+        "Import addresses from a CSV or JSON-lines file of address components. Rows are resolved in "
+        "chunks, each in its own transaction, and rows that can't be imported are written to a "
+        "rejects file instead of aborting the run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help='File to import, or "-" to read from standard input.')
+        parser.add_argument(
+            "--format",
+            choices=("csv", "jsonl"),
+            help="Input format. Defaults to the file extension, or jsonl when reading standard input.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Number of rows per transaction.")
+        parser.add_argument("--rejects", help="Write rejected rows to this JSON-lines file.")
+        parser.add_argument("--encoding", default="utf-8")
+        parser.add_argument(
+            "--geocode",
+            action="store_true",
+            help="Geocode rows with only a raw address using the ADDRESS_GEOCODER setting.",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive.")
+        self.verbosity = options["verbosity"]
+        self.geocoder = get_geocoder() if options["geocode"] else None
+
+        if path == "-":
+            infile = io.TextIOWrapper(sys.stdin.buffer, encoding=options["encoding"], newline="")
+        else:
+            try:
+                infile = open(path, encoding=options["encoding"], newline="")
+            except OSError as e:
+                raise CommandError("Unable to open %s: %s" % (path, e))
+        rejects = open(options["rejects"], "w", encoding="utf-8") if options["rejects"] else None
+
+        self.imported = 0
+        self.rejected = 0
+        self.started = self.reported = time.time()
+        try:
+            chunk = []
+            for line, row in self.read_rows(infile, fmt):
+                chunk.append((line, row))
+                if len(chunk) >= chunk_size:
+                    self.import_chunk(chunk, rejects)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk, rejects)
+        finally:
+            if path != "-":
+                infile.close()
+            if rejects is not None:
+                rejects.close()
+
+        self.stdout.write(
+            "Imported %d addresses, rejected %d, in %.1fs (%s rows/s)."
+            % (self.imported, self.rejected, time.time() - self.started, self.rate())
+        )
+
+    def read_rows(self, infile, fmt):
+        """
+        Yield `(line number, row)` pairs, or `(line number, exception)` for
+        lines that can't be parsed.
+        """
+        if fmt == "csv":
+            reader = csv.DictReader(infile)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line, text in enumerate(infile, 1):
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                    if not isinstance(row, dict):
+                        raise ValueError("Expected a JSON object.")
+                except ValueError as e:
+                    yield line, e
+                else:
+                    yield line, row
+
+    def clean_row(self, row):
+        if isinstance(row, Exception):
+            raise row
+        row = {k: v for k, v in row.items() if v is not None}
+        for field, value in row.items():
+            if field in ("latitude", "longitude") or isinstance(value, str):
+                continue
+            # JSON rows may give postcodes and street numbers as numbers.
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                row[field] = str(value)
+            else:
+                raise ValueError("Invalid value for %s: %s" % (field, json.dumps(value)))
+        if not row.get("raw"):
+            raise ValueError("Missing raw address.")
+        for field in ("latitude", "longitude"):
+            value = row.get(field)
+            if value in ("", None):
+                row[field] = None
+            else:
+                try:
+                    row[field] = float(value)
+                except (TypeError, ValueError):
+                    raise ValueError("Invalid value for %s: %s" % (field, value))
+        return row
+
+    def import_chunk(self, chunk, rejects):
+        values = []
+        accepted = []
+        rejected = []
+        for line, row in chunk:
+            try:
+                values.append(self.clean_row(row))
+                accepted.append((line, row))
+            except ValueError as e:
+                rejected.append((line, row, e))
+        if self.geocoder is not None:
+            values, accepted = self.geocode(values, accepted, rejected)
+
+        errors = []
+        try:
+            with transaction.atomic():
+                to_python_many(values, strict=True, on_error=lambda index, exc: errors.append((index, exc)))
+        except DatabaseError:
+            # Something in the chunk upset the database; retry one row at a
+            # time to find the culprits.
+            errors = []
+            for index, value in enumerate(values):
+                try:
+                    with transaction.atomic():
+                        to_python_many([value], strict=True, on_error=lambda _, exc: errors.append((index, exc)))
+                except DatabaseError as e:
+                    errors.append((index, e))
+
+        rejected.extend(accepted[index] + (exc,) for index, exc in errors)
+        for line, row, exc in sorted(rejected, key=lambda r: r[0]):
+            self.reject(rejects, line, row, exc)
+        self.imported += len(values) - len(errors)
+
+        # Report progress every few seconds, or after every chunk if asked.
+        now = time.time()
+        if self.verbosity > 1 or (self.verbosity > 0 and now - self.reported >= PROGRESS_INTERVAL):
+            self.reported = now
+            self.stdout.write("%d imported, %d rejected (%s rows/s)" % (self.imported, self.rejected, self.rate()))
+
+    def geocode(self, values, accepted, rejected):
+        """
+        Replace rows that have nothing but a raw address with their geocoded
+        components. Rows the geocoder fails on are rejected; rows it can't
+        match are kept as raw addresses.
+        """
+        indices = [i for i, value in enumerate(values) if not any(value.get(k) for k in GEOCODED_FIELDS)]
+        failed = {}
+        results = self.geocoder.geocode_many(
+            [values[i]["raw"] for i in indices], on_error=lambda index, exc: failed.setdefault(indices[index], exc)
+        )
+        for i, result in zip(indices, results):
+            if result is not None:
+                values[i] = result
+        rejected.extend(accepted[i] + (exc,) for i, exc in failed.items())
+        keep = [i for i in range(len(values)) if i not in failed]
+        return [values[i] for i in keep], [accepted[i] for i in keep]
+
+    def reject(self, rejects, line, row, exc):
+        self.rejected += 1
+        error = str(exc) or exc.__class__.__name__
+        if rejects is not None:
+            if isinstance(row, Exception):
+                row = None
+            rejects.write(json.dumps({"line": line, "error": error, "row": row}) + "\n")
+        if self.verbosity > 2:
+            self.stderr.write("Rejected line %d: %s" % (line, error))
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return "%.0f" % ((self.imported + self.rejected) / elapsed) if elapsed > 0 else "-"
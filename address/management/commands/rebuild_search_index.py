@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from address.models import Address, AddressTrigram
+from address.search import _frequencies, index_addresses, search_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the trigram table searched by `Address.objects.search` when ADDRESS_SEARCH_INDEX is "
+        "set. Use after enabling the setting, or after changing addresses with `QuerySet.update`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Number of addresses indexed at a time.")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive.")
+        backend = search_backend()
+        if backend == "pg_trgm":
+            self.stdout.write("Addresses are searched with pg_trgm, which needs no rebuilding.")
+            return
+        if backend is None:
+            raise CommandError("Set ADDRESS_SEARCH_INDEX = True to search addresses without pg_trgm.")
+
+        AddressTrigram.objects.all().delete()
+
+        addresses = Address.objects.only("pk", "raw", "formatted").order_by("pk")
+        indexed = 0
+        last_pk = None
+        while True:
+            batch = list((addresses if last_pk is None else addresses.filter(pk__gt=last_pk))[:chunk_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                index_addresses(batch, replace=False)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+
+        _frequencies.clear()
+        self.stdout.write("Indexed %d addresses for search." % indexed)
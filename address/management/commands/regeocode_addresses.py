@@ -0,0 +1,199 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from address.geocoders import CachedGeocoder, RateLimitedGeocoder, get_geocoder
+from address.models import (
+    Address,
+    InconsistentDictError,
+    _addresses_changed,
+    _canonical_key,
+    _components,
+    _geohash,
+    _resolve_hierarchy_many,
+)
+
+PROGRESS_INTERVAL = 5
+
+# Requests a second when neither --rate nor the geocoder's RATE is given.
+DEFAULT_RATE = 10
+
+# The most addresses kept in the checkpoint to retry after geocoder errors,
+# which is rewritten after every chunk. Any more are counted as failed.
+MAX_RETRY = 10000
+
+# Fields rewritten on each geocoded address.
+UPDATE_FIELDS = (
+    "street_number",
+    "route",
+    "locality",
+    "canonical_key",
+    "formatted",
+    "latitude",
+    "longitude",
+    "geohash",
+    "modified",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Geocode addresses without a locality, such as raw strings saved from imports, using the "
+        "ADDRESS_GEOCODER setting. Addresses are processed in chunks in primary key order, each "
+        "chunk in its own transaction, and with --checkpoint an interrupted run picks up where it "
+        "left off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=100, help="Number of addresses per transaction.")
+        parser.add_argument(
+            "--rate",
+            type=float,
+            help="Maximum geocoding requests a second, or 0 for no limit. Defaults to the geocoder's RATE, or %d."
+            % DEFAULT_RATE,
+        )
+        parser.add_argument("--workers", type=int, help="Number of concurrent geocoding requests.")
+        parser.add_argument("--checkpoint", help="JSON file recording progress, read on start when it exists.")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint.")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive.")
+        if options["rate"] is not None and options["rate"] < 0:
+            raise CommandError("--rate can't be negative.")
+        self.verbosity = options["verbosity"]
+
+        # Rate limit calls to the backend, not lookups answered by the cache,
+        # replacing the geocoder's own limit so the two don't add up.
+        configured = get_geocoder()
+        backend = configured.geocoder
+        rate = options["rate"]
+        if isinstance(backend, RateLimitedGeocoder):
+            rate = backend.rate if rate is None else rate
+            backend = backend.geocoder
+        rate = DEFAULT_RATE if rate is None else rate
+        if rate:
+            backend = RateLimitedGeocoder(backend, rate)
+        self.geocoder = CachedGeocoder(
+            backend,
+            maxsize=configured.maxsize,
+            cache=configured.cache,
+            timeout=configured.timeout,
+            workers=options["workers"] or configured.workers,
+        )
+
+        self.checkpoint = options["checkpoint"]
+        self.state = {"last_pk": None, "updated": 0, "unmatched": 0, "failed": 0, "retry": []}
+        if self.checkpoint and os.path.exists(self.checkpoint) and not options["restart"]:
+            try:
+                with open(self.checkpoint) as f:
+                    self.state.update(json.load(f))
+            except (OSError, ValueError) as e:
+                raise CommandError("Unable to read checkpoint %s: %s" % (self.checkpoint, e))
+            if self.verbosity > 0:
+                self.stdout.write("Resuming after address %s." % self.state["last_pk"])
+
+        addresses = Address.objects.filter(locality=None).exclude(raw="").order_by("pk")
+        self.started = self.reported = time.time()
+        self.processed = 0
+        while True:
+            last_pk = self.state["last_pk"]
+            batch = list((addresses if last_pk is None else addresses.filter(pk__gt=last_pk))[:chunk_size])
+            if not batch:
+                break
+            errors = self.geocode_chunk(batch)
+            room = max(MAX_RETRY - len(self.state["retry"]), 0)
+            self.state["retry"].extend(errors[:room])
+            self.state["failed"] += len(errors[room:])
+            self.state["last_pk"] = batch[-1].pk
+            self.save_checkpoint()
+
+        # Geocoder errors are often temporary, such as going over a quota, so
+        # up to MAX_RETRY of those addresses are tried once more, and stay in
+        # the checkpoint for the next run until they succeed.
+        retry, failed = self.state["retry"], []
+        while retry:
+            pks, retry = retry[:chunk_size], retry[chunk_size:]
+            batch = list(addresses.filter(pk__in=pks))
+            if batch:
+                failed.extend(self.geocode_chunk(batch))
+            self.state["retry"] = failed + retry
+            self.save_checkpoint()
+
+        self.stdout.write(
+            "Updated %d addresses, %d unmatched, %d failed."
+            % (self.state["updated"], self.state["unmatched"], self.state["failed"] + len(self.state["retry"]))
+        )
+
+    def geocode_chunk(self, batch):
+        """
+        Geocode and update a chunk of addresses, returning the primary keys
+        of those the geocoder failed on.
+        """
+        errors = set()
+        results = self.geocoder.geocode_many([a.raw for a in batch], on_error=lambda index, _: errors.add(index))
+        failed = set()
+        rows = []
+        for index, result in enumerate(results):
+            if index in errors:
+                continue
+            try:
+                c = _components(result) if result is not None else None
+            except InconsistentDictError:
+                c = None
+            if c is None or not c.locality:
+                self.state["unmatched"] += 1
+            else:
+                rows.append((index, c))
+
+        def fail(index, exc):
+            failed.add(index)
+
+        now = timezone.now()
+        with transaction.atomic():
+            resolved = _resolve_hierarchy_many(rows, fail)
+            changed = []
+            for index, c, locality_obj in resolved:
+                address = batch[index]
+                address.street_number = c.street_number
+                address.route = c.route
+                address.locality = locality_obj
+                address.canonical_key = _canonical_key(c.street_number, c.route, locality_obj.pk, address.raw)
+                if c.latitude is not None and c.longitude is not None:
+                    address.latitude, address.longitude = c.latitude, c.longitude
+                address.geohash = _geohash(address.latitude, address.longitude)
+                address.formatted = c.formatted or str(address)
+                address.modified = now
+                changed.append(address)
+            Address.objects.bulk_update(changed, UPDATE_FIELDS)
+            _addresses_changed(changed, Address.objects.db)
+
+        self.state["updated"] += len(changed)
+        self.state["failed"] += len(failed)
+        self.processed += len(batch)
+
+        # Report progress every few seconds, or after every chunk if asked.
+        now = time.time()
+        if self.verbosity > 1 or (self.verbosity > 0 and now - self.reported >= PROGRESS_INTERVAL):
+            self.reported = now
+            elapsed = now - self.started
+            self.stdout.write(
+                "%d processed, %d updated (%.0f addresses/s)"
+                % (self.processed, self.state["updated"], self.processed / elapsed if elapsed > 0 else 0)
+            )
+        return [batch[index].pk for index in sorted(errors)]
+
+    def save_checkpoint(self):
+        if not self.checkpoint:
+            return
+        # Write a new file and move it into place, so an interruption never
+        # leaves a partial checkpoint behind.
+        path = self.checkpoint + ".tmp"
+        with open(path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(path, self.checkpoint)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from address.regions import reference_regions, seed_regions
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the ISO 3166-1 countries and top level ISO 3166-2 states shipped with django-address, "
+        "and correct the codes of those already stored, matching them by name or code. Run it again "
+        "at any time; rows that already match are left alone. Set ADDRESS_SEEDED_REGIONS = True to "
+        "resolve submitted addresses against the seeded rows without writing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--country",
+            action="append",
+            dest="countries",
+            metavar="CODE",
+            help="Only seed the country with this ISO code, and its states. May be given more than once.",
+        )
+        parser.add_argument("--database", default=None, help="Database to seed.")
+
+    def handle(self, *args, **options):
+        countries = options["countries"]
+        if countries:
+            known = set(code for code, _ in reference_regions()[0])
+            unknown = sorted(set(code.upper() for code in countries) - known)
+            if unknown:
+                raise CommandError("Unknown country codes: %s" % ", ".join(unknown))
+        counts = seed_regions(using=options["database"], countries=countries)
+        self.stdout.write("Created %d and updated %d countries, created %d and updated %d states." % counts)
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:32
+
+from django.db import DatabaseError, migrations, models, transaction
+
+# Columns searched by `AddressAdmin`. Django implements `icontains` on
+# PostgreSQL as `UPPER(column::text) LIKE UPPER(...)`, which a trigram index
+# over the same expression can serve.
+TRIGRAM_COLUMNS = ("street_number", "route", "raw")
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    # Creating the extension needs elevated privileges; carry on without the
+    # indexes rather than failing the migration if we don't have them.
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DatabaseError:
+        return
+
+    for column in TRIGRAM_COLUMNS:
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS address_address_%s_trgm ON address_address "
+            "USING gin ((UPPER(%s::text)) gin_trgm_ops)" % (column, column)
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for column in TRIGRAM_COLUMNS:
+        schema_editor.execute("DROP INDEX IF EXISTS address_address_%s_trgm" % column)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address", "0003_auto_20200830_1851"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="address",
+            index=models.Index(fields=["locality", "route", "street_number"], name="address_locality_route_idx"),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
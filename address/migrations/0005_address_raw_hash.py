@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address", "0004_address_indexes"),
+    ]
+
+    operations = [
+        # Filled in for existing rows by 0009, along with canonical_key.
+        migrations.AddField(
+            model_name="address",
+            name="raw_hash",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=40),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address", "0005_address_raw_hash"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="address",
+            index=models.Index(fields=["latitude", "longitude"], name="address_coordinates_idx"),
+        ),
+    ]
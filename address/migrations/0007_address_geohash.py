@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address", "0006_address_coordinates_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="geohash",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+    ]
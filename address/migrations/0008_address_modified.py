@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address", "0007_address_geohash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="modified",
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,233 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:10
+
+import hashlib
+import re
+import unicodedata
+from functools import lru_cache
+
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+##
+# A frozen copy of `address.normalize` as of this migration, so that later
+# changes to the rules don't change what it computes. Changing the rules
+# needs a new migration with its own copy.
+##
+
+# Letters without a decomposition that still have a plain ASCII spelling.
+FOLDED_LETTERS = str.maketrans({"ø": "o", "æ": "ae", "œ": "oe", "đ": "d", "ð": "d", "ł": "l", "þ": "th", "ı": "i"})
+
+# Words abbreviated the same way wherever they appear.
+ABBREVIATIONS = {
+    "apt": "apartment",
+    "bldg": "building",
+    "fl": "floor",
+    "flr": "floor",
+    "ft": "fort",
+    "lvl": "level",
+    "mt": "mount",
+    "ste": "suite",
+}
+
+# Street types, only expanded as the last word of a route so that "St Kilda
+# Rd" becomes "st kilda road" rather than "street kilda road".
+STREET_TYPES = {
+    "aly": "alley",
+    "av": "avenue",
+    "ave": "avenue",
+    "blvd": "boulevard",
+    "bvd": "boulevard",
+    "cct": "circuit",
+    "cir": "circle",
+    "cl": "close",
+    "cr": "crescent",
+    "cres": "crescent",
+    "crt": "court",
+    "ct": "court",
+    "dr": "drive",
+    "drv": "drive",
+    "esp": "esplanade",
+    "expy": "expressway",
+    "fwy": "freeway",
+    "gr": "grove",
+    "gv": "grove",
+    "hts": "heights",
+    "hwy": "highway",
+    "ln": "lane",
+    "pde": "parade",
+    "pkwy": "parkway",
+    "pl": "place",
+    "plz": "plaza",
+    "rd": "road",
+    "sq": "square",
+    "st": "street",
+    "str": "street",
+    "tce": "terrace",
+    "ter": "terrace",
+    "trl": "trail",
+    "wy": "way",
+}
+
+_STREET_TYPE_WORDS = frozenset(STREET_TYPES) | frozenset(STREET_TYPES.values())
+
+# Compass points, expanded at the start of a route or after its street type,
+# but not when the only other word is the street type, so lettered streets
+# such as "E St", "N Street NW" and "Avenue N" keep their letter.
+DIRECTIONS = {
+    "n": "north",
+    "s": "south",
+    "e": "east",
+    "w": "west",
+    "ne": "northeast",
+    "nw": "northwest",
+    "se": "southeast",
+    "sw": "southwest",
+}
+
+_APOSTROPHES = re.compile(r"['’`]")
+_SEPARATORS = re.compile(r"[^0-9a-z/\-,#]+")
+_SPACED_PUNCTUATION = re.compile(r"\s*([/\-,])\s*")
+
+# A unit written before the street number: "Unit 3, 12", "Apt 4B 12",
+# "#5 12" or "3/12".
+_UNIT_PREFIX = re.compile(r"^(?:unit|apartment|suite|flat|shop|#)\s*([0-9a-z]+)[\s,/]+(.+)$")
+_UNIT_SLASH = re.compile(r"^([0-9a-z]+)/(.+)$")
+
+
+def fold(text):
+    """
+    Case fold `text` and strip accents, so that "Émile" and "emile" match.
+    """
+    try:
+        text.encode("ascii")
+    except UnicodeEncodeError:
+        pass
+    else:
+        # Nothing to strip, and ASCII case folds the same as it lowers.
+        return text.lower()
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).translate(FOLDED_LETTERS)
+
+
+def _words(text):
+    """
+    Fold `text` and split it into words, dropping punctuation other than
+    slashes, hyphens, commas and hashes, which are kept as separate words.
+    """
+    text = _SEPARATORS.sub(" ", _APOSTROPHES.sub("", fold(text)).replace("#", " # "))
+    return _SPACED_PUNCTUATION.sub(r" \1 ", text).split()
+
+
+def _expand(words):
+    words = [ABBREVIATIONS.get(w, w) for w in words]
+    if not words:
+        return words
+    last = len(words) - 1
+    if last > 1 and words[last] in DIRECTIONS and words[last - 1] in _STREET_TYPE_WORDS:
+        words[last] = DIRECTIONS[words[last]]
+        last -= 1
+    words[last] = STREET_TYPES.get(words[last], words[last])
+    if last and words[0] in DIRECTIONS and not (last == 1 and words[1] in _STREET_TYPE_WORDS):
+        words[0] = DIRECTIONS[words[0]]
+    return words
+
+
+@lru_cache(maxsize=65536)
+def normalize_route(route):
+    """
+    The canonical spelling of a street name: folded, without punctuation
+    or hyphens, and with abbreviated street types and compass points spelt out.
+    "N. Main St" and "North Main Street" both become "north main street".
+    """
+    return " ".join(_expand([w for w in _words(route) if w not in (",", "-")]))
+
+
+def normalize_text(text):
+    """
+    The canonical spelling of free text such as a raw address, treating
+    each comma separated part as a route.
+    """
+    parts = []
+    part = []
+    for word in _words(text) + [","]:
+        if word == ",":
+            if part:
+                parts.append(" ".join(_expand(part)))
+            part = []
+        elif word != "-":
+            part.append(word)
+    return ", ".join(parts)
+
+
+@lru_cache(maxsize=65536)
+def parse_number(street_number):
+    """
+    Split a street number into `(unit, number)`, each folded and without
+    spaces, so that "Unit 3, 12 A", "3/12a" and "3 / 12A" all give
+    `("3", "12a")`. The unit is empty when there isn't one.
+    """
+    text = _SPACED_PUNCTUATION.sub(r"\1", " ".join(ABBREVIATIONS.get(w, w) for w in _words(street_number)))
+    for pattern in (_UNIT_PREFIX, _UNIT_SLASH):
+        match = pattern.match(text)
+        if match:
+            return match.group(1), match.group(2).replace(" ", "").strip(",")
+    return "", text.replace(" ", "").strip(",")
+
+
+def _hash(*parts):
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def address_key(street_number, route, locality_id):
+    """
+    The canonical key of an address in a locality, equal for any two
+    spellings of the same street number and route.
+    """
+    unit, number = parse_number(street_number)
+    return _hash("address", unit, number, normalize_route(route), "" if locality_id is None else str(locality_id))
+
+
+def raw_key(raw):
+    """
+    The canonical key of an address known only by its raw string.
+    """
+    return _hash("raw", normalize_text(raw))
+
+
+def fill_keys(apps, schema_editor):
+    Address = apps.get_model("address", "Address")
+    addresses = (
+        Address.objects.using(schema_editor.connection.alias)
+        .only("pk", "street_number", "route", "locality_id", "raw")
+        .order_by("pk")
+    )
+    last_pk = None
+    while True:
+        batch = list((addresses if last_pk is None else addresses.filter(pk__gt=last_pk))[:BATCH_SIZE])
+        if not batch:
+            break
+        for address in batch:
+            address.raw_hash = raw_key(address.raw)
+            if address.street_number or address.route or address.locality_id is not None:
+                address.canonical_key = address_key(address.street_number, address.route, address.locality_id)
+            else:
+                address.canonical_key = address.raw_hash
+        addresses.bulk_update(batch, ["raw_hash", "canonical_key"])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address", "0008_address_modified"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="address",
+            name="canonical_key",
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=40),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:13
+
+from django.db import DatabaseError, migrations, models, transaction
+import django.db.models.deletion
+
+TRIGRAM_INDEXES = (
+    ("address_raw_trgm", "raw"),
+    ("address_formatted_trgm", "formatted"),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Address search uses pg_trgm where it is available. Installing it can
+    # need more privileges than the migration has, in which case search
+    # falls back to the AddressTrigram table.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DatabaseError:
+        return
+    for name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS %s ON address_address USING gin (%s gin_trgm_ops)" % (name, column)
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS %s" % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("address", "0009_address_canonical_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AddressTrigram",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("trigram", models.CharField(max_length=3)),
+                (
+                    "address",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="address.address"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["trigram", "address"], name="address_trigram_idx")],
+            },
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -1,7 +1,11 @@
 import logging
+import math
+from collections import OrderedDict, namedtuple
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models.functions import ASin, Concat, Cos, Least, Power, Radians, Sin, Sqrt
 
 try:
     from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
@@ -10,6 +14,11 @@ except ImportError:
         ReverseSingleRelatedObjectDescriptor as ForwardManyToOneDescriptor,
     )
 
+from . import geohash
+from .cache import address_cache, hierarchy_cache
+from .normalize import address_key, raw_key
+from .compat import can_return_rows_from_bulk_insert, can_upsert_returning_rows, is_django41, sync_to_async
+
 logger = logging.getLogger(__name__)
 
 __all__ = ["Country", "State", "Locality", "Address", "AddressField"]
@@ -19,21 +28,46 @@ class InconsistentDictError(Exception):
     pass
 
 
-def _to_python(value):
-    raw = value.get("raw", "")
-    country = value.get("country", "")
-    country_code = value.get("country_code", "")
-    state = value.get("state", "")
-    state_code = value.get("state_code", "")
-    locality = value.get("locality", "")
-    sublocality = value.get("sublocality", "")
-    postal_town = value.get("postal_town", "")
-    postal_code = value.get("postal_code", "")
-    street_number = value.get("street_number", "")
-    route = value.get("route", "")
-    formatted = value.get("formatted", "")
-    latitude = value.get("latitude", None)
-    longitude = value.get("longitude", None)
+_Components = namedtuple(
+    "_Components",
+    [
+        "raw",
+        "country",
+        "country_code",
+        "state",
+        "state_code",
+        "locality",
+        "postal_code",
+        "street_number",
+        "route",
+        "formatted",
+        "latitude",
+        "longitude",
+    ],
+)
+
+
+def _text(value, key):
+    """
+    A component of an address dictionary as a string, since imported rows
+    may give numbers such as postcodes and street numbers unquoted.
+    """
+    component = value.get(key)
+    return "" if component is None else str(component)
+
+
+def _components(value):
+    """
+    Extract the components of an address dictionary, applying the locality
+    fallbacks. Returns `None` for an empty `raw` and raises
+    `InconsistentDictError` when country, state and locality don't agree.
+    """
+    raw = _text(value, "raw")
+    country = _text(value, "country")
+    state = _text(value, "state")
+    locality = _text(value, "locality")
+    sublocality = _text(value, "sublocality")
+    postal_town = _text(value, "postal_town")
 
     # If there is no value (empty raw) then return None.
     if not raw:
@@ -52,69 +86,415 @@ def _to_python(value):
     if (country or state or locality) and not (country and state and locality):
         raise InconsistentDictError
 
-    # Handle the country.
+    return _Components(
+        raw=raw,
+        country=country,
+        country_code=_text(value, "country_code"),
+        state=state,
+        state_code=_text(value, "state_code"),
+        locality=locality,
+        postal_code=_text(value, "postal_code"),
+        street_number=_text(value, "street_number"),
+        route=_text(value, "route"),
+        formatted=_text(value, "formatted"),
+        latitude=value.get("latitude", None),
+        longitude=value.get("longitude", None),
+    )
+
+
+def _fingerprint(value):
+    """
+    Reduce an address dictionary to the components that decide which
+    address it resolves to, for comparison with `Address.fingerprint`.
+    """
     try:
-        country_obj = Country.objects.get(name=country)
-    except Country.DoesNotExist:
-        if country:
-            if len(country_code) > Country._meta.get_field("code").max_length:
-                if country_code != country:
-                    raise ValueError("Invalid country code (too long): %s" % country_code)
-                country_code = ""
-            country_obj = Country.objects.create(name=country, code=country_code)
-        else:
-            country_obj = None
+        c = _components(value)
+    except InconsistentDictError:
+        return ("raw", _text(value, "raw"))
+    if c is None:
+        return None
+    if _is_raw_only(c):
+        return ("raw", c.raw)
+    return ("address", c.country, c.state, c.locality, c.postal_code if c.locality else "", c.street_number, c.route)
+
+
+def _valid_code(model, name, code):
+    """
+    Check a country or state code will fit in `model`. Google sometimes
+    repeats the name in place of the code, in which case it is dropped.
+    """
+    if len(code) > model._meta.get_field("code").max_length:
+        if code != name:
+            raise ValueError("Invalid %s code (too long): %s" % (model._meta.model_name, code))
+        code = ""
+    return code
+
+
+def _is_raw_only(components):
+    return not (components.street_number or components.route or components.locality)
+
+
+def _new_address(components, locality_obj):
+    address_obj = Address(
+        street_number=components.street_number,
+        route=components.route,
+        raw=components.raw,
+        locality=locality_obj,
+        formatted=components.formatted,
+        latitude=components.latitude,
+        longitude=components.longitude,
+    )
 
-    # Handle the state.
+    # If "formatted" is empty try to construct it from other values.
+    if not address_obj.formatted:
+        address_obj.formatted = str(address_obj)
+
+    return address_obj
+
+
+def _canonical_key(street_number, route, locality_id, raw):
+    """
+    The indexed key addresses are matched on, which ignores differences in
+    spelling such as "St" for "Street". Addresses with nothing but a raw
+    string are keyed by that instead.
+    """
+    if street_number or route or locality_id is not None:
+        return address_key(street_number, route, locality_id)
+    return raw_key(raw)
+
+
+def _raw_hash(raw):
+    """
+    Digest of a raw address for `ADDRESS_DEDUPLICATE_RAW`. This is the same
+    `raw_key` that raw-only addresses are matched on, so "1 Somewhere St"
+    and "1 somewhere street" are the same address either way.
+    """
+    return raw_key(raw)
+
+
+def _geohash(latitude, longitude):
     try:
-        state_obj = State.objects.get(name=state, country=country_obj)
-    except State.DoesNotExist:
-        if state:
-            if len(state_code) > State._meta.get_field("code").max_length:
-                if state_code != state:
-                    raise ValueError("Invalid state code (too long): %s" % state_code)
-                state_code = ""
-            state_obj = State.objects.create(name=state, code=state_code, country=country_obj)
-        else:
-            state_obj = None
+        return geohash.encode(float(latitude), float(longitude))
+    except (TypeError, ValueError):
+        return ""
+
+
+def _deduplicate_raw():
+    return getattr(settings, "ADDRESS_DEDUPLICATE_RAW", False)
+
+
+def _sync_formatted():
+    return getattr(settings, "ADDRESS_SYNC_FORMATTED", False)
+
+
+def _raw_address(raw):
+    """
+    Make an address from a raw string. With `ADDRESS_DEDUPLICATE_RAW` set an
+    existing address with the same raw string is reused instead.
+    """
+    if _deduplicate_raw():
+        obj = Address.objects.filter(raw_hash=_raw_hash(raw)).order_by("pk").first()
+        if obj is not None:
+            return obj
+    return Address.objects.create(raw=raw)
+
+
+def _cached_get(model, key, **lookup):
+    """
+    Fetch a hierarchy row by its natural key, consulting the in-process
+    cache before the database. Raises `DoesNotExist` like `get`.
+    """
+    obj = hierarchy_cache.get(model, key)
+    if obj is None:
+        obj = model.objects.get(**lookup)
+        hierarchy_cache.add(model, key, obj)
+    return obj
+
+
+def _insert(model, obj, unique_fields):
+    """
+    Insert a new hierarchy row without tripping over a concurrent insert of
+    the same natural key, returning whichever row ended up in the table.
+    Where possible this is a single `INSERT ... ON CONFLICT ... RETURNING`;
+    otherwise conflicts are ignored and the winner read back.
+    """
+    db = router.db_for_write(model)
+    connection = connections[db]
+    if can_upsert_returning_rows(connection):
+        model.objects.using(db).bulk_create(
+            [obj], update_conflicts=True, unique_fields=unique_fields, update_fields=unique_fields[:1]
+        )
+    elif connection.features.supports_ignore_conflicts:
+        model.objects.using(db).bulk_create([obj], ignore_conflicts=True)
+        obj = model.objects.using(db).get(**{f: getattr(obj, f) for f in unique_fields})
+    else:
+        # Saving sends the signals that keep the indexes up to date.
+        try:
+            with transaction.atomic(using=db):
+                obj.save(using=db, force_insert=True)
+        except IntegrityError:
+            return model.objects.using(db).get(**{f: getattr(obj, f) for f in unique_fields})
+        return obj
+    _hierarchy_created(model, [obj], db)
+    return obj
+
+
+def _seeded_regions(load=True):
+    from .regions import get_regions
+
+    return get_regions(load)
+
+
+def _seeded_country(regions, c):
+    return regions.country(c.country, c.country_code) if regions is not None and c.country else None
+
+
+def _seeded_state(regions, c, country_obj):
+    if regions is None or not c.state or country_obj is None:
+        return None
+    return regions.state(country_obj, c.state, c.state_code)
+
+
+def _to_python(value):
+    try:
+        return _resolve_dict(value)
+    except IntegrityError:
+        if not _retry_stale_hierarchy():
+            raise
+        return _resolve_dict(value)
+
+
+def _retry_stale_hierarchy():
+    """
+    Whether a conversion that failed with an `IntegrityError` may be tried
+    again, after emptying the hierarchy cache and the seeded regions in case
+    they held a row another process has deleted. Only outside a
+    transaction, where the failed statement left nothing behind.
+    """
+    from .regions import reset_regions
+
+    if transaction.get_connection(router.db_for_write(Address)).in_atomic_block:
+        return False
+    hierarchy_cache.clear()
+    reset_regions()
+    return True
+
+
+def _resolve_dict(value):
+    c = _components(value)
+    if c is None:
+        return None
+
+    # Seeded countries and states are found by name or code without a query.
+    regions = _seeded_regions()
+
+    # Handle the country.
+    country_obj = _seeded_country(regions, c)
+    if country_obj is None:
+        try:
+            country_obj = _cached_get(Country, c.country, name=c.country)
+        except Country.DoesNotExist:
+            if c.country:
+                country_obj = _insert(
+                    Country, Country(name=c.country, code=_valid_code(Country, c.country, c.country_code)), ["name"]
+                )
+            else:
+                country_obj = None
+
+    # Handle the state.
+    state_obj = _seeded_state(regions, c, country_obj)
+    if state_obj is None:
+        try:
+            state_obj = _cached_get(
+                State,
+                (c.state, country_obj and country_obj.pk),
+                name=c.state,
+                country=country_obj,
+            )
+        except State.DoesNotExist:
+            if c.state:
+                state_obj = _insert(
+                    State,
+                    State(name=c.state, code=_valid_code(State, c.state, c.state_code), country=country_obj),
+                    ["name", "country"],
+                )
+            else:
+                state_obj = None
 
     # Handle the locality.
     try:
-        locality_obj = Locality.objects.get(name=locality, postal_code=postal_code, state=state_obj)
+        locality_obj = _cached_get(
+            Locality,
+            (c.locality, c.postal_code, state_obj and state_obj.pk),
+            name=c.locality,
+            postal_code=c.postal_code,
+            state=state_obj,
+        )
     except Locality.DoesNotExist:
-        if locality:
-            locality_obj = Locality.objects.create(name=locality, postal_code=postal_code, state=state_obj)
+        if c.locality:
+            locality_obj = _insert(
+                Locality,
+                Locality(name=c.locality, postal_code=c.postal_code, state=state_obj),
+                ["name", "postal_code", "state"],
+            )
         else:
             locality_obj = None
 
+    # Link the hierarchy so formatting below doesn't have to reload it.
+    if state_obj is not None:
+        state_obj.country = country_obj
+    if locality_obj is not None:
+        locality_obj.state = state_obj
+
     # Handle the address.
-    try:
-        if not (street_number or route or locality):
-            address_obj = Address.objects.get(raw=raw)
-        else:
-            address_obj = Address.objects.get(street_number=street_number, route=route, locality=locality_obj)
-    except Address.DoesNotExist:
-        address_obj = Address(
-            street_number=street_number,
-            route=route,
-            raw=raw,
-            locality=locality_obj,
-            formatted=formatted,
-            latitude=latitude,
-            longitude=longitude,
-        )
+    return _get_or_create_address(c, locality_obj)
 
-        # If "formatted" is empty try to construct it from other values.
-        if not address_obj.formatted:
-            address_obj.formatted = str(address_obj)
 
-        # Need to save.
-        address_obj.save()
+def _components_key(c, locality_obj):
+    return _canonical_key(c.street_number, c.route, locality_obj.pk if locality_obj is not None else None, c.raw)
+
 
-    # Done.
+def _get_or_create_address(c, locality_obj):
+    # Differently spelt duplicates may predate canonical keys; the oldest wins.
+    address_obj = Address.objects.filter(canonical_key=_components_key(c, locality_obj)).order_by("pk").first()
+    if address_obj is None:
+        address_obj = _new_address(c, locality_obj)
+        address_obj.save()
+    elif locality_obj is not None:
+        address_obj.locality = locality_obj
     return address_obj
 
 
+def _fetch(model, keys, fields):
+    """
+    Map each natural key in `keys`, a set of tuples of `fields` values, to
+    its existing row with a single query. The lowest primary key wins when
+    a key matches several rows.
+    """
+    if not keys:
+        return {}
+    query = models.Q()
+    for ii, field in enumerate(fields):
+        values = set(k[ii] for k in keys)
+        q = models.Q(**{"%s__in" % field: values - {None}})
+        if None in values:
+            q |= models.Q(**{"%s__isnull" % field: True})
+        query &= q
+    found = {}
+    for obj in model.objects.filter(query).order_by("pk"):
+        key = tuple(getattr(obj, f) for f in fields)
+        if key in keys:
+            found.setdefault(key, obj)
+    return found
+
+
+def _get_or_create_many(model, rows, names, parent_field, make, fail, seeded=None):
+    """
+    Resolve one level of the hierarchy for `(index, components, parent)`
+    rows, where `names` are the components matching the model's natural
+    key. `make` builds the unsaved row for a missing key, raising
+    `ValueError` if it can't; such rows are handed to `fail` and dropped.
+    `seeded(components, parent)` may find a row without a query first.
+    Returns `(index, components, obj)` for the remaining rows, where `obj`
+    is `None` if the level was left empty.
+    """
+    attnames = ("name",) + names[1:]
+    if parent_field:
+        attnames += (parent_field + "_id",)
+
+    def key(c, parent):
+        values = tuple(getattr(c, n) for n in names)
+        return values + (parent.pk if parent is not None else None,) if parent_field else values
+
+    # Rows in the hierarchy cache are keyed the way `_to_python` looks them
+    # up; only the rest are fetched.
+    def cache_key(k):
+        return k if parent_field else k[0]
+
+    preset = {}
+    if seeded is not None:
+        for index, c, parent in rows:
+            obj = seeded(c, parent)
+            if obj is not None:
+                preset[index] = obj
+
+    found = {}
+    keys = set()
+    for k in set(key(c, p) for index, c, p in rows if index not in preset):
+        obj = hierarchy_cache.get(model, cache_key(k))
+        if obj is None:
+            keys.add(k)
+        else:
+            found[k] = obj
+    fetched = _fetch(model, keys, attnames)
+    for k, obj in fetched.items():
+        hierarchy_cache.add(model, cache_key(k), obj)
+    found.update(fetched)
+    missing = OrderedDict()
+    resolved = []
+    for index, c, parent in rows:
+        k = key(c, parent)
+        if index not in preset and k[0] and k not in found and k not in missing:
+            try:
+                missing[k] = make(c, parent)
+            except ValueError as e:
+                fail(index, e)
+                continue
+        resolved.append((index, c, parent, k))
+
+    # Let the unique constraints drop anything inserted concurrently, then
+    # read the new rows back to learn their primary keys.
+    if missing:
+        db = router.db_for_write(model)
+        ignore_conflicts = connections[db].features.supports_ignore_conflicts
+        model.objects.using(db).bulk_create(list(missing.values()), ignore_conflicts=ignore_conflicts)
+        found.update(_fetch(model, set(missing), attnames))
+        _hierarchy_created(model, [found[k] for k in missing if k in found], db)
+
+    result = []
+    for index, c, parent, k in resolved:
+        obj = preset.get(index) or found.get(k)
+        if obj is not None and parent_field:
+            setattr(obj, parent_field, parent)
+        result.append((index, c, obj))
+    return result
+
+
+def _resolve_hierarchy_many(rows, fail):
+    """
+    Find or create the country, state and locality of every
+    `(index, components)` pair with one lookup per level. Returns
+    `(index, components, locality)` for each row that didn't fail.
+    """
+    regions = _seeded_regions()
+    rows = _get_or_create_many(
+        Country,
+        [(index, c, None) for index, c in rows],
+        ("country",),
+        None,
+        lambda c, _: Country(name=c.country, code=_valid_code(Country, c.country, c.country_code)),
+        fail,
+        lambda c, _: _seeded_country(regions, c),
+    )
+    rows = _get_or_create_many(
+        State,
+        rows,
+        ("state",),
+        "country",
+        lambda c, country: State(name=c.state, code=_valid_code(State, c.state, c.state_code), country=country),
+        fail,
+        lambda c, country: _seeded_state(regions, c, country),
+    )
+    return _get_or_create_many(
+        Locality,
+        rows,
+        ("locality", "postal_code"),
+        "state",
+        lambda c, state: Locality(name=c.locality, postal_code=c.postal_code, state=state),
+        fail,
+    )
+
+
 ##
 # Convert a dictionary to an address.
 ##
@@ -136,23 +516,257 @@ def to_python(value):
 
     # A string is considered a raw value.
     elif isinstance(value, str):
-        obj = Address(raw=value)
-        obj.save()
-        return obj
+        return _raw_address(value)
 
-    # A dictionary of named address components.
+    # A dictionary of named address components, which other processes may
+    # already have resolved. Raw addresses aren't shared, as they are only
+    # reused when deduplicating.
     elif isinstance(value, dict):
+        fingerprint = _fingerprint(value) if address_cache.enabled else None
+        if fingerprint is not None and fingerprint[0] == "address":
+            return address_cache.resolve(fingerprint, lambda: _dict_to_python(value))
+        return _dict_to_python(value)
+
+    # Not in any of the formats I recognise.
+    raise ValidationError("Invalid address value.")
+
+
+def _dict_to_python(value):
 
-        # Attempt a conversion.
+    # Attempt a conversion.
+    try:
+        return _to_python(value)
+    except InconsistentDictError:
+        return _raw_address(value["raw"])
+
+
+##
+# Convert many dictionaries to addresses at once.
+##
+
+
+def to_python_many(values, strict=False, on_error=None):
+    """
+    Convert an iterable of address dictionaries (or `None`s) to addresses,
+    as `to_python` would, but with at most one query per level of the
+    hierarchy and bulk inserts for anything missing. Addresses are returned in input
+    order; repeated components resolve to the same instance.
+
+    Rows that can't be converted, either because a country or state code is
+    too long or, when `strict` is set, because their components are
+    inconsistent, are passed to `on_error(index, exception)` and come back
+    as `None`. Without `on_error` the exception is raised, so callers that
+    need all-or-nothing semantics should wrap the call in a transaction.
+
+    Each call issues `IN` queries sized by the number of values, so very
+    large inputs should be fed in chunks of a few thousand.
+    """
+    results = []
+    rows = []
+    raw_only = []
+
+    def fail(index, exc):
+        if on_error is None:
+            raise exc
+        on_error(index, exc)
+
+    for index, value in enumerate(values):
+        results.append(None)
+        if value is None:
+            continue
+        if not isinstance(value, dict):
+            raise ValidationError("Invalid address value.")
         try:
-            return _to_python(value)
-        except InconsistentDictError:
-            return Address.objects.create(raw=value["raw"])
+            c = _components(value)
+        except InconsistentDictError as e:
+            if strict:
+                fail(index, e)
+            else:
+                raw_only.append((index, _text(value, "raw")))
+            continue
+        if c is not None:
+            rows.append((index, c))
+
+    rows = _resolve_hierarchy_many(rows, fail)
+
+    # Match existing addresses the same way `_to_python` does.
+    def key(c, locality_obj):
+        return (_components_key(c, locality_obj),)
+
+    found = _fetch(Address, set(key(c, obj) for _, c, obj in rows), ("canonical_key",))
+
+    # Create the missing addresses in one go.
+    missing = OrderedDict()
+    for index, c, locality_obj in rows:
+        k = key(c, locality_obj)
+        if k not in found and k not in missing:
+            missing[k] = _new_address(c, locality_obj)
+    found.update(missing)
+    for index, c, locality_obj in rows:
+        results[index] = found[key(c, locality_obj)]
+
+    # Inconsistent components fall back to raw addresses, which may be
+    # shared when deduplicating.
+    new_raw = []
+    if raw_only and _deduplicate_raw():
+        reused = _fetch(Address, set((_raw_hash(raw),) for _, raw in raw_only), ("raw_hash",))
+        for index, raw in raw_only:
+            k = (_raw_hash(raw),)
+            if k not in reused:
+                reused[k] = Address(raw=raw)
+                new_raw.append(reused[k])
+            results[index] = reused[k]
+    else:
+        for index, raw in raw_only:
+            results[index] = Address(raw=raw)
+            new_raw.append(results[index])
+
+    _insert_addresses(list(missing.values()) + new_raw)
+    return results
+
+
+def _insert_addresses(objs):
+    """
+    Bulk insert new addresses, falling back to one INSERT each on backends
+    that can't report the primary keys of bulk inserted rows.
+    """
+    if not objs:
+        return
+    for obj in objs:
+        obj.raw_hash = _raw_hash(obj.raw)
+        obj.canonical_key = _canonical_key(obj.street_number, obj.route, obj.locality_id, obj.raw)
+        obj.geohash = _geohash(obj.latitude, obj.longitude)
+    db = router.db_for_write(Address)
+    if can_return_rows_from_bulk_insert(connections[db]):
+        Address.objects.using(db).bulk_create(objs)
+        _addresses_changed(objs, db, created=True)
+    else:
+        for obj in objs:
+            obj.save(using=db)
+
+
+def _addresses_changed(addresses, db, created=False):
+    """
+    Bring the search and autocomplete indexes up to date with addresses
+    written without saving them one at a time, and drop any that already
+    existed from the shared address cache.
+    """
+    from .autocomplete import autocomplete_index
+    from .search import index_addresses, search_backend
+
+    if search_backend(db) == "ngram":
+        index_addresses(addresses, using=db)
+    autocomplete_index.addresses_changed(using=db)
+    if not created and address_cache.enabled:
+        pks = [obj.pk for obj in addresses]
+        transaction.on_commit(lambda: address_cache.evict(pks), using=db)
+
+
+def _hierarchy_created(model, objs, db):
+    """
+    Add countries, states or localities inserted in bulk, which sends no
+    signals, to the in-process indexes once the current transaction
+    commits.
+    """
+    from .autocomplete import autocomplete_index
+    from .localities import _update_locality_index
+
+    for obj in objs:
+        if model is Country:
+            _update_locality_index(db, "put_country", obj.pk, obj.name, obj.code)
+        elif model is State:
+            _update_locality_index(db, "put_state", obj.pk, obj.name, obj.code, obj.country_id)
+        else:
+            _update_locality_index(db, "put_locality", obj.pk, obj.name, obj.postal_code, obj.state_id)
+    if model is Locality:
+        autocomplete_index.localities_saved(objs, using=db)
 
-    # Not in any of the formats I recognise.
+
+##
+# Convert addresses from asynchronous code.
+##
+
+
+def _async(func):
+    if sync_to_async is None:
+        raise RuntimeError("Asynchronous address conversion requires Django 3.0 or later.")
+    return sync_to_async(func)
+
+
+def _cached_locality(c):
+    """
+    The locality named by `c` with its state and country linked, if all
+    three are in the hierarchy cache. Never touches the database, so it is
+    safe to call from an event loop.
+    """
+    regions = _seeded_regions(load=False)
+    country_obj = _seeded_country(regions, c) or hierarchy_cache.get(Country, c.country)
+    if country_obj is None:
+        return None
+    state_obj = _seeded_state(regions, c, country_obj) or hierarchy_cache.get(State, (c.state, country_obj.pk))
+    if state_obj is None:
+        return None
+    locality_obj = hierarchy_cache.get(Locality, (c.locality, c.postal_code, state_obj.pk))
+    if locality_obj is None:
+        return None
+    state_obj.country = country_obj
+    locality_obj.state = state_obj
+    return locality_obj
+
+
+async def _araw_address(raw):
+    if is_django41 and not _deduplicate_raw():
+        return await Address.objects.acreate(raw=raw)
+    return await _async(_raw_address)(raw)
+
+
+async def _ato_python(value):
+    c = _components(value)
+    if c is None:
+        return None
+
+    # Either way this is a single trip to the thread Django runs synchronous
+    # database code in. Looking up and creating the address in the same trip
+    # stops concurrent conversions of a new address from both inserting it.
+    locality_obj = _cached_locality(c) if c.locality else None
+    if locality_obj is None:
+        return await _async(_to_python)(value)
+    try:
+        return await _async(_get_or_create_address)(c, locality_obj)
+    except IntegrityError:
+        if not await _async(_retry_stale_hierarchy)():
+            raise
+        return await _async(_to_python)(value)
+
+
+async def ato_python(value):
+    """
+    Asynchronous `to_python`. Countries, states and localities found in the
+    hierarchy cache are resolved on the event loop, leaving only the address
+    itself to query; each conversion takes at most one hop to the
+    synchronous thread.
+    """
+    if value is None or isinstance(value, (Address, int)):
+        return value
+    elif isinstance(value, str):
+        return await _araw_address(value)
+    elif isinstance(value, dict):
+        try:
+            return await _ato_python(value)
+        except InconsistentDictError:
+            return await _araw_address(value["raw"])
     raise ValidationError("Invalid address value.")
 
 
+async def ato_python_many(values, strict=False, on_error=None):
+    """
+    Asynchronous `to_python_many`. The whole batch is converted in one hop
+    to the synchronous thread, so a request with several address fields
+    should gather them into one call rather than awaiting each in turn.
+    """
+    return await _async(to_python_many)(list(values), strict=strict, on_error=on_error)
+
+
 ##
 # A country.
 ##
@@ -170,6 +784,15 @@ class Country(models.Model):
         return "%s" % (self.name or self.code)
 
 
+class StateQuerySet(models.QuerySet):
+    def with_hierarchy(self):
+        """
+        Load each state's country in the same query, so formatting states
+        doesn't cost a query apiece.
+        """
+        return self.select_related("country")
+
+
 ##
 # A state. Google refers to this as `administration_level_1`.
 ##
@@ -180,6 +803,8 @@ class State(models.Model):
     code = models.CharField(max_length=8, blank=True)
     country = models.ForeignKey(Country, on_delete=models.CASCADE, related_name="states")
 
+    objects = StateQuerySet.as_manager()
+
     class Meta:
         unique_together = ("name", "country")
         ordering = ("country", "name")
@@ -196,6 +821,14 @@ class State(models.Model):
         return "%s" % (self.name or self.code)
 
 
+class LocalityQuerySet(models.QuerySet):
+    def with_hierarchy(self):
+        """
+        Load each locality's state and country in the same query.
+        """
+        return self.select_related("state__country")
+
+
 ##
 # A locality (suburb).
 ##
@@ -206,6 +839,8 @@ class Locality(models.Model):
     postal_code = models.CharField(max_length=10, blank=True)
     state = models.ForeignKey(State, on_delete=models.CASCADE, related_name="localities")
 
+    objects = LocalityQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Localities"
         unique_together = ("name", "postal_code", "state")
@@ -225,6 +860,290 @@ class Locality(models.Model):
         return txt
 
 
+def _format_locality(name, postal_code, state_name, state_code, country_name, country_code):
+    """
+    The same string as `Locality.__str__`, from column values.
+    """
+    txt = "%s" % name
+    state = "%s" % (state_name or state_code)
+    if txt and state:
+        txt += ", "
+    txt += state
+    if postal_code:
+        txt += " %s" % postal_code
+    country = "%s" % (country_name or country_code)
+    if country:
+        txt += ", %s" % country
+    return txt
+
+
+def _format_address(street_number, route, locality):
+    """
+    The string `Address.__str__` builds for an address with a locality and
+    no `formatted` value. The route is only shown after a street number.
+    """
+    if not street_number:
+        return locality
+    txt = "%s %s" % (street_number, route) if route else "%s" % street_number
+    return "%s, %s" % (txt, locality) if locality else txt
+
+
+def _formatted_expression(locality):
+    """
+    `_format_address` as an expression over the street number and route of
+    each address, for addresses in a locality formatted as `locality`.
+    """
+    separator = ", %s" % locality if locality else ""
+    return models.Case(
+        models.When(street_number="", then=models.Value(locality)),
+        models.When(route="", then=Concat("street_number", models.Value(separator))),
+        default=Concat("street_number", models.Value(" "), "route", models.Value(separator)),
+        output_field=models.CharField(),
+    )
+
+
+def _locality_strings(localities):
+    """
+    Format each of a queryset of localities as `Locality.__str__` would,
+    keyed by primary key.
+    """
+    rows = localities.values_list(
+        "pk", "name", "postal_code", "state__name", "state__code", "state__country__name", "state__country__code"
+    )
+    return dict((row[0], _format_locality(*row[1:])) for row in rows)
+
+
+def _update_formatted(old, new):
+    """
+    Update the `formatted` value of addresses in localities formatted as
+    `old` before a change and `new` after, both keyed by locality. Only
+    addresses with an empty value, or one derived from the old locality
+    string, are changed, with a single UPDATE per locality.
+    """
+    with transaction.atomic(using=router.db_for_write(Address)):
+        for pk, locality in new.items():
+            if pk not in old or old[pk] == locality:
+                continue
+            derived = models.Q(formatted="") | models.Q(formatted=_formatted_expression(old[pk]))
+            Address.objects.filter(locality_id=pk).filter(derived).update(formatted=_formatted_expression(locality))
+
+
+# Mean radius of the Earth, in kilometres.
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _bbox_filter(south, west, north, east):
+    """
+    Filter for coordinates inside a bounding box, which may cross the
+    antimeridian (west > east).
+    """
+    query = models.Q(latitude__gte=south, latitude__lte=north)
+    if west <= east:
+        return query & models.Q(longitude__gte=west, longitude__lte=east)
+    return query & (models.Q(longitude__gte=west) | models.Q(longitude__lte=east))
+
+
+def _radius_bbox(latitude, longitude, km):
+    """
+    The smallest bounding box enclosing a circle of `km` around a point,
+    as `(south, west, north, east)`.
+    """
+    dlat = math.degrees(km / EARTH_RADIUS_KM)
+    south, north = latitude - dlat, latitude + dlat
+
+    # Near the poles the circle covers every longitude.
+    if south <= -90 or north >= 90:
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    dlng = math.degrees(math.asin(min(1.0, math.sin(km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)))))
+    west, east = longitude - dlng, longitude + dlng
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+
+def _haversine(latitude, longitude):
+    """
+    Expression for the great-circle distance in kilometres from a point to
+    each address.
+    """
+    phi = math.radians(latitude)
+    a = Power(Sin((Radians("latitude") - phi) / 2.0), 2) + math.cos(phi) * Cos(Radians("latitude")) * Power(
+        Sin((Radians("longitude") - math.radians(longitude)) / 2.0), 2
+    )
+    return 2.0 * EARTH_RADIUS_KM * ASin(Least(Sqrt(a), models.Value(1.0)))
+
+
+def _cells_filter(cells):
+    """
+    Filter for addresses whose geohash starts with any of `cells`, written
+    as ranges so the geohash index can serve it.
+    """
+    query = models.Q()
+    for cell in cells:
+        low, high = geohash.prefix_range(cell)
+        query |= models.Q(geohash__gte=low, geohash__lt=high) if high else models.Q(geohash__gte=low)
+    return query
+
+
+def _covered_radius(latitude, longitude, cell):
+    """
+    Distance in kilometres from a point in `cell` to the edge of the block
+    made up of the cell and its neighbours. Every address closer than this
+    lies inside the block.
+    """
+    south, west, north, east = geohash.bbox(cell)
+    height, width = north - south, east - west
+    dlat = min(latitude - max(south - height, -90.0), min(north + height, 90.0) - latitude)
+    dlng = min(longitude - (west - width), (east + width) - longitude)
+    # Leaving through the east or west edge means crossing a meridian, and the
+    # shortest way to a meridian is along a great circle meeting it at right angles.
+    cross = math.asin(math.sin(math.radians(dlng)) * math.cos(math.radians(latitude)))
+    return EARTH_RADIUS_KM * min(math.radians(dlat), cross)
+
+
+class AddressQuerySet(models.QuerySet):
+
+    # Keys of `Address.as_dict` and where to find them relative to an address.
+    dict_fields = (
+        ("street_number", "street_number"),
+        ("route", "route"),
+        ("raw", "raw"),
+        ("formatted", "formatted"),
+        ("latitude", "latitude"),
+        ("longitude", "longitude"),
+        ("locality", "locality__name"),
+        ("postal_code", "locality__postal_code"),
+        ("state", "locality__state__name"),
+        ("state_code", "locality__state__code"),
+        ("country", "locality__state__country__name"),
+        ("country_code", "locality__state__country__code"),
+    )
+
+    # Columns used to format an address.
+    format_fields = (
+        "formatted",
+        "raw",
+        "street_number",
+        "route",
+        "locality_id",
+        "locality__name",
+        "locality__postal_code",
+        "locality__state__name",
+        "locality__state__code",
+        "locality__state__country__name",
+        "locality__state__country__code",
+    )
+
+    def with_hierarchy(self):
+        """
+        Load each address's locality, state and country in the same query.
+        The default ordering already joins these tables, so this costs
+        little more than fetching the addresses alone.
+        """
+        return self.select_related("locality__state__country")
+
+    def in_bbox(self, south, west, north, east):
+        """
+        Addresses with coordinates inside a bounding box given in degrees.
+        Boxes crossing the antimeridian have `west` greater than `east`.
+        """
+        return self.filter(_bbox_filter(south, west, north, east))
+
+    def within_radius(self, latitude, longitude, km):
+        """
+        Addresses within `km` kilometres of a point, annotated with their
+        `distance` from it in kilometres. Candidates are first narrowed to
+        the enclosing bounding box, which the coordinate index can serve,
+        and then filtered by their exact great-circle distance.
+        """
+        return (
+            self.filter(_bbox_filter(*_radius_bbox(latitude, longitude, km)))
+            .annotate(distance=_haversine(latitude, longitude))
+            .filter(distance__lte=km)
+        )
+
+    def nearest(self, latitude, longitude, k=1, precision=6):
+        """
+        The `k` addresses nearest to a point as a list, closest first, each
+        annotated with its `distance` in kilometres. The search starts with
+        the geohash cell of the point and its neighbours at `precision`
+        (about a kilometre across at the default) and moves out to coarser
+        cells until the k-th closest candidate can't be beaten by anything
+        outside them, scanning the whole table only as a last resort.
+        """
+        point = geohash.encode(latitude, longitude, precision)
+        distance = _haversine(latitude, longitude)
+        for length in range(precision, 0, -1):
+            cell = point[:length]
+            found = list(
+                self.filter(_cells_filter([cell] + geohash.neighbours(cell)))
+                .annotate(distance=distance)
+                .order_by("distance", "pk")[:k]
+            )
+            if len(found) == k and found[-1].distance <= _covered_radius(latitude, longitude, cell):
+                return found
+        return list(
+            self.exclude(latitude=None)
+            .exclude(longitude=None)
+            .annotate(distance=distance)
+            .order_by("distance", "pk")[:k]
+        )
+
+    def as_dicts(self, chunk_size=2000, with_id=False):
+        """
+        Iterate over the addresses as dictionaries identical to those from
+        `Address.as_dict`, joining the whole hierarchy in the one query and
+        streaming the results so memory use stays flat on large tables.
+        With `with_id`, each dictionary also holds the address's `id`.
+        """
+        keys = [k for k, _ in self.dict_fields]
+        rows = self.values_list("locality_id", "pk", *[f for _, f in self.dict_fields])
+        for row in rows.iterator(chunk_size=chunk_size):
+            ad = dict(zip(keys[:6], row[2:8]))
+            ad["latitude"] = ad["latitude"] if ad["latitude"] else ""
+            ad["longitude"] = ad["longitude"] if ad["longitude"] else ""
+            if row[0] is not None:
+                ad.update(zip(keys[6:], row[8:]))
+            if with_id:
+                ad["id"] = row[1]
+            yield ad
+
+    def search(self, q, limit=10, threshold=None):
+        """
+        The `limit` addresses most like `q`, tolerating typos, best first and
+        each annotated with its `similarity` from 0 to 1. Uses pg_trgm on
+        PostgreSQL, and otherwise the trigram table kept when
+        `ADDRESS_SEARCH_INDEX` is set.
+        """
+        from .search import search
+
+        return search(self, q, limit=limit, threshold=threshold)
+
+    def as_strings(self, chunk_size=2000, with_id=False):
+        """
+        Iterate over the addresses formatted exactly as `str(address)`
+        would, from one joined query. Each locality is formatted once and
+        reused for every address in it. With `with_id`, yields `(id,
+        string)` pairs instead.
+        """
+        localities = {}
+        for row in self.values_list("pk", *self.format_fields).iterator(chunk_size=chunk_size):
+            formatted, raw, street_number, route, locality_id = row[1:6]
+            if formatted != "":
+                txt = "%s" % formatted
+            elif locality_id is not None:
+                try:
+                    locality = localities[locality_id]
+                except KeyError:
+                    locality = localities[locality_id] = _format_locality(*row[6:])
+                txt = _format_address(street_number, route, locality)
+            else:
+                txt = "%s" % raw
+            yield (row[0], txt) if with_id else txt
+
+
 ##
 # An address. If for any reason we are unable to find a matching
 # decomposed address we will store the raw address string in `raw`.
@@ -242,36 +1161,104 @@ class Address(models.Model):
         null=True,
     )
     raw = models.CharField(max_length=200)
+    raw_hash = models.CharField(max_length=40, blank=True, db_index=True, editable=False)
+    # Normalized street number, route and locality, or raw string; see `address.normalize`.
+    canonical_key = models.CharField(max_length=40, blank=True, db_index=True, editable=False)
+    geohash = models.CharField(max_length=geohash.PRECISION, blank=True, db_index=True, editable=False)
     formatted = models.CharField(max_length=200, blank=True)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    # When the address was last saved, for refreshing a `SpatialIndex`.
+    modified = models.DateTimeField(auto_now=True, null=True, db_index=True, editable=False)
+
+    objects = AddressQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = "Addresses"
         ordering = ("locality", "route", "street_number")
+        indexes = [
+            # Lists a locality's addresses in the default order.
+            models.Index(fields=["locality", "route", "street_number"], name="address_locality_route_idx"),
+            # Bounding box prefilter for `in_bbox` and `within_radius`.
+            models.Index(fields=["latitude", "longitude"], name="address_coordinates_idx"),
+        ]
 
     def __str__(self):
         if self.formatted != "":
             txt = "%s" % self.formatted
         elif self.locality:
-            txt = ""
-            if self.street_number:
-                txt = "%s" % self.street_number
-            if self.route:
-                if txt:
-                    txt += " %s" % self.route
-            locality = "%s" % self.locality
-            if txt and locality:
-                txt += ", "
-            txt += locality
+            txt = _format_address(self.street_number, self.route, "%s" % self.locality)
         else:
             txt = "%s" % self.raw
         return txt
 
+    def save(self, *args, **kwargs):
+        # Numbers from imports and the like are stored as text anyway.
+        for field in ("street_number", "route", "raw"):
+            value = getattr(self, field)
+            setattr(self, field, "" if value is None else str(value))
+        self.raw_hash = _raw_hash(self.raw)
+        self.canonical_key = _canonical_key(self.street_number, self.route, self.locality_id, self.raw)
+        self.geohash = _geohash(self.latitude, self.longitude)
+        update_fields = kwargs.get("update_fields")
+        sync_formatted = _sync_formatted() and self._formatted_is_derived()
+        if sync_formatted:
+            self.formatted = ""
+            if self.locality_id is not None:
+                self.formatted = str(self)
+        if update_fields:
+            update_fields = set(update_fields) | {"modified"}
+            if sync_formatted:
+                update_fields.add("formatted")
+            if "raw" in update_fields:
+                update_fields.add("raw_hash")
+            if update_fields & {"street_number", "route", "locality", "locality_id", "raw"}:
+                update_fields.add("canonical_key")
+            if "latitude" in update_fields or "longitude" in update_fields:
+                update_fields.add("geohash")
+            kwargs["update_fields"] = update_fields
+        super(Address, self).save(*args, **kwargs)
+
+    def _formatted_is_derived(self):
+        """
+        Whether `formatted` is empty, or unchanged since it was derived from
+        the components stored for this address.
+        """
+        if self.formatted == "":
+            return True
+        if self._state.adding or self.pk is None:
+            return False
+        row = Address.objects.filter(pk=self.pk).values_list(*AddressQuerySet.format_fields).first()
+        if row is None or row[0] != self.formatted or row[4] is None:
+            return False
+        return row[0] == _format_address(row[2], row[3], _format_locality(*row[5:]))
+
     def clean(self):
         if not self.raw:
             raise ValidationError("Addresses may not have a blank `raw` field.")
 
+    def fingerprint(self):
+        """
+        The components identifying this address, matching the fingerprint of
+        any dictionary that resolves to it. Loads the hierarchy if it isn't
+        already.
+        """
+        if self.locality_id is not None:
+            locality = self.locality
+            state = locality.state
+            return (
+                "address",
+                state.country.name,
+                state.name,
+                locality.name,
+                locality.postal_code,
+                self.street_number,
+                self.route,
+            )
+        if self.street_number or self.route:
+            return ("address", "", "", "", "", self.street_number, self.route)
+        return ("raw", self.raw)
+
     def as_dict(self):
         ad = dict(
             street_number=self.street_number,
@@ -293,11 +1280,51 @@ class Address(models.Model):
         return ad
 
 
+##
+# The portable search index: the trigrams of each address's raw and
+# formatted strings, maintained when `ADDRESS_SEARCH_INDEX` is set.
+##
+
+
+class AddressTrigram(models.Model):
+    trigram = models.CharField(max_length=3)
+    address = models.ForeignKey(Address, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        indexes = [models.Index(fields=["trigram", "address"], name="address_trigram_idx")]
+
+    def __str__(self):
+        return "%s" % self.trigram
+
+
 class AddressDescriptor(ForwardManyToOneDescriptor):
     def __set__(self, inst, value):
+        # Skip resolving a dictionary that describes the current address,
+        # when that is already loaded along with its hierarchy. Loading it
+        # just to compare would cost more queries than it saves.
+        if isinstance(value, dict) and self.field.is_cached(inst):
+            current = self.field.get_cached_value(inst)
+            if current is not None and _loaded_fingerprint(current) == _fingerprint(value):
+                value = current
         super(AddressDescriptor, self).__set__(inst, to_python(value))
 
 
+def _loaded_fingerprint(address):
+    """
+    `address.fingerprint()`, or `None` if that would have to load any of
+    its locality, state or country.
+    """
+    obj = address
+    for model, name in ((Address, "locality"), (Locality, "state"), (State, "country")):
+        field = model._meta.get_field(name)
+        if getattr(obj, field.attname) is None:
+            break
+        if not field.is_cached(obj):
+            return None
+        obj = field.get_cached_value(obj)
+    return address.fingerprint()
+
+
 ##
 # A field for addresses in other models.
 ##
@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import router, transaction
+from django.dispatch import receiver
+
+from .cache import address_cache, hierarchy_cache
+from .models import Country, State
+from .normalize import fold
+
+__all__ = ["RegionIndex", "reference_regions", "seed_regions", "get_regions"]
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "iso3166.json")
+
+
+@lru_cache(maxsize=None)
+def reference_regions():
+    """
+    The ISO 3166-1 countries and top level ISO 3166-2 subdivisions shipped
+    with django-address: a list of `(code, name)` pairs for the countries,
+    and a dictionary from each country code to `(code, name)` pairs for its
+    subdivisions, with codes given without the country prefix.
+    """
+    with open(DATA_FILE, encoding="utf-8") as f:
+        data = json.load(f)
+    countries = [tuple(row) for row in data["countries"]]
+    subdivisions = dict((code, [tuple(row) for row in rows]) for code, rows in data["subdivisions"].items())
+    return countries, subdivisions
+
+
+##
+# Seed countries and states from the reference data.
+##
+
+
+def _upsert(existing, scope, regions, make):
+    """
+    Match reference `regions`, `(scope, code, name)` triples, against the
+    `existing` rows with the same `scope(row)`, by folded name or else by a
+    code no other row in the scope has. Matched rows with a different code
+    are corrected and the rest are made with `make`. Returns the row for
+    each `(scope, code)`, and the lists of new and updated rows.
+    """
+    by_name = {}
+    by_code = {}
+    for obj in existing:
+        by_name.setdefault((scope(obj), fold(obj.name)), obj)
+        by_code.setdefault((scope(obj), obj.code), []).append(obj)
+    found = {}
+    used = set()
+    created = []
+    updated = []
+    for key, code, name in regions:
+        obj = by_name.get((key, fold(name)))
+        if obj is None and len(by_code.get((key, code), ())) == 1:
+            obj = by_code[(key, code)][0]
+        if obj is None or obj.pk in used:
+            obj = make(key, code, name)
+            created.append(obj)
+        else:
+            used.add(obj.pk)
+            if obj.code != code:
+                obj.code = code
+                updated.append(obj)
+        found[(key, code)] = obj
+    return found, created, updated
+
+
+def seed_regions(using=None, countries=None):
+    """
+    Create or correct the reference countries and their states, only those
+    with the ISO codes in `countries` if given, in a few bulk statements.
+    Existing rows are matched by name or code, and keep their names; only
+    their codes are corrected. Returns the numbers of countries created and
+    updated, and of states created and updated.
+    """
+    using = using or router.db_for_write(Country)
+    reference, subdivisions = reference_regions()
+    if countries is not None:
+        countries = set(code.upper() for code in countries)
+        reference = [(code, name) for code, name in reference if code in countries]
+
+    with transaction.atomic(using=using):
+        found, created, updated = _upsert(
+            Country.objects.using(using).all(),
+            lambda obj: None,
+            [(None, code, name) for code, name in reference],
+            lambda key, code, name: Country(name=name, code=code),
+        )
+        Country.objects.using(using).bulk_create(created)
+        Country.objects.using(using).bulk_update(updated, ["code"])
+        counts = (len(created), len(updated))
+
+        # Read back any country whose primary key the insert didn't report.
+        if any(obj.pk is None for obj in created):
+            pks = dict(
+                Country.objects.using(using).filter(name__in=[c.name for c in created]).values_list("name", "pk")
+            )
+            for obj in created:
+                obj.pk = pks[obj.name]
+
+        country_pks = dict((code, found[(None, code)].pk) for code, _ in reference)
+        _, created, updated = _upsert(
+            State.objects.using(using).filter(country__in=country_pks.values()),
+            lambda obj: obj.country_id,
+            [
+                (country_pks[country], code, name)
+                for country, _ in reference
+                for code, name in subdivisions.get(country, ())
+            ],
+            lambda key, code, name: State(name=name, code=code, country_id=key),
+        )
+        State.objects.using(using).bulk_create(created, batch_size=1000)
+        State.objects.using(using).bulk_update(updated, ["code"], batch_size=1000)
+
+        # Bulk statements don't send the signals that keep these up to date.
+        transaction.on_commit(_regions_changed, using=using)
+    return counts + (len(created), len(updated))
+
+
+def _regions_changed():
+    from .localities import reset_locality_index
+
+    hierarchy_cache.clear()
+    reset_locality_index()
+    reset_regions()
+    if address_cache.enabled:
+        address_cache.clear()
+
+
+##
+# Resolve countries and states from memory once they have been seeded.
+##
+
+
+class RegionIndex(object):
+    """
+    Every country and state, looked up by folded name or by code without
+    querying the database. Only the column values are kept, so each lookup
+    returns a fresh instance, as `HierarchyCache` does.
+    """
+
+    def __init__(self, countries, states, using=None):
+        self.using = using
+        self._country_fields = [f.attname for f in Country._meta.concrete_fields]
+        self._state_fields = [f.attname for f in State._meta.concrete_fields]
+        self._countries = {}
+        self._states = {}
+        for values in countries:
+            obj = dict(zip(self._country_fields, values))
+            self._add(self._countries, None, obj["name"], obj["code"], values)
+        for values in states:
+            obj = dict(zip(self._state_fields, values))
+            self._add(self._states, obj["country_id"], obj["name"], obj["code"], values)
+
+    @classmethod
+    def load(cls, using=None):
+        using = using or router.db_for_read(Country)
+        return cls(
+            Country.objects.using(using)
+            .order_by("pk")
+            .values_list(*[f.attname for f in Country._meta.concrete_fields]),
+            State.objects.using(using).order_by("pk").values_list(*[f.attname for f in State._meta.concrete_fields]),
+            using=using,
+        )
+
+    @staticmethod
+    def _add(entries, scope, name, code, values):
+        # The first row with a name wins, and codes shared by several rows
+        # are left ambiguous.
+        if name:
+            entries.setdefault((scope, "name", fold(name)), values)
+        if code:
+            key = (scope, "code", code.upper())
+            entries[key] = None if key in entries else values
+
+    def _find(self, model, fields, entries, scope, name, code):
+        values = entries.get((scope, "name", fold(name))) if name else None
+        if values is None and code:
+            values = entries.get((scope, "code", code.upper()))
+        if values is None:
+            return None
+        return model.from_db(self.using, fields, values)
+
+    def country(self, name, code=""):
+        """
+        The country called `name`, or else the only one with `code`.
+        """
+        return self._find(Country, self._country_fields, self._countries, None, name, code)
+
+    def state(self, country, name, code=""):
+        """
+        The state of `country` called `name`, or else its only state with
+        `code`. `country` may be a `Country` or its primary key.
+        """
+        country_id = country.pk if isinstance(country, Country) else country
+        return self._find(State, self._state_fields, self._states, country_id, name, code)
+
+
+_regions = None
+_regions_lock = threading.Lock()
+
+
+def get_regions(load=True):
+    """
+    The shared `RegionIndex` when `ADDRESS_SEEDED_REGIONS` is set, loaded
+    on first use unless `load` is false, and otherwise `None`.
+    """
+    global _regions
+    if not getattr(settings, "ADDRESS_SEEDED_REGIONS", False):
+        return None
+    if _regions is None and load:
+        with _regions_lock:
+            if _regions is None:
+                _regions = RegionIndex.load()
+    return _regions
+
+
+def reset_regions():
+    """
+    Drop the shared index, so it is loaded again when next used.
+    """
+    global _regions
+    with _regions_lock:
+        _regions = None
+
+
+@receiver(setting_changed, dispatch_uid="address_regions_setting_changed")
+def reset_regions_setting(setting, **kwargs):
+    if setting == "ADDRESS_SEEDED_REGIONS":
+        reset_regions()
@@ -0,0 +1,208 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections, models, router
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+
+from .models import Address, AddressTrigram
+from .normalize import fold
+
+__all__ = ["search_backend", "trigrams", "index_addresses", "search"]
+
+# How alike a query and an address must be for the address to match, from 0
+# to 1, as measured by pg_trgm's `word_similarity`.
+DEFAULT_THRESHOLD = 0.5
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+# Whether each database alias has pg_trgm installed, looked up once.
+_has_pg_trgm = {}
+
+
+def _pg_trgm(alias):
+    if alias not in _has_pg_trgm:
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                _has_pg_trgm[alias] = cursor.fetchone() is not None
+        except DatabaseError:
+            _has_pg_trgm[alias] = False
+    return _has_pg_trgm[alias]
+
+
+def search_backend(alias=None):
+    """
+    How addresses in database `alias` are searched: `"pg_trgm"` on
+    PostgreSQL with that extension installed, `"ngram"` when
+    `ADDRESS_SEARCH_INDEX` maintains the portable trigram table, and `None`
+    when search isn't available.
+    """
+    alias = alias or router.db_for_read(Address)
+    if connections[alias].vendor == "postgresql" and _pg_trgm(alias):
+        return "pg_trgm"
+    if getattr(settings, "ADDRESS_SEARCH_INDEX", False):
+        return "ngram"
+    return None
+
+
+def trigrams(text):
+    """
+    The trigrams of each word in `text`, padded the way pg_trgm pads them so
+    that word boundaries count towards similarity.
+    """
+    result = set()
+    for word in _WORD.findall(fold(text)):
+        padded = "  %s " % word
+        result.update("".join(t) for t in zip(padded, padded[1:], padded[2:]))
+    return result
+
+
+def index_addresses(addresses, using=None, replace=True):
+    """
+    Store the trigrams of the current raw and formatted strings of saved
+    `addresses`, replacing any stored before unless `replace` is false.
+    Only needed for the `"ngram"` backend.
+    """
+    addresses = [a for a in addresses if a.pk is not None]
+    if not addresses:
+        return
+    using = using or router.db_for_write(AddressTrigram)
+    if replace:
+        AddressTrigram.objects.using(using).filter(address_id__in=[a.pk for a in addresses]).delete()
+    AddressTrigram.objects.using(using).bulk_create(
+        [
+            AddressTrigram(trigram=trigram, address_id=a.pk)
+            for a in addresses
+            for trigram in sorted(trigrams(a.raw) | trigrams(a.formatted))
+        ],
+        batch_size=5000,
+    )
+
+
+def search(queryset, q, limit=10, threshold=None):
+    """
+    The `limit` addresses in `queryset` most like `q`, best first, each
+    with its `similarity` to `q` from 0 to 1. Addresses less similar than
+    `threshold` are left out.
+    """
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLD
+    backend = search_backend(queryset.db)
+    if backend is None:
+        raise ImproperlyConfigured(
+            "Address search needs PostgreSQL with the pg_trgm extension, or ADDRESS_SEARCH_INDEX = True."
+        )
+    if not q.strip():
+        return []
+    if backend == "pg_trgm":
+        return _search_pg_trgm(queryset, q, limit, threshold)
+    return _search_ngram(queryset, q, limit, threshold)
+
+
+def _search_pg_trgm(queryset, q, limit, threshold):
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(Address._meta.db_table)
+
+    def column(name):
+        return "%s.%s" % (table, connection.ops.quote_name(name))
+
+    # `<%` is word similarity above `pg_trgm.word_similarity_threshold`, which
+    # the trigram indexes on raw and formatted can answer.
+    matches = RawSQL(
+        "(%%s <%%%% %s OR %%s <%%%% %s)" % (column("raw"), column("formatted")),
+        (q, q),
+        output_field=models.BooleanField(),
+    )
+    similarity = Greatest(
+        RawSQL("word_similarity(%%s, %s)" % column("raw"), (q,), output_field=models.FloatField()),
+        RawSQL("word_similarity(%%s, %s)" % column("formatted"), (q,), output_field=models.FloatField()),
+    )
+    with connection.cursor() as cursor:
+        # Lasts for the session, so each search sets it again.
+        cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, false)", [str(threshold)])
+    return list(queryset.filter(matches).annotate(similarity=similarity).order_by("-similarity", "pk")[:limit])
+
+
+class _Frequencies(object):
+    """
+    How many addresses contain each trigram, remembered per database so
+    that searches can start from the rarest trigrams of a query. The counts
+    only steer the search, so they are allowed to go stale.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()
+
+    def get(self, alias, query):
+        with self._lock:
+            counts = {t: self._counts.get((alias, t)) for t in query}
+        missing = [t for t, n in counts.items() if n is None]
+        if missing:
+            rows = (
+                AddressTrigram.objects.using(alias)
+                .filter(trigram__in=missing)
+                .values_list("trigram")
+                .annotate(n=models.Count("*"))
+                .order_by()
+            )
+            found = dict(rows)
+            with self._lock:
+                for t in missing:
+                    counts[t] = self._counts[(alias, t)] = found.get(t, 0)
+                while len(self._counts) > self.maxsize:
+                    self._counts.popitem(last=False)
+        return counts
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+_frequencies = _Frequencies()
+
+
+def _search_ngram(queryset, q, limit, threshold):
+    query = trigrams(q)
+    if not query:
+        return []
+    # An address's score is the share of the query's trigrams it contains,
+    # which approximates word similarity without reading the addresses.
+    minimum = max(1, math.ceil(len(query) * threshold))
+
+    # An address sharing `minimum` trigrams with the query lacks at most
+    # `len(query) - minimum` of them, so it contains two of any one more than
+    # that, or one when the query is short. Candidates are found from the
+    # rarest trigrams and only they are scored against the whole query.
+    counts = _frequencies.get(queryset.db, query)
+    missing = len(query) - minimum
+    required = 2 if missing + 2 <= len(query) else 1
+    rarest = sorted(query, key=lambda t: (counts[t], t))[: missing + required]
+    trigram_table = AddressTrigram.objects.using(queryset.db)
+    candidates = trigram_table.filter(trigram__in=rarest).values("address_id")
+    if required > 1:
+        candidates = candidates.annotate(n=models.Count("*")).filter(n__gte=required).values("address_id")
+    if queryset.query.where:
+        candidates = candidates.filter(address__in=queryset.order_by().values("pk"))
+    rows = (
+        trigram_table.filter(trigram__in=query, address_id__in=candidates)
+        .values("address_id")
+        .annotate(shared=models.Count("*"))
+        .filter(shared__gte=minimum)
+        .order_by("-shared", "address_id")[:limit]
+    )
+    scores = [(row["address_id"], row["shared"] / len(query)) for row in rows]
+    addresses = queryset.in_bulk([pk for pk, _ in scores])
+    results = []
+    for pk, similarity in scores:
+        address = addresses.get(pk)
+        if address is not None:
+            address.similarity = similarity
+            results.append(address)
+    return results
@@ -0,0 +1,154 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import autocomplete_index
+from .cache import address_cache, hierarchy_cache
+from .localities import _update_locality_index
+from .regions import get_regions, reset_regions
+from .models import Address, Country, Locality, State, _locality_strings, _sync_formatted, _update_formatted
+from .search import index_addresses, search_backend
+
+
+@receiver(post_save, sender=Country, dispatch_uid="address_country_saved")
+@receiver(post_save, sender=State, dispatch_uid="address_state_saved")
+@receiver(post_save, sender=Locality, dispatch_uid="address_locality_saved")
+def invalidate_saved_hierarchy(sender, instance, created, **kwargs):
+    # Nothing can be cached for a row that did not exist yet.
+    if not created:
+        hierarchy_cache.evict(sender, instance.pk)
+
+
+@receiver(post_delete, sender=Country, dispatch_uid="address_country_deleted")
+@receiver(post_delete, sender=State, dispatch_uid="address_state_deleted")
+@receiver(post_delete, sender=Locality, dispatch_uid="address_locality_deleted")
+def invalidate_deleted_hierarchy(sender, instance, **kwargs):
+    hierarchy_cache.evict(sender, instance.pk)
+
+
+def _affected_localities(sender, instance):
+    if sender is Country:
+        return Locality.objects.filter(state__country_id=instance.pk)
+    if sender is State:
+        return Locality.objects.filter(state_id=instance.pk)
+    return Locality.objects.filter(pk=instance.pk)
+
+
+@receiver(pre_save, sender=Country, dispatch_uid="address_country_formatting")
+@receiver(pre_save, sender=State, dispatch_uid="address_state_formatting")
+@receiver(pre_save, sender=Locality, dispatch_uid="address_locality_formatting")
+def remember_locality_strings(sender, instance, raw=False, **kwargs):
+    # With ADDRESS_SYNC_FORMATTED, note how the affected localities read
+    # before the change so addresses formatted from them can be found.
+    instance._address_locality_strings = None
+    if _sync_formatted() and not raw and instance.pk is not None:
+        instance._address_locality_strings = _locality_strings(_affected_localities(sender, instance))
+
+
+@receiver(post_save, sender=Country, dispatch_uid="address_country_formatted")
+@receiver(post_save, sender=State, dispatch_uid="address_state_formatted")
+@receiver(post_save, sender=Locality, dispatch_uid="address_locality_formatted")
+def update_formatted_addresses(sender, instance, created, raw=False, **kwargs):
+    old = getattr(instance, "_address_locality_strings", None)
+    if old:
+        instance._address_locality_strings = None
+        new = _locality_strings(_affected_localities(sender, instance))
+        _update_formatted(old, new)
+        if search_backend() == "ngram":
+            changed = [pk for pk, locality in new.items() if pk in old and old[pk] != locality]
+            index_addresses(Address.objects.filter(locality_id__in=changed).only("pk", "raw", "formatted"))
+
+
+@receiver(post_save, sender=Address, dispatch_uid="address_search_index")
+def index_saved_address(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Keep the portable search index in step with raw and formatted.
+    if raw or (update_fields and not {"raw", "formatted"} & set(update_fields)):
+        return
+    if search_backend(kwargs.get("using")) == "ngram":
+        index_addresses([instance], using=kwargs.get("using"))
+
+
+@receiver(post_save, sender=Address, dispatch_uid="address_autocomplete_saved")
+@receiver(post_delete, sender=Address, dispatch_uid="address_autocomplete_deleted")
+def autocomplete_changed_address(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete_index.addresses_changed(using=kwargs.get("using"))
+
+
+@receiver(post_save, sender=Country, dispatch_uid="address_country_autocomplete")
+@receiver(post_save, sender=State, dispatch_uid="address_state_autocomplete")
+@receiver(post_save, sender=Locality, dispatch_uid="address_locality_autocomplete")
+@receiver(post_delete, sender=Country, dispatch_uid="address_country_deleted_autocomplete")
+@receiver(post_delete, sender=State, dispatch_uid="address_state_deleted_autocomplete")
+@receiver(post_delete, sender=Locality, dispatch_uid="address_locality_deleted_autocomplete")
+def autocomplete_changed_hierarchy(sender, instance, created=False, **kwargs):
+    # A new row can't change the label of any existing locality, so only a
+    # new locality itself needs adding. Otherwise locality labels may have
+    # changed, and the index is built again when next used.
+    if not autocomplete_index.loaded:
+        return
+    if created:
+        if sender is Locality:
+            autocomplete_index.localities_saved([instance], using=kwargs.get("using"))
+    else:
+        transaction.on_commit(autocomplete_index.invalidate, using=kwargs.get("using"))
+
+
+@receiver(post_save, sender=Country, dispatch_uid="address_country_locality_index")
+def locality_index_saved_country(sender, instance, raw=False, **kwargs):
+    _update_locality_index(kwargs.get("using"), "put_country", instance.pk, instance.name, instance.code)
+
+
+@receiver(post_save, sender=State, dispatch_uid="address_state_locality_index")
+def locality_index_saved_state(sender, instance, raw=False, **kwargs):
+    _update_locality_index(
+        kwargs.get("using"), "put_state", instance.pk, instance.name, instance.code, instance.country_id
+    )
+
+
+@receiver(post_save, sender=Locality, dispatch_uid="address_locality_locality_index")
+def locality_index_saved_locality(sender, instance, raw=False, **kwargs):
+    _update_locality_index(
+        kwargs.get("using"), "put_locality", instance.pk, instance.name, instance.postal_code, instance.state_id
+    )
+
+
+@receiver(post_delete, sender=Country, dispatch_uid="address_country_deleted_locality_index")
+@receiver(post_delete, sender=State, dispatch_uid="address_state_deleted_locality_index")
+@receiver(post_delete, sender=Locality, dispatch_uid="address_locality_deleted_locality_index")
+def locality_index_deleted(sender, instance, **kwargs):
+    method = {Country: "remove_country", State: "remove_state", Locality: "remove_locality"}[sender]
+    _update_locality_index(kwargs.get("using"), method, instance.pk)
+
+
+@receiver(post_save, sender=Country, dispatch_uid="address_country_regions")
+@receiver(post_save, sender=State, dispatch_uid="address_state_regions")
+@receiver(post_delete, sender=Country, dispatch_uid="address_country_deleted_regions")
+@receiver(post_delete, sender=State, dispatch_uid="address_state_deleted_regions")
+def regions_changed(sender, instance, **kwargs):
+    # Countries and states change rarely, so the seeded regions are simply
+    # loaded again when next used.
+    if get_regions(load=False) is not None:
+        transaction.on_commit(reset_regions, using=kwargs.get("using"))
+
+
+@receiver(post_save, sender=Address, dispatch_uid="address_shared_cache_saved")
+@receiver(post_delete, sender=Address, dispatch_uid="address_shared_cache_deleted")
+def evict_shared_address(sender, instance, created=False, **kwargs):
+    # Nothing can be cached for an address that did not exist yet. Deleting
+    # clears the primary key before the transaction commits, so it is read
+    # now.
+    if address_cache.enabled and not created:
+        pk = instance.pk
+        transaction.on_commit(lambda: address_cache.evict([pk]), using=kwargs.get("using"))
+
+
+@receiver(post_save, sender=Country, dispatch_uid="address_country_shared_cache")
+@receiver(post_save, sender=State, dispatch_uid="address_state_shared_cache")
+@receiver(post_save, sender=Locality, dispatch_uid="address_locality_shared_cache")
+@receiver(post_delete, sender=Country, dispatch_uid="address_country_deleted_shared_cache")
+@receiver(post_delete, sender=State, dispatch_uid="address_state_deleted_shared_cache")
+@receiver(post_delete, sender=Locality, dispatch_uid="address_locality_deleted_shared_cache")
+def clear_shared_addresses(sender, instance, created=False, **kwargs):
+    if address_cache.enabled and not created:
+        transaction.on_commit(address_cache.clear, using=kwargs.get("using"))
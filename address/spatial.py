@@ -0,0 +1,222 @@
+import datetime
+from itertools import islice
+
+from django.utils import timezone
+
+from .models import EARTH_RADIUS_KM, Address
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ["SpatialIndex"]
+
+# How long before a build `refresh` looks for changed rows by default.
+REFRESH_OVERLAP = datetime.timedelta(minutes=5)
+
+
+def _unit_vectors(latitudes, longitudes):
+    phi = np.radians(latitudes)
+    lam = np.radians(longitudes)
+    cos_phi = np.cos(phi)
+    return np.column_stack((cos_phi * np.cos(lam), cos_phi * np.sin(lam), np.sin(phi)))
+
+
+def _chord(km):
+    """
+    Straight line distance through the unit sphere between two points `km`
+    apart on the surface. Comparing chords ranks points the same way as
+    great-circle distances without any trigonometry per point.
+    """
+    return 2.0 * np.sin(min(km / EARTH_RADIUS_KM, np.pi) / 2.0)
+
+
+def _km(chords):
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chords / 2.0, 1.0))
+
+
+##
+# An in-memory index of address coordinates, for batch jobs asking many
+# radius and nearest neighbour questions of the same set of addresses.
+##
+
+
+class SpatialIndex(object):
+    """
+    Address ids and coordinates held in NumPy arrays, sorted along a grid of
+    cubes covering the unit sphere so the addresses near a point occupy a
+    few contiguous runs of the arrays. Positions are kept as 3D vectors,
+    which avoids any special cases at the poles or the antimeridian.
+
+    Build one with `SpatialIndex.load`, and call `refresh` to pick up
+    addresses changed since.
+    """
+
+    def __init__(self, ids, latitudes, longitudes, cell_km=1.0):
+        if np is None:
+            raise ImportError('SpatialIndex requires NumPy; install "django-address[spatial]".')
+        self.cell = _chord(cell_km)
+        self.size = int(np.ceil(2.0 / self.cell)) + 1
+        if self.size**3 >= 2**63:
+            raise ValueError("cell_km is too small: %s" % cell_km)
+        self.queryset = None
+        self.built_at = None
+        self._set(
+            np.asarray(ids, dtype=np.int64),
+            np.asarray(latitudes, dtype=np.float64),
+            np.asarray(longitudes, dtype=np.float64),
+        )
+
+    @classmethod
+    def load(cls, queryset=None, cell_km=1.0, chunk_size=10000):
+        """
+        Index the addresses in `queryset`, or all of them, that have
+        coordinates. `cell_km` sets the size of the grid cells; the default
+        suits addresses spread over cities.
+        """
+        queryset = Address.objects.all() if queryset is None else queryset
+        built_at = timezone.now()
+        index = cls(*_fetch(queryset, chunk_size), cell_km=cell_km)
+        index.queryset = queryset
+        index.built_at = built_at
+        return index
+
+    def refresh(self, prune=True, overlap=REFRESH_OVERLAP, chunk_size=10000):
+        """
+        Update the index with addresses saved since it was built or last
+        refreshed. Addresses changed with `QuerySet.update` or raw SQL are
+        not detected. With `prune`, addresses deleted since are dropped too,
+        which costs one pass over the ids of the queryset. Rows saved within
+        `overlap` of the last build are read again, in case their
+        transactions hadn't committed by then.
+        """
+        if self.queryset is None:
+            raise ValueError("Only indexes built with SpatialIndex.load can be refreshed.")
+        built_at = timezone.now()
+        changed = self.queryset.filter(modified__gte=self.built_at - overlap)
+        ids, latitudes, longitudes = _fetch(changed, chunk_size, with_coordinates=False)
+        keep = ~np.isin(self.ids, ids)
+        if prune:
+            present = _fetch_ids(self.queryset, chunk_size)
+            keep &= np.isin(self.ids, present)
+        has_coordinates = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        self._set(
+            np.concatenate((self.ids[keep], ids[has_coordinates])),
+            np.concatenate((self.latitudes[keep], latitudes[has_coordinates])),
+            np.concatenate((self.longitudes[keep], longitudes[has_coordinates])),
+        )
+        self.built_at = built_at
+
+    def _set(self, ids, latitudes, longitudes):
+        vectors = _unit_vectors(latitudes, longitudes)
+        keys = self._cell_keys(vectors)
+        order = np.argsort(keys, kind="stable")
+        self.ids = ids[order]
+        self.latitudes = latitudes[order]
+        self.longitudes = longitudes[order]
+        self.vectors = vectors[order]
+        self.keys = keys[order]
+
+    def _cells(self, values):
+        return np.clip(np.floor((values + 1.0) / self.cell).astype(np.int64), 0, self.size - 1)
+
+    def _cell_keys(self, vectors):
+        cells = self._cells(vectors)
+        return (cells[:, 0] * self.size + cells[:, 1]) * self.size + cells[:, 2]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidates(self, vector, chord):
+        """
+        Positions of the addresses in the cells overlapping a cube around
+        `vector`, which contains every address within `chord` of it. Each
+        column of cells along the last axis is one run of the sorted keys.
+        """
+        low = self._cells(vector - chord)
+        high = self._cells(vector + chord)
+        columns = (high[0] - low[0] + 1) * (high[1] - low[1] + 1)
+        if columns >= len(self.keys):
+            return np.arange(len(self.keys))
+        xs, ys = np.meshgrid(np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1), indexing="ij")
+        base = (xs.ravel() * self.size + ys.ravel()) * self.size
+        starts = np.searchsorted(self.keys, base + low[2], side="left")
+        lengths = np.searchsorted(self.keys, base + high[2], side="right") - starts
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+
+    def _distances(self, positions, vector):
+        return np.sqrt(((self.vectors[positions] - vector) ** 2).sum(axis=1))
+
+    def within_radius(self, points, km):
+        """
+        For each `(latitude, longitude)` in `points`, an array of the ids of
+        addresses within `km` kilometres of it.
+        """
+        chord = _chord(km)
+        results = []
+        for vector in _points(points):
+            positions = self._candidates(vector, chord)
+            results.append(self.ids[positions[self._distances(positions, vector) <= chord]])
+        return results
+
+    def nearest(self, points, k=1):
+        """
+        The `k` nearest addresses to each `(latitude, longitude)` in
+        `points`, as a pair of arrays with a row per point: the address ids,
+        closest first, and their distances in kilometres. Fewer than `k`
+        columns are returned if the index holds fewer addresses.
+        """
+        vectors = _points(points)
+        k = min(k, len(self.ids))
+        ids = np.empty((len(vectors), k), dtype=np.int64)
+        chords = np.empty((len(vectors), k), dtype=np.float64)
+        if not k:
+            return ids, chords
+        for row, vector in enumerate(vectors):
+            # Search a growing cube until the k-th closest address found lies
+            # within the sphere the cube encloses.
+            chord = self.cell
+            while True:
+                positions = self._candidates(vector, chord)
+                if len(positions) >= k:
+                    distances = self._distances(positions, vector)
+                    closest = np.argpartition(distances, k - 1)[:k]
+                    closest = closest[np.argsort(distances[closest], kind="stable")]
+                    if distances[closest[-1]] <= chord or chord >= 2.0:
+                        break
+                chord = min(chord * 2.0, 2.0)
+            ids[row] = self.ids[positions[closest]]
+            chords[row] = distances[closest]
+        return ids, _km(chords)
+
+
+def _points(points):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return _unit_vectors(points[:, 0], points[:, 1])
+
+
+def _fetch(queryset, chunk_size, with_coordinates=True):
+    """
+    Stream `(id, latitude, longitude)` from `queryset` into arrays, a chunk
+    at a time. Missing coordinates are NaN.
+    """
+    if with_coordinates:
+        queryset = queryset.exclude(latitude=None).exclude(longitude=None)
+    rows = queryset.order_by().values_list("pk", "latitude", "longitude").iterator(chunk_size=chunk_size)
+    ids, latitudes, longitudes = [np.empty(0, dtype=np.int64)], [np.empty(0)], [np.empty(0)]
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        chunk_ids, chunk_latitudes, chunk_longitudes = zip(*chunk)
+        ids.append(np.array(chunk_ids, dtype=np.int64))
+        latitudes.append(np.array(chunk_latitudes, dtype=np.float64))
+        longitudes.append(np.array(chunk_longitudes, dtype=np.float64))
+    return np.concatenate(ids), np.concatenate(latitudes), np.concatenate(longitudes)
+
+
+def _fetch_ids(queryset, chunk_size):
+    rows = queryset.order_by().values_list("pk", flat=True).iterator(chunk_size=chunk_size)
+    return np.fromiter(rows, dtype=np.int64)
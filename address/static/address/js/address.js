@@ -1,32 +1,148 @@
 $(function () {
+	var cmp_names = [
+		'country',
+		'country_code',
+		'locality',
+		'postal_code',
+		'postal_town',
+		'route',
+		'street_number',
+		'state',
+		'state_code',
+		'formatted',
+		'latitude',
+		'longitude',
+		'id',
+	];
+
+	function clearComponents(self) {
+		for (var ii = 0; ii < cmp_names.length; ++ii) {
+			$('input[name="' + self.attr('name') + '_' + cmp_names[ii] + '"]').val('');
+		}
+	}
+
+	// Google Places, used on its own or once stored addresses run out.
+	function useGoogle(self) {
+		if (self.data('address-google')) {
+			return;
+		}
+		self.data('address-google', true);
+		self.geocomplete({
+			details: $('#' + self.attr('name') + '_components'),
+			detailsAttribute: 'data-geo'
+		});
+	}
+
+	// Suggest stored localities and addresses from the autocomplete view,
+	// falling back to Google when it has nothing to offer.
+	function useStored(self) {
+		var url = self.data('autocomplete-url');
+		var debounce = parseInt(self.data('autocomplete-debounce'), 10) || 250;
+		var minLength = parseInt(self.data('autocomplete-min-length'), 10) || 3;
+		var list = $('<ul class="address-suggestions" role="listbox"></ul>').css({
+			position: 'absolute',
+			zIndex: 1000,
+			margin: 0,
+			padding: 0,
+			listStyle: 'none',
+			background: '#fff',
+			border: '1px solid #ccc'
+		}).hide().insertAfter(self);
+		var results = {};
+		var timer = null;
+		var active = -1;
+
+		function choose(suggestion) {
+			clearComponents(self);
+			$.each(suggestion.components, function (key, value) {
+				$('input[name="' + self.attr('name') + '_' + key + '"]').val(value);
+			});
+			self.val(suggestion.label);
+			list.hide();
+		}
+
+		function show(suggestions) {
+			list.empty();
+			active = -1;
+			$.each(suggestions, function (ii, suggestion) {
+				$('<li role="option"></li>').text(suggestion.label).css({padding: '2px 6px', cursor: 'pointer'}).on('mousedown', function (e) {
+					e.preventDefault();
+					choose(suggestion);
+				}).appendTo(list).data('suggestion', suggestion);
+			});
+			list.css({minWidth: self.outerWidth()}).toggle(suggestions.length > 0);
+		}
+
+		function fallBack() {
+			self.off('.address');
+			list.remove();
+			useGoogle(self);
+		}
+
+		function lookup() {
+			var q = $.trim(self.val());
+			if (q.length < minLength) {
+				show([]);
+				return;
+			}
+			if (results.hasOwnProperty(q)) {
+				show(results[q]);
+				return;
+			}
+			$.getJSON(url, {q: q}).done(function (data) {
+				debounce = data.debounce || debounce;
+				minLength = data.min_length || minLength;
+				results[q] = data.results;
+				if (!data.results.length) {
+					fallBack();
+				} else if ($.trim(self.val()) == q) {
+					show(data.results);
+				}
+			}).fail(fallBack);
+		}
+
+		function highlight(index) {
+			var items = list.children();
+			active = Math.max(-1, Math.min(index, items.length - 1));
+			items.css('background', '').eq(active).css('background', '#eee');
+		}
+
+		self.attr('autocomplete', 'off').on('input.address', function () {
+			clearTimeout(timer);
+			timer = setTimeout(lookup, debounce);
+		}).on('keydown.address', function (e) {
+			if (!list.is(':visible')) {
+				return;
+			}
+			if (e.which == 40) {
+				highlight(active + 1);
+				e.preventDefault();
+			} else if (e.which == 38) {
+				highlight(active - 1);
+				e.preventDefault();
+			} else if (e.which == 13 && active >= 0) {
+				choose(list.children().eq(active).data('suggestion'));
+				e.preventDefault();
+			} else if (e.which == 27) {
+				list.hide();
+			}
+		}).on('blur.address', function () {
+			list.hide();
+		});
+	}
+
 	$('input.address').each(function () {
 		var self = $(this);
-		var cmps = $('#' + self.attr('name') + '_components');
 		var fmtd = $('input[name="' + self.attr('name') + '_formatted"]');
-		self.geocomplete({
-			details: cmps,
-			detailsAttribute: 'data-geo'
-		}).change(function () {
+		if (self.data('autocomplete-url')) {
+			useStored(self);
+		} else {
+			useGoogle(self);
+		}
+		self.change(function () {
 			if (self.val() != fmtd.val()) {
-				var cmp_names = [
-					'country',
-					'country_code',
-					'locality',
-					'postal_code',
-					'postal_town',
-					'route',
-					'street_number',
-					'state',
-					'state_code',
-					'formatted',
-					'latitude',
-					'longitude',
-				];
-
-				for (var ii = 0; ii < cmp_names.length; ++ii) {
-					$('input[name="' + self.attr('name') + '_' + cmp_names[ii] + '"]').val('');
-				}
+				clearComponents(self);
 			}
 		});
 	});
-});
\ No newline at end of file
+});
@@ -0,0 +1,161 @@
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import Permission, User
+from django.test import TestCase, override_settings
+from django.urls import include, path, reverse
+
+from address import autocomplete
+from address.autocomplete import PrefixIndex, autocomplete_index
+from address.cache import hierarchy_cache
+from address.models import Address, Locality, State, to_python, to_python_many
+from address.widgets import AddressWidget
+
+urlpatterns = [path("address/", include("address.urls"))]
+
+
+class PrefixIndexTestCase(TestCase):
+    def test_lookup(self):
+        index = PrefixIndex([(1, "12 Collins Street, Melbourne"), (2, "Collingwood, VIC 3066"), (3, "1 High St")])
+        self.assertEqual(index.lookup("coll", 10), [2, 1])
+        self.assertEqual(index.lookup("12 col", 10), [1])
+        self.assertEqual(index.lookup("coll", 1), [2])
+        self.assertEqual(index.lookup("high", 10), [3])
+        self.assertEqual(index.lookup("street", 10), [])
+
+    def test_add_discard(self):
+        index = PrefixIndex([(1, "12 Collins Street")])
+        index.add(2, "Collins Place")
+        index.add(1, "3 Flinders Lane")
+        self.assertEqual(index.lookup("coll", 10), [2])
+        self.assertEqual(index.lookup("flin", 10), [1])
+        index.discard(1)
+        index.discard(4)
+        self.assertEqual(index.lookup("flin", 10), [])
+        self.assertEqual(len(index), 1)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AutocompleteViewTestCase(TestCase):
+    def setUp(self):
+        autocomplete_index.clear()
+        self.addCleanup(autocomplete_index.clear)
+        self.addCleanup(hierarchy_cache.clear)
+        self.value = {
+            "raw": "12 Collins Street, Melbourne",
+            "street_number": "12",
+            "route": "Collins Street",
+            "locality": "Melbourne",
+            "postal_code": "3000",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+        self.address = to_python(self.value)
+        self.locality = self.address.locality
+        self.url = reverse("address:autocomplete")
+        self.user = User.objects.create_user("clerk", password="secret")
+        self.user.user_permissions.add(Permission.objects.get(codename="view_address"))
+
+    def test_localities_only_without_permission(self):
+        data = self.client.get(self.url, {"q": "melb"}).json()
+        self.assertEqual([r["type"] for r in data["results"]], ["locality"])
+        self.assertEqual(data["results"][0]["label"], "Melbourne, Victoria 3000, Australia")
+        self.assertEqual(data["results"][0]["components"]["postal_code"], "3000")
+        self.assertEqual(self.client.get(self.url, {"q": "colli"}).json()["results"], [])
+
+    def test_addresses(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {"q": "Collins St"})
+        self.assertIn("private", response["Cache-Control"])
+        data = response.json()
+        self.assertEqual(data["debounce"], 250)
+        self.assertEqual(data["min_length"], 3)
+        [result] = data["results"]
+        self.assertEqual(result["id"], self.address.pk)
+        self.assertEqual(result["components"]["id"], self.address.pk)
+        self.assertEqual(result["components"]["route"], "Collins Street")
+        self.assertEqual(result["components"]["formatted"], str(self.address))
+
+    def test_limits(self):
+        Address.objects.create(raw="Melbourne Central")
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url, {"q": "me"}).json()["results"], [])
+        with self.settings(ADDRESS_AUTOCOMPLETE_MIN_LENGTH=1, ADDRESS_AUTOCOMPLETE_DEBOUNCE=100):
+            data = self.client.get(self.url, {"q": "m", "limit": "x"}).json()
+        self.assertEqual(data["debounce"], 100)
+        self.assertEqual(len(data["results"]), 2)
+        self.assertEqual(len(self.client.get(self.url, {"q": "melb", "limit": 0}).json()["results"]), 1)
+
+    def test_address_prefixes(self):
+        other = to_python(dict(self.value, raw="3 Collins Street, Melbourne", street_number="3"))
+
+        def addresses(q):
+            return [r["id"] for r in autocomplete_index.suggest(q) if r["type"] == "address"]
+
+        self.assertEqual(addresses("12 coll"), [self.address.pk])
+        self.assertEqual(addresses("12 Collins Street,"), [self.address.pk])
+        self.assertEqual(sorted(addresses("COLLI")), sorted([self.address.pk, other.pk]))
+        self.assertEqual(addresses("Collins Rd"), [])
+
+    def test_results_cached(self):
+        autocomplete_index.suggest("melb")
+        with self.assertNumQueries(0):
+            self.assertEqual(autocomplete_index.suggest("Melb.")[0]["id"], self.locality.pk)
+
+    def test_maintained(self):
+        self.assertEqual(autocomplete_index.suggest("flin"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            flinders = Address.objects.create(raw="Flinders Street Station")
+        self.assertEqual([r["id"] for r in autocomplete_index.suggest("flin")], [flinders.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            flinders.delete()
+        self.assertEqual(autocomplete_index.suggest("flin"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.locality.name = "Melbourne City"
+            self.locality.save()
+        self.assertEqual(autocomplete_index.suggest("melb")[0]["label"], "Melbourne City, Victoria 3000, Australia")
+
+    def test_new_hierarchy_kept(self):
+        localities = autocomplete_index._load()
+        with self.captureOnCommitCallbacks(execute=True):
+            carlton = Locality.objects.create(name="Carlton", postal_code="3053", state=self.locality.state)
+            State.objects.create(name="Tasmania", country=self.locality.state.country)
+        self.assertIs(autocomplete_index._load(), localities)
+        self.assertEqual([r["id"] for r in autocomplete_index.suggest("carl")], [carlton.pk])
+
+    def test_bulk_localities(self):
+        autocomplete_index.suggest("melb")
+        value = dict(self.value, locality="Carlton", postal_code="3053")
+        with self.captureOnCommitCallbacks(execute=True):
+            carlton = to_python(value).locality
+            fitzroy = to_python_many([dict(value, locality="Fitzroy", postal_code="3065")])[0].locality
+        self.assertEqual([r["id"] for r in autocomplete_index.suggest("carl")], [carlton.pk])
+        self.assertEqual([r["id"] for r in autocomplete_index.suggest("fitz")], [fitzroy.pk])
+
+    def test_single_build(self):
+        # Lookups made while the index is rebuilt are served the previous
+        # one rather than building their own.
+        previous = autocomplete_index._load()
+        autocomplete_index.invalidate()
+        seen = []
+        strings = autocomplete._locality_strings
+
+        def slow(localities):
+            thread = threading.Thread(target=lambda: seen.append(autocomplete_index._load()))
+            thread.start()
+            thread.join(5)
+            return strings(localities)
+
+        with mock.patch("address.autocomplete._locality_strings", slow):
+            rebuilt = autocomplete_index._load()
+        self.assertEqual(len(seen), 1)
+        self.assertIs(seen[0], previous)
+        self.assertIsNot(rebuilt, previous)
+        self.assertIs(autocomplete_index._load(), rebuilt)
+
+    def test_widget(self):
+        html = AddressWidget().render("address", None)
+        self.assertIn('data-autocomplete-url="%s"' % self.url, html)
+        self.assertIn('data-autocomplete-debounce="250"', html)
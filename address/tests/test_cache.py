@@ -0,0 +1,111 @@
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from address.cache import address_cache, hierarchy_cache
+from address.models import Address, Locality, to_python
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "addresses": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "addresses"},
+    },
+    ADDRESS_CACHE_ALIAS="addresses",
+)
+class AddressCacheTestCase(TestCase):
+    def setUp(self):
+        # Tests roll back the database, but not the cache.
+        caches["addresses"].clear()
+        self.addCleanup(hierarchy_cache.clear)
+        self.value = {
+            "raw": "12 Smith Street, Northcote",
+            "street_number": "12",
+            "route": "Smith Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+
+    def resolve(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            address = to_python(self.value)
+        # As if the next conversion happened in another process.
+        hierarchy_cache.clear()
+        return address
+
+    def test_shared(self):
+        address = self.resolve()
+        with self.assertNumQueries(0):
+            cached = to_python(self.value)
+            self.assertEqual(cached, address)
+            self.assertEqual(cached.locality.state.country.code, "AU")
+            self.assertEqual(str(cached), str(address))
+
+    def test_not_shared_until_committed(self):
+        to_python(self.value)
+        hierarchy_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            to_python(self.value)
+        self.assertGreater(len(queries), 0)
+
+    def test_raw_not_shared(self):
+        del self.value["locality"], self.value["street_number"], self.value["route"]
+        self.resolve()
+        with CaptureQueriesContext(connection) as queries:
+            to_python(self.value)
+        self.assertGreater(len(queries), 0)
+
+    def test_evicted_when_saved(self):
+        address = self.resolve()
+        with self.captureOnCommitCallbacks(execute=True):
+            address.route = "Smith Road"
+            address.save()
+        self.assertNotEqual(to_python(self.value), address)
+        self.assertEqual(Address.objects.count(), 2)
+
+    def test_evicted_when_deleted(self):
+        address = self.resolve()
+        pk = address.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            address_cache.dicts([pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                address.delete()
+        self.assertEqual(address_cache.dicts([pk]), {})
+        self.assertNotEqual(to_python(self.value).pk, pk)
+
+    def test_dicts(self):
+        address = self.resolve()
+        with self.assertNumQueries(1):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(
+                    address_cache.dicts([address.pk, 0]), {address.pk: dict(address.as_dict(), id=address.pk)}
+                )
+        with self.assertNumQueries(0):
+            self.assertEqual(address_cache.dicts([address.pk])[address.pk]["locality"], "Northcote")
+
+    def test_cleared_when_hierarchy_saved(self):
+        address = self.resolve()
+        with self.captureOnCommitCallbacks(execute=True):
+            address_cache.dicts([address.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            locality = Locality.objects.get(pk=address.locality_id)
+            locality.name = "Northcote South"
+            locality.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(address_cache.dicts([address.pk])[address.pk]["locality"], "Northcote South")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(to_python(self.value).locality.name, "Northcote")
+        self.assertGreater(len(queries), 0)
+
+    @override_settings(ADDRESS_CACHE_ALIAS=None)
+    def test_disabled(self):
+        address = to_python(self.value)
+        with self.assertNumQueries(1):
+            self.assertEqual(address_cache.dicts([address.pk])[address.pk]["route"], "Smith Street")
+        self.assertFalse(address_cache.enabled)
@@ -0,0 +1,313 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from address import geohash
+from address.geocoders import FakeGeocoder, GeocoderError, RateLimitedGeocoder
+from address.management.commands import regeocode_addresses
+from address.models import Address, Country, Locality, State
+
+
+class ImportAddressesTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.rejects = os.path.join(self.dir, "rejects.jsonl")
+        self.rows = [
+            {
+                "raw": "1 Somewhere Street, Northcote, Victoria 3070, VIC, AU",
+                "street_number": "1",
+                "route": "Somewhere Street",
+                "locality": "Northcote",
+                "postal_code": "3070",
+                "state": "Victoria",
+                "state_code": "VIC",
+                "country": "Australia",
+                "country_code": "AU",
+                "latitude": "-37.77",
+                "longitude": "144.99",
+            },
+            {"raw": "Inconsistent", "locality": "Northcote"},
+            {
+                "raw": "1 Somewhere Street, Nowhere",
+                "locality": "Nowhere",
+                "state": "Nowhere",
+                "country": "Nowhere",
+                "country_code": "Not a code",
+            },
+            {"raw": "Out the back", "latitude": "", "longitude": ""},
+            {"raw": "Bad coordinates", "latitude": "x"},
+            {"route": "No raw"},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def call(self, path, *args):
+        out = StringIO()
+        call_command("import_addresses", path, "--rejects", self.rejects, *args, stdout=out)
+        with open(self.rejects) as f:
+            return out.getvalue(), [json.loads(line) for line in f]
+
+    def check_import(self, out, rejects):
+        self.assertIn("Imported 2 addresses, rejected 4", out)
+        self.assertEqual(Address.objects.count(), 2)
+        address = Address.objects.get(route="Somewhere Street")
+        self.assertEqual(address.locality.state.country.code, "AU")
+        self.assertEqual(address.latitude, -37.77)
+        self.assertIsNone(Address.objects.get(raw="Out the back").latitude)
+        self.assertFalse(Country.objects.filter(name="Nowhere").exists())
+        self.assertEqual(
+            [r["error"] for r in rejects],
+            [
+                "InconsistentDictError",
+                "Invalid country code (too long): Not a code",
+                "Invalid value for latitude: x",
+                "Missing raw address.",
+            ],
+        )
+
+    def test_jsonl(self):
+        lines = [json.dumps(row) for row in self.rows]
+        lines.insert(3, "not json")
+        out, rejects = self.call(self.write("in.jsonl", "\n".join(lines) + "\n"), "--chunk-size", "2")
+        self.assertEqual(rejects[2]["line"], 4)
+        self.assertIsNone(rejects.pop(2)["row"])
+        self.assertEqual(rejects[0]["row"], self.rows[1])
+        self.check_import(out.replace("rejected 5", "rejected 4"), rejects)
+
+    def test_csv(self):
+        fields = sorted(set(k for row in self.rows for k in row))
+        lines = [",".join(fields)]
+        for row in self.rows:
+            lines.append(",".join('"%s"' % row.get(f, "") for f in fields))
+        out, rejects = self.call(self.write("in.csv", "\n".join(lines) + "\n"))
+        self.assertEqual([r["line"] for r in rejects], [3, 4, 6, 7])
+        self.check_import(out, rejects)
+
+    def test_numeric_fields(self):
+        rows = [
+            {"raw": 12345},
+            {
+                "raw": "12 Main St, Northcote",
+                "street_number": 12,
+                "route": "Main St",
+                "locality": "Northcote",
+                "postal_code": 3070,
+                "state": "Victoria",
+                "country": "Australia",
+            },
+            {"raw": "Listed", "route": ["Main St"]},
+        ]
+        out, rejects = self.call(self.write("in.jsonl", "\n".join(json.dumps(row) for row in rows) + "\n"))
+        self.assertIn("Imported 2 addresses, rejected 1", out)
+        self.assertEqual(Address.objects.get(raw="12345").canonical_key, Address.objects.get(raw="12345").raw_hash)
+        address = Address.objects.get(street_number="12")
+        self.assertEqual(address.locality.postal_code, "3070")
+        self.assertEqual([r["error"] for r in rejects], ['Invalid value for route: ["Main St"]'])
+
+    def test_geocode(self):
+        geocoder = {
+            "BACKEND": "address.geocoders.FakeGeocoder",
+            "OPTIONS": {
+                "results": {"out the back": dict(self.rows[0], street_number="2", latitude=-37.7, longitude=145.0)}
+            },
+        }
+        lines = [json.dumps(row) for row in self.rows[:4] + [{"raw": "Unknown"}]]
+        with override_settings(ADDRESS_GEOCODER=geocoder):
+            out, rejects = self.call(self.write("in.jsonl", "\n".join(lines) + "\n"), "--geocode")
+        self.assertIn("Imported 3 addresses, rejected 2", out)
+        address = Address.objects.get(raw="Out the back")
+        self.assertEqual(address.locality.name, "Northcote")
+        self.assertEqual(address.latitude, -37.7)
+        self.assertIsNone(Address.objects.get(raw="Unknown").locality)
+
+
+class ExportAddressesTestCase(TestCase):
+    def setUp(self):
+        self.au = Country.objects.create(name="Australia", code="AU")
+        self.vic = State.objects.create(name="Victoria", code="VIC", country=self.au)
+        self.mel = Locality.objects.create(name="Melbourne", postal_code="3000", state=self.vic)
+        self.ad1 = Address.objects.create(
+            street_number="1", route="Some Street", locality=self.mel, raw="1 Some Street", latitude=-37.8
+        )
+        self.ad2 = Address.objects.create(raw="Out the back")
+
+    def test_jsonl(self):
+        out = StringIO()
+        call_command("export_addresses", stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(rows, [self.ad1.as_dict(), self.ad2.as_dict()])
+
+    def test_csv_round_trip(self):
+        path = os.path.join(tempfile.mkdtemp(), "out.csv")
+        try:
+            call_command("export_addresses", "--output", path, stdout=StringIO())
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(rows[0]["state_code"], "VIC")
+            self.assertEqual(rows[1]["locality"], "")
+            Address.objects.all().delete()
+            call_command("import_addresses", path, stdout=StringIO())
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEqual(Address.objects.get(raw="1 Some Street").locality, self.mel)
+        self.assertEqual(Address.objects.get(raw="1 Some Street").latitude, -37.8)
+        self.assertIsNone(Address.objects.get(raw="Out the back").locality)
+
+
+class BackfillGeohashTestCase(TestCase):
+    def test_backfill(self):
+        a = Address.objects.create(raw="Flinders Street Station", latitude=-37.8183, longitude=144.9671)
+        b = Address.objects.create(raw="Nowhere")
+        Address.objects.update(geohash="")
+        out = StringIO()
+        call_command("backfill_geohash", "--chunk-size", "1", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Updated the geohash of 1 addresses.")
+        self.assertEqual(Address.objects.get(pk=a.pk).geohash, "r1r0fg3u6mbm")
+        self.assertEqual(Address.objects.get(pk=b.pk).geohash, "")
+
+
+class FillFormattedTestCase(TestCase):
+    def test_fill(self):
+        au = Country.objects.create(name="Australia", code="AU")
+        mel = Locality.objects.create(
+            name="Melbourne", postal_code="3000", state=State.objects.create(name="Victoria", code="VIC", country=au)
+        )
+        a = Address.objects.create(street_number="1", route="Some Street", locality=mel, raw="x")
+        b = Address.objects.create(formatted="Custom", locality=mel, raw="x")
+        c = Address.objects.create(raw="Out the back")
+        out = StringIO()
+        # Updated rows are reindexed for search and evicted from the cache.
+        with self.settings(ADDRESS_SEARCH_INDEX=True, ADDRESS_CACHE_ALIAS="default"):
+            with mock.patch("address.cache.address_cache.evict") as evict:
+                with self.captureOnCommitCallbacks(execute=True):
+                    call_command("fill_formatted", stdout=out)
+            evict.assert_called_once_with([a.pk])
+            self.assertEqual(Address.objects.search("1 some street melbourne"), [a])
+        self.assertEqual(out.getvalue().strip(), "Filled in the formatted value of 1 addresses.")
+        self.assertEqual(Address.objects.get(pk=a.pk).formatted, "1 Some Street, Melbourne, Victoria 3000, Australia")
+        self.assertEqual(Address.objects.get(pk=b.pk).formatted, "Custom")
+        self.assertEqual(Address.objects.get(pk=c.pk).formatted, "")
+
+
+class RegeocodeAddressesTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.dir, "checkpoint.json")
+        northcote = {
+            "route": "Somewhere Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+        self.geocoder = {
+            "BACKEND": "address.geocoders.FakeGeocoder",
+            "OPTIONS": {
+                "results": {
+                    "1 Somewhere Street": dict(northcote, street_number="1", latitude=-37.77, longitude=144.99),
+                    "2 Somewhere Street": dict(northcote, street_number="2", formatted="Two"),
+                    "Bad code": dict(northcote, country="Nowhere", country_code="Not a code"),
+                    "Inconsistent": {"locality": "Northcote"},
+                }
+            },
+        }
+        self.raws = ["1 Somewhere Street", "Unknown", "2 Somewhere Street", "Bad code", "Inconsistent"]
+        self.addresses = [Address.objects.create(raw=raw) for raw in self.raws]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def call(self, *args):
+        out = StringIO()
+        with override_settings(ADDRESS_GEOCODER=self.geocoder):
+            call_command("regeocode_addresses", "--rate", "0", "--checkpoint", self.checkpoint, *args, stdout=out)
+        return out.getvalue()
+
+    def test_regeocode(self):
+        out = self.call("--chunk-size", "2")
+        self.assertIn("Updated 2 addresses, 2 unmatched, 1 failed.", out)
+        first = Address.objects.get(pk=self.addresses[0].pk)
+        self.assertEqual(first.locality.state.country.code, "AU")
+        self.assertEqual(first.street_number, "1")
+        self.assertEqual(first.geohash, geohash.encode(-37.77, 144.99))
+        self.assertEqual(first.formatted, "1 Somewhere Street, Northcote, Victoria 3070, Australia")
+        second = Address.objects.get(pk=self.addresses[2].pk)
+        self.assertEqual(second.locality, first.locality)
+        self.assertEqual(second.formatted, "Two")
+        self.assertIsNone(second.latitude)
+        self.assertEqual(Address.objects.filter(locality=None).count(), 3)
+        self.assertFalse(Country.objects.filter(code="Not a code").exists())
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)["last_pk"], self.addresses[-1].pk)
+
+    def test_retry(self):
+        # The first two lookups of the first address hit a temporary error.
+        errors = []
+        geocode = FakeGeocoder.geocode
+
+        def flaky(geocoder, raw):
+            if raw == self.raws[0] and len(errors) < 2:
+                errors.append(raw)
+                raise GeocoderError("OVER_QUERY_LIMIT")
+            return geocode(geocoder, raw)
+
+        with mock.patch.object(FakeGeocoder, "geocode", flaky):
+            self.assertIn("Updated 1 addresses, 2 unmatched, 2 failed.", self.call("--chunk-size", "2"))
+            with open(self.checkpoint) as f:
+                self.assertEqual(json.load(f)["retry"], [self.addresses[0].pk])
+            self.assertIn("Updated 2 addresses, 2 unmatched, 1 failed.", self.call())
+        self.assertIsNotNone(Address.objects.get(pk=self.addresses[0].pk).locality)
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)["retry"], [])
+
+    def test_retry_limit(self):
+        def failing(geocoder, raw):
+            raise GeocoderError("OVER_QUERY_LIMIT")
+
+        with mock.patch.object(FakeGeocoder, "geocode", failing), mock.patch.object(
+            regeocode_addresses, "MAX_RETRY", 2
+        ):
+            self.assertIn("Updated 0 addresses, 0 unmatched, 5 failed.", self.call("--chunk-size", "2"))
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)["retry"], [a.pk for a in self.addresses[:2]])
+
+    def test_rate(self):
+        # The command's limit replaces the geocoder's own, rather than both
+        # applying.
+        for args, rate in (((), 100), (("--rate", "50"), 50)):
+            command = regeocode_addresses.Command()
+            with override_settings(ADDRESS_GEOCODER=dict(self.geocoder, RATE=100)):
+                call_command(command, *args, stdout=StringIO())
+            self.assertIsInstance(command.geocoder.geocoder, RateLimitedGeocoder)
+            self.assertEqual(command.geocoder.geocoder.rate, rate)
+            self.assertIsInstance(command.geocoder.geocoder.geocoder, FakeGeocoder)
+        command = regeocode_addresses.Command()
+        with override_settings(ADDRESS_GEOCODER=dict(self.geocoder, RATE=100)):
+            call_command(command, "--rate", "0", stdout=StringIO())
+        self.assertIsInstance(command.geocoder.geocoder, FakeGeocoder)
+
+    def test_resume(self):
+        with open(self.checkpoint, "w") as f:
+            json.dump({"last_pk": self.addresses[0].pk, "updated": 5, "unmatched": 0, "failed": 0}, f)
+        out = self.call()
+        self.assertIn("Resuming after address %d." % self.addresses[0].pk, out)
+        self.assertIn("Updated 6 addresses", out)
+        self.assertIsNone(Address.objects.get(pk=self.addresses[0].pk).locality)
+        self.assertIn("Updated 1 addresses", self.call("--restart"))
+        self.assertIsNotNone(Address.objects.get(pk=self.addresses[0].pk).locality)
@@ -1,6 +1,10 @@
 from django.test import TestCase
-from django.forms import ValidationError, Form
-from address.forms import AddressField, AddressWidget
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.forms import BaseFormSet, ValidationError, Form, formset_factory
+from address.forms import AddressField, AddressFormSetMixin, AddressWidget
+from address.models import Address, to_python
+from address.widgets import prefetch_addresses
 
 
 class TestForm(Form):
@@ -78,6 +82,34 @@ class AddressFieldTestCase(TestCase):
         res = self.field.to_python({"raw": "Someplace"})
         self.assertEqual(res.raw, "Someplace")
 
+    def test_to_python_unchanged(self):
+        data = {
+            "raw": "209 Joralemon Street, Brooklyn, NY, United States",
+            "street_number": "209",
+            "route": "Joralemon St",
+            "locality": "Brooklyn",
+            "postal_code": "11201",
+            "state": "New York",
+            "state_code": "NY",
+            "country": "United States",
+            "country_code": "US",
+            "latitude": "40.69",
+            "longitude": "-73.99",
+        }
+        address = self.field.to_python(dict(data))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.field.to_python(dict(data, id=str(address.pk))), address)
+        self.assertNotEqual(self.field.to_python(dict(data, id=str(address.pk), street_number="210")), address)
+        self.assertEqual(self.field.to_python(dict(data, id="nonsense")), address)
+
+    def test_rendered_id_round_trip(self):
+        address = self.field.to_python({"raw": "Someplace"})
+        widget = AddressWidget()
+        html = widget.render("address", address)
+        self.assertIn('name="address_id" value="%s"' % address.pk, html)
+        data = {"address": "Someplace", "address_id": str(address.pk)}
+        self.assertEqual(self.field.to_python(widget.value_from_datadict(data, {}, "address")), address)
+
     def test_render(self):
         # TODO: Check return value.
         self.form.as_table()
@@ -89,3 +121,89 @@ class AddressWidgetTestCase(TestCase):
         self.assertEqual(wid.attrs["size"], "150")
         html = wid.render("test", None)
         self.assertNotEqual(html.find('size="150"'), -1)
+
+    def test_render_pk(self):
+        address = to_python({"raw": "1 <Some> Street", "formatted": "1 Some Street"})
+        html = AddressWidget().render("test", address.pk)
+        self.assertEqual(html, AddressWidget().render("test", address))
+        self.assertIn('name="test_formatted" data-geo="formatted_address" value="1 Some Street"', html)
+        self.assertIn('name="test_id" value="%s"' % address.pk, html)
+
+    def test_prefetch_addresses(self):
+        addresses = [to_python({"raw": "Place %d" % i}) for i in range(5)]
+        FormSet = formset_factory(TestForm, extra=1)
+        initial = [{"address": a.pk} for a in addresses]
+        expected = [form["address"].as_widget() for form in FormSet(initial=initial)]
+        formset = FormSet(initial=initial)
+        with self.assertNumQueries(1):
+            prefetch_addresses(formset)
+            self.assertEqual([form["address"].as_widget() for form in formset], expected)
+        self.assertEqual(TestForm.base_fields["address"].widget.address_dicts, {})
+
+
+class AddressFormSet(AddressFormSetMixin, BaseFormSet):
+    pass
+
+
+class AddressFormSetMixinTestCase(TestCase):
+    def row(self, i, **kwargs):
+        return dict(
+            {
+                "address": "%d Somewhere Street, Northcote" % i,
+                "address_street_number": str(i),
+                "address_route": "Somewhere Street",
+                "address_locality": "Northcote",
+                "address_postal_code": "3070",
+                "address_state": "Victoria",
+                "address_state_code": "VIC",
+                "address_country": "Australia",
+                "address_country_code": "AU",
+                "address_latitude": "-37.77",
+                "address_longitude": "144.99",
+            },
+            **kwargs
+        )
+
+    def bind(self, rows, formset=AddressFormSet):
+        data = {"form-TOTAL_FORMS": str(len(rows)), "form-INITIAL_FORMS": "0"}
+        for i, row in enumerate(rows):
+            data.update(("form-%d-%s" % (i, k), v) for k, v in row.items())
+        FormSet = formset_factory(TestForm, formset=formset)
+        return FormSet(data)
+
+    def test_resolve(self):
+        rows = [self.row(i) for i in range(20)] + [self.row(0), {"address": ""}]
+        with CaptureQueriesContext(connection) as queries:
+            formset = self.bind(rows)
+            self.assertTrue(formset.is_valid())
+        with CaptureQueriesContext(connection) as unbatched:
+            self.assertTrue(self.bind([self.row(i) for i in range(20, 40)], BaseFormSet).is_valid())
+        self.assertLess(len(queries), len(unbatched) / 2)
+        addresses = [form.cleaned_data.get("address") for form in formset]
+        self.assertEqual([a.street_number for a in addresses[:20]], [str(i) for i in range(20)])
+        self.assertEqual(addresses[20], addresses[0])
+        self.assertIsNone(addresses[21])
+        self.assertEqual(len(set(a.locality_id for a in addresses[:21])), 1)
+        self.assertEqual(Address.objects.count(), 40)
+        self.assertEqual(addresses[0].latitude, -37.77)
+
+    def test_rendered_address_reused(self):
+        formset = self.bind([self.row(1)])
+        self.assertTrue(formset.is_valid())
+        address = formset[0].cleaned_data["address"]
+        formset = self.bind([self.row(1, address_id=str(address.pk)), self.row(2, address_id=str(address.pk))])
+        self.assertTrue(formset.is_valid())
+        self.assertEqual(formset[0].cleaned_data["address"], address)
+        self.assertNotEqual(formset[1].cleaned_data["address"], address)
+
+    def test_errors(self):
+        formset = self.bind(
+            [self.row(1, address_latitude="x"), self.row(2, address_country_code="Not a code"), self.row(3)]
+        )
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.errors[0], {"address": ["Invalid value for latitude"]})
+        self.assertEqual(
+            formset.errors[1], {"address": ["Invalid address: Invalid country code (too long): Not a code"]}
+        )
+        self.assertEqual(formset.errors[2], {})
+        self.assertEqual(formset[2].cleaned_data["address"].street_number, "3")
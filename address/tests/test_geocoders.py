@@ -0,0 +1,169 @@
+import json
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from address.geocoders import (
+    BaseGeocoder,
+    CachedGeocoder,
+    FakeGeocoder,
+    GeocoderError,
+    GoogleGeocoder,
+    RateLimitedGeocoder,
+    get_geocoder,
+    normalize_raw,
+)
+
+NORTHCOTE = {
+    "street_number": "1",
+    "route": "Somewhere Street",
+    "locality": "Northcote",
+    "postal_code": "3070",
+    "state": "Victoria",
+    "state_code": "VIC",
+    "country": "Australia",
+    "country_code": "AU",
+}
+
+
+class FailingGeocoder(BaseGeocoder):
+    def geocode(self, raw):
+        if raw == "fail":
+            raise GeocoderError("Failed")
+        return {"raw": raw, "formatted": raw.upper()}
+
+
+class GeocoderTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.fake = FakeGeocoder({"1 Somewhere Street, Northcote": NORTHCOTE})
+
+    def test_normalize_raw(self):
+        self.assertEqual(normalize_raw("  1 Somewhere  Street ,Northcote, "), "1 somewhere street, northcote")
+
+    def test_fake(self):
+        result = self.fake.geocode("1 SOMEWHERE STREET,  northcote")
+        self.assertEqual(result, dict(NORTHCOTE, raw="1 SOMEWHERE STREET,  northcote"))
+        self.assertIsNone(self.fake.geocode("Nowhere"))
+
+    def test_geocode_many_errors(self):
+        with self.assertRaises(GeocoderError):
+            FailingGeocoder().geocode_many(["a", "fail"])
+        errors = []
+        results = FailingGeocoder().geocode_many(["a", "fail", "b"], on_error=lambda i, e: errors.append(i))
+        self.assertEqual([r and r["formatted"] for r in results], ["A", None, "B"])
+        self.assertEqual(errors, [1])
+
+    def test_cached(self):
+        geocoder = CachedGeocoder(self.fake, maxsize=1)
+        self.assertEqual(geocoder.geocode("1 Somewhere Street, Northcote")["raw"], "1 Somewhere Street, Northcote")
+        self.assertEqual(geocoder.geocode("1 somewhere street,northcote")["raw"], "1 somewhere street,northcote")
+        self.assertIsNone(geocoder.geocode("Nowhere"))
+        self.assertIsNone(geocoder.geocode("nowhere"))
+        self.assertIsNone(geocoder.geocode(" "))
+        self.assertEqual(len(self.fake.calls), 2)
+        geocoder.geocode("1 Somewhere Street, Northcote")
+        self.assertEqual(len(self.fake.calls), 3)
+
+    def test_persistent_cache(self):
+        CachedGeocoder(self.fake, cache="default").geocode("1 Somewhere Street, Northcote")
+        CachedGeocoder(self.fake, cache="default").geocode("Nowhere")
+        geocoder = CachedGeocoder(self.fake, cache="default")
+        self.assertEqual(geocoder.geocode("1 Somewhere Street, Northcote")["locality"], "Northcote")
+        self.assertIsNone(geocoder.geocode("Nowhere"))
+        self.assertEqual(len(self.fake.calls), 2)
+
+    def test_coalescing(self):
+        fake = FakeGeocoder({"Northcote": NORTHCOTE}, delay=0.1)
+        geocoder = CachedGeocoder(fake)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(geocoder.geocode("Northcote"))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual([r["locality"] for r in results], ["Northcote"] * 5)
+
+    def test_cached_geocode_many(self):
+        fake = FakeGeocoder({"Northcote": NORTHCOTE}, delay=0.01)
+        geocoder = CachedGeocoder(fake, workers=3)
+        results = geocoder.geocode_many(["Northcote", "Nowhere", "northcote", "Northcote "])
+        self.assertEqual([r and r["raw"] for r in results], ["Northcote", None, "northcote", "Northcote "])
+        self.assertEqual(len(fake.calls), 2)
+        errors = []
+        results = CachedGeocoder(FailingGeocoder()).geocode_many(["a", "fail"], on_error=lambda i, e: errors.append(i))
+        self.assertEqual(results[1], None)
+        self.assertEqual(errors, [1])
+
+    def test_rate_limited(self):
+        geocoder = RateLimitedGeocoder(self.fake, rate=4)
+        with mock.patch("address.geocoders.time") as time:
+            time.monotonic.return_value = 100.0
+            for _ in range(3):
+                geocoder.geocode("Nowhere")
+        self.assertEqual([c[0][0] for c in time.sleep.call_args_list], [0.25, 0.5])
+        self.assertEqual(len(self.fake.calls), 3)
+
+    def test_google(self):
+        response = mock.MagicMock()
+        response.__enter__.return_value.read.return_value = json.dumps(
+            {
+                "status": "OK",
+                "results": [
+                    {
+                        "address_components": [
+                            {"long_name": "1", "short_name": "1", "types": ["street_number"]},
+                            {"long_name": "Somewhere Street", "short_name": "Somewhere St", "types": ["route"]},
+                            {"long_name": "Northcote", "short_name": "Northcote", "types": ["locality", "political"]},
+                            {
+                                "long_name": "Victoria",
+                                "short_name": "VIC",
+                                "types": ["administrative_area_level_1", "political"],
+                            },
+                            {"long_name": "Australia", "short_name": "AU", "types": ["country", "political"]},
+                            {"long_name": "3070", "short_name": "3070", "types": ["postal_code"]},
+                        ],
+                        "formatted_address": "1 Somewhere St, Northcote VIC 3070, Australia",
+                        "geometry": {"location": {"lat": -37.77, "lng": 144.99}},
+                    }
+                ],
+            }
+        ).encode("utf-8")
+        with mock.patch("address.geocoders.urlopen", return_value=response) as urlopen:
+            result = GoogleGeocoder(api_key="key").geocode("1 Somewhere St")
+        self.assertIn("address=1+Somewhere+St", urlopen.call_args[0][0])
+        self.assertEqual(
+            result,
+            dict(
+                NORTHCOTE,
+                raw="1 Somewhere St",
+                formatted="1 Somewhere St, Northcote VIC 3070, Australia",
+                latitude=-37.77,
+                longitude=144.99,
+            ),
+        )
+
+        response.__enter__.return_value.read.return_value = b'{"status": "ZERO_RESULTS", "results": []}'
+        with mock.patch("address.geocoders.urlopen", return_value=response):
+            self.assertIsNone(GoogleGeocoder(api_key="key").geocode("Nowhere"))
+        response.__enter__.return_value.read.return_value = b'{"status": "OVER_QUERY_LIMIT"}'
+        with mock.patch("address.geocoders.urlopen", return_value=response):
+            with self.assertRaises(GeocoderError):
+                GoogleGeocoder(api_key="key").geocode("Nowhere")
+
+    def test_get_geocoder(self):
+        with override_settings(ADDRESS_GEOCODER=None):
+            with self.assertRaises(ImproperlyConfigured):
+                get_geocoder()
+        config = {"BACKEND": "address.geocoders.FakeGeocoder", "OPTIONS": {"delay": 0}, "WORKERS": 2}
+        with override_settings(ADDRESS_GEOCODER=config):
+            geocoder = get_geocoder()
+            self.assertIs(get_geocoder(), geocoder)
+            self.assertIsInstance(geocoder.geocoder, FakeGeocoder)
+            self.assertEqual(geocoder.workers, 2)
+        with override_settings(ADDRESS_GEOCODER=config):
+            self.assertIsNot(get_geocoder(), geocoder)
@@ -0,0 +1,105 @@
+from django.test import TestCase
+
+from address.cache import hierarchy_cache
+
+from address.localities import LocalityIndex, get_locality_index, reset_locality_index
+from address.models import Country, Locality, State, to_python, to_python_many
+
+
+class LocalityIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = LocalityIndex(
+            localities=[
+                (1, "Northcote", "3070", 10),
+                (2, "Fitzroy North", "3068", 10),
+                (3, "Clifton Hill", "3068", 10),
+                (4, "Northcote", "2000", 11),
+                (5, "Saint-Émile", "G3E", 12),
+            ],
+            states=[(10, "Victoria", "VIC", 100), (11, "New South Wales", "NSW", 100), (12, "Québec", "QC", 101)],
+            countries=[(100, "Australia", "AU"), (101, "Canada", "CA")],
+        )
+
+    def test_by_postal_code(self):
+        self.assertEqual(sorted(r.name for r in self.index.by_postal_code("3068")), ["Clifton Hill", "Fitzroy North"])
+        self.assertEqual([r.id for r in self.index.by_postal_code("3068", state="vic")], [2, 3])
+        self.assertEqual(self.index.by_postal_code("3068", state="NSW"), [])
+        self.assertEqual([r.id for r in self.index.by_postal_code(" g3e ")], [5])
+        self.assertEqual(self.index.by_postal_code("9999"), [])
+
+    def test_by_name_state(self):
+        [row] = self.index.by_name_state("NORTHCOTE", "Victoria")
+        self.assertEqual(tuple(row), (1, "Northcote", "3070", 10, "Victoria", "VIC", 100, "Australia", "AU"))
+        self.assertEqual([r.id for r in self.index.by_name_state("northcote", 11)], [4])
+        self.assertEqual([r.id for r in self.index.by_name_state("saint-emile", "quebec")], [5])
+        self.assertEqual(self.index.by_name_state("Northcote", "QC"), [])
+
+    def test_updates(self):
+        self.index.put_locality(2, "Fitzroy North", "3068", 11)
+        self.assertEqual([r.id for r in self.index.by_postal_code("3068", state=10)], [3])
+        self.index.remove_locality(3)
+        self.index.put_locality(6, "Carlton", "3053", 10)
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.get(6).name, "Carlton")
+        self.assertIsNone(self.index.get(3))
+        self.assertEqual(self.index.by_name_state("Clifton Hill", 10), [])
+        self.index.put_state(10, "Victoria", "V", 100)
+        self.assertEqual(self.index.by_name_state("Carlton", "VIC"), [])
+        self.assertEqual(self.index.get(6).state_code, "V")
+        self.index.remove_country(100)
+        self.assertEqual([r.id for r in self.index.by_postal_code("3068")], [])
+        self.assertEqual(len(self.index), 1)
+
+
+class SharedLocalityIndexTestCase(TestCase):
+    def setUp(self):
+        reset_locality_index()
+        self.addCleanup(reset_locality_index)
+        self.country = Country.objects.create(name="Australia", code="AU")
+        self.state = State.objects.create(name="Victoria", code="VIC", country=self.country)
+        self.locality = Locality.objects.create(name="Northcote", postal_code="3070", state=self.state)
+
+    def test_loaded(self):
+        with self.assertNumQueries(3):
+            index = get_locality_index()
+        with self.assertNumQueries(0):
+            self.assertEqual(index.by_postal_code("3070", "VIC")[0].id, self.locality.pk)
+            self.assertIs(get_locality_index(), index)
+
+    def test_maintained(self):
+        index = get_locality_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            carlton = Locality.objects.create(name="Carlton", postal_code="3053", state=self.state)
+            self.locality.postal_code = "3071"
+            self.locality.save()
+        self.assertEqual(index.by_name_state("carlton", "VIC")[0].id, carlton.pk)
+        self.assertEqual(index.by_postal_code("3070"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.state.code = "V"
+            self.state.save()
+        self.assertEqual(index.get(carlton.pk).state_code, "V")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.state.delete()
+        self.assertEqual(len(index), 0)
+
+    def test_conversions(self):
+        index = get_locality_index()
+        self.addCleanup(hierarchy_cache.clear)
+        value = {
+            "raw": "1 Collins Street, Melbourne",
+            "street_number": "1",
+            "route": "Collins Street",
+            "locality": "Melbourne",
+            "postal_code": "3000",
+            "state": "Victoria",
+            "country": "Australia",
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            to_python(value)
+            to_python_many(
+                [dict(value, locality="Sydney", postal_code="2000", state="New South Wales", state_code="NSW")]
+            )
+        self.assertEqual([r.name for r in index.by_postal_code("3000", "VIC")], ["Melbourne"])
+        [sydney] = index.by_name_state("sydney", "NSW")
+        self.assertEqual((sydney.state_name, sydney.country_code), ("New South Wales", "AU"))
+        self.assertEqual(len(index), 3)
@@ -1,9 +1,16 @@
-from django.test import TestCase
-from django.db import IntegrityError
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import IntegrityError, connection, models
 from django.core.exceptions import ValidationError
 
 from address.models import Country, State, Locality, Address, AddressField
-from address.models import to_python
+from address.models import InconsistentDictError, to_python, to_python_many, _haversine
+from address.models import ato_python, ato_python_many
+from address import geohash
+from address.cache import hierarchy_cache
 
 # Python 3 fixes.
 import sys
@@ -310,6 +317,59 @@ class AddressFieldTestCase(TestCase):
         self.test.address = to_python(self.ad1_dict["raw"])
         self.assertEqual(self.test.address.raw, self.ad1_dict["raw"])
 
+    def test_assignment_from_string_creates_rows(self):
+        self.assertNotEqual(to_python("Somewhere").pk, to_python("Somewhere").pk)
+
+    @override_settings(ADDRESS_DEDUPLICATE_RAW=True)
+    def test_assignment_from_string_deduplicated(self):
+        first = to_python("1 Somewhere  Street ")
+        with self.assertNumQueries(1):
+            self.assertEqual(to_python("1 somewhere street").pk, first.pk)
+        self.assertEqual(to_python("1 Somewhere St.").pk, first.pk)
+        self.assertEqual(to_python({"raw": "1 SOMEWHERE STREET", "locality": "Northcote"}).pk, first.pk)
+        self.assertNotEqual(to_python("2 Somewhere Street").pk, first.pk)
+
+    @override_settings(ADDRESS_DEDUPLICATE_RAW=True)
+    def test_numeric_raw_deduplicated(self):
+        first = Address.objects.create(raw=12345)
+        self.assertEqual(first.raw, "12345")
+        self.assertEqual(to_python("12345").pk, first.pk)
+        self.assertEqual(to_python_many([{"raw": 12345, "locality": "Northcote"}])[0].pk, first.pk)
+
+    @override_settings(ADDRESS_DEDUPLICATE_RAW=True)
+    def test_deduplicated_many(self):
+        first = to_python("1 Somewhere Street")
+        values = [{"raw": raw, "locality": "Northcote"} for raw in ("1 somewhere street", "Elsewhere", "elsewhere")]
+        results = to_python_many(values)
+        self.assertEqual(results[0].pk, first.pk)
+        self.assertEqual(results[1].pk, results[2].pk)
+        self.assertEqual(Address.objects.get(pk=results[1].pk).raw_hash, results[1].raw_hash)
+
+    def test_spelling_variants(self):
+        first = to_python(self.ad1_dict)
+        variant = dict(self.ad1_dict, street_number=" 1", route="SOMEWHERE ST.", raw="1 Somewhere St")
+        self.assertEqual(to_python(variant).pk, first.pk)
+        self.assertEqual(to_python_many([variant])[0].pk, first.pk)
+        self.assertNotEqual(to_python(dict(variant, street_number="2/1")).pk, first.pk)
+        raw = to_python({"raw": "Somewhere St, Northcote"})
+        self.assertEqual(to_python({"raw": "somewhere street,northcote"}).pk, raw.pk)
+
+    def test_numeric_components(self):
+        first = to_python(self.ad1_dict)
+        numeric = dict(self.ad1_dict, street_number=1, postal_code=3070)
+        self.assertEqual(to_python(numeric).pk, first.pk)
+        self.assertEqual(to_python_many([numeric])[0].pk, first.pk)
+        address = Address(street_number=1, route="Somewhere Street", locality=first.locality, raw=1)
+        address.save()
+        self.assertEqual((address.street_number, address.raw), ("1", "1"))
+        self.assertEqual(address.canonical_key, first.canonical_key)
+
+    def test_canonical_key_maintained(self):
+        address = to_python(self.ad1_dict)
+        address.route = "Elsewhere Rd"
+        address.save(update_fields=["route"])
+        self.assertEqual(to_python(dict(self.ad1_dict, route="Elsewhere Road")).pk, address.pk)
+
     # def test_save(self):
     #     self.test.address = self.ad1_dict
     #     self.test.save()
@@ -323,3 +383,586 @@ class AddressFieldTestCase(TestCase):
     #     self.assertEqual(test.address.locality.state.code, self.ad1_dict['state_code'])
     #     self.assertEqual(test.address.locality.state.country.name, self.ad1_dict['country'])
     #     self.assertEqual(test.address.locality.state.country.code, self.ad1_dict['country_code'])
+
+
+class HierarchyCacheTestCase(TestCase):
+    def setUp(self):
+        hierarchy_cache.clear()
+        self.ad_dict = {
+            "raw": "1 Somewhere Street, Northcote, Victoria 3070, VIC, AU",
+            "street_number": "1",
+            "route": "Somewhere Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+
+    def tearDown(self):
+        hierarchy_cache.clear()
+
+    def test_hit_skips_hierarchy_queries(self):
+        first = to_python(self.ad_dict)
+        with self.captureOnCommitCallbacks(execute=True):
+            to_python(self.ad_dict)
+        with self.assertNumQueries(1):
+            second = to_python(self.ad_dict)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(second.locality.state.country.name, "Australia")
+
+    def test_to_python_many_uses_cache(self):
+        first = to_python(self.ad_dict)
+        with self.captureOnCommitCallbacks(execute=True):
+            to_python_many([self.ad_dict])
+        with self.assertNumQueries(1):
+            second = to_python_many([self.ad_dict])[0]
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(second.locality.state.country.name, "Australia")
+
+    def test_uncommitted_rows_are_not_cached(self):
+        to_python(self.ad_dict)
+        self.assertEqual(len(hierarchy_cache), 0)
+
+    def test_rename_invalidates(self):
+        address = to_python(self.ad_dict)
+        with self.captureOnCommitCallbacks(execute=True):
+            to_python(self.ad_dict)
+        state = address.locality.state
+        state.name = "Vic"
+        state.save()
+        self.assertIsNone(hierarchy_cache.get(State, ("Victoria", state.country_id)))
+        self.assertIsNotNone(hierarchy_cache.get(Country, "Australia"))
+
+    def test_delete_invalidates(self):
+        address = to_python(self.ad_dict)
+        with self.captureOnCommitCallbacks(execute=True):
+            to_python(self.ad_dict)
+        self.assertEqual(len(hierarchy_cache), 3)
+        address.locality.state.country.delete()
+        self.assertEqual(len(hierarchy_cache), 0)
+        self.assertNotEqual(to_python(self.ad_dict).pk, address.pk)
+
+    @override_settings(ADDRESS_HIERARCHY_CACHE_SIZE=2)
+    def test_bounded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            to_python(self.ad_dict)
+            to_python(self.ad_dict)
+        self.assertEqual(len(hierarchy_cache), 2)
+        self.assertIsNone(hierarchy_cache.get(Country, "Australia"))
+
+    @override_settings(ADDRESS_HIERARCHY_CACHE_SIZE=0)
+    def test_disabled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            to_python(self.ad_dict)
+            to_python(self.ad_dict)
+        self.assertEqual(len(hierarchy_cache), 0)
+
+    @override_settings(ADDRESS_HIERARCHY_CACHE_MAX_AGE=60)
+    def test_expires(self):
+        with mock.patch("address.cache.time") as time:
+            time.monotonic.return_value = 1000
+            with self.captureOnCommitCallbacks(execute=True):
+                to_python(self.ad_dict)
+                to_python(self.ad_dict)
+            time.monotonic.return_value = 1059
+            self.assertIsNotNone(hierarchy_cache.get(Country, "Australia"))
+            time.monotonic.return_value = 1060
+            self.assertIsNone(hierarchy_cache.get(Country, "Australia"))
+            self.assertEqual(len(hierarchy_cache), 2)
+
+
+class StaleHierarchyTestCase(TransactionTestCase):
+    def setUp(self):
+        hierarchy_cache.clear()
+        self.addCleanup(hierarchy_cache.clear)
+        self.ad_dict = {
+            "raw": "1 Somewhere Street, Northcote, Victoria 3070, VIC, AU",
+            "street_number": "1",
+            "route": "Somewhere Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+
+    def test_deleted_by_another_process(self):
+        address = to_python(self.ad_dict)
+        to_python(self.ad_dict)
+        self.assertEqual(len(hierarchy_cache), 3)
+
+        # Deleting without signals, as another process would appear to.
+        Address.objects.all()._raw_delete("default")
+        Locality.objects.all()._raw_delete("default")
+        other = to_python(dict(self.ad_dict, street_number="2"))
+        self.assertNotEqual(other.locality_id, address.locality_id)
+        self.assertEqual(Locality.objects.get().pk, other.locality_id)
+
+    @override_settings(ADDRESS_SEEDED_REGIONS=True)
+    def test_seeded_region_deleted_by_another_process(self):
+        from address.regions import get_regions, reset_regions
+
+        self.addCleanup(reset_regions)
+        address = to_python(self.ad_dict)
+        reset_regions()
+        self.assertIsNotNone(get_regions().state(address.locality.state.country_id, "Victoria"))
+        Address.objects.all()._raw_delete("default")
+        Locality.objects.all()._raw_delete("default")
+        State.objects.all()._raw_delete("default")
+        other = to_python(dict(self.ad_dict, street_number="2"))
+        self.assertNotEqual(other.locality.state_id, address.locality.state_id)
+        self.assertEqual(State.objects.get().pk, other.locality.state_id)
+
+
+class AsyncToPythonTestCase(TestCase):
+    def setUp(self):
+        hierarchy_cache.clear()
+        self.ad_dict = {
+            "raw": "1 Somewhere Street, Northcote, Victoria 3070, VIC, AU",
+            "street_number": "1",
+            "route": "Somewhere Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+
+    def tearDown(self):
+        hierarchy_cache.clear()
+
+    def test_matches_to_python(self):
+        address = async_to_sync(ato_python)(self.ad_dict)
+        self.assertIsNotNone(address.pk)
+        self.assertEqual(address.locality.state.country.code, "AU")
+        self.assertEqual(to_python(self.ad_dict).pk, address.pk)
+        self.assertEqual(async_to_sync(ato_python)(self.ad_dict).pk, address.pk)
+
+    def test_cached_hierarchy(self):
+        existing = to_python(self.ad_dict)
+        with self.captureOnCommitCallbacks(execute=True):
+            to_python(self.ad_dict)
+        with self.assertNumQueries(1):
+            address = async_to_sync(ato_python)(self.ad_dict)
+        self.assertEqual(address.pk, existing.pk)
+        self.assertEqual(address.locality.state.country.name, "Australia")
+        with self.assertNumQueries(2):
+            address = async_to_sync(ato_python)(dict(self.ad_dict, street_number="2"))
+        self.assertEqual(address.locality.pk, existing.locality.pk)
+        self.assertEqual(address.formatted, "2 Somewhere Street, Northcote, Victoria 3070, Australia")
+
+    def test_other_values(self):
+        convert = async_to_sync(ato_python)
+        self.assertIsNone(convert(None))
+        self.assertIsNone(convert({"raw": ""}))
+        self.assertEqual(convert(3), 3)
+        address = convert("Somewhere")
+        self.assertIs(convert(address), address)
+        self.assertEqual(address.raw, "Somewhere")
+        inconsistent = convert({"raw": "Northcote", "locality": "Northcote"})
+        self.assertEqual(inconsistent.raw, "Northcote")
+        self.assertIsNone(inconsistent.locality)
+        with self.assertRaises(ValidationError):
+            convert([])
+
+    def test_many(self):
+        values = [self.ad_dict, None, dict(self.ad_dict, street_number="2"), self.ad_dict]
+        addresses = async_to_sync(ato_python_many)(iter(values))
+        self.assertIsNone(addresses[1])
+        self.assertEqual(addresses[0].pk, addresses[3].pk)
+        self.assertEqual([a and a.pk for a in addresses], [a and a.pk for a in to_python_many(values)])
+
+
+class AddressOwner(models.Model):
+    # Not backed by a table, so keep deletions of addresses from touching it.
+    address = AddressField(blank=True, null=True, on_delete=models.DO_NOTHING, related_name="+")
+
+    class Meta:
+        app_label = "address"
+        managed = False
+
+
+class AddressDescriptorTestCase(TestCase):
+    def setUp(self):
+        self.ad_dict = {
+            "raw": "1 Somewhere Street, Northcote, Victoria 3070, VIC, AU",
+            "street_number": "1",
+            "route": "Somewhere Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+            "formatted": "1 Somewhere St, Northcote VIC 3070, Australia",
+        }
+
+    def test_unchanged_dict_is_not_resolved(self):
+        owner = AddressOwner(address=self.ad_dict)
+        address = owner.address
+        with self.assertNumQueries(0):
+            owner.address = dict(self.ad_dict, raw="1 Somewhere St")
+        self.assertIs(owner.address, address)
+
+    def test_unloaded_address_not_compared(self):
+        # Assigning costs no more than converting, whether or not the
+        # current address or its hierarchy is loaded.
+        address = to_python(self.ad_dict)
+        with CaptureQueriesContext(connection) as converting:
+            to_python(self.ad_dict)
+        for owner in (AddressOwner(address_id=address.pk), AddressOwner(address=Address.objects.get(pk=address.pk))):
+            with self.assertNumQueries(len(converting)):
+                owner.address = self.ad_dict
+            self.assertEqual(owner.address.pk, address.pk)
+
+    def test_unchanged_raw_address(self):
+        owner = AddressOwner(address={"raw": "Out the back", "locality": "Northcote"})
+        address = owner.address
+        with self.assertNumQueries(0):
+            owner.address = {"raw": "Out the back", "locality": "Northcote"}
+        self.assertIs(owner.address, address)
+
+    def test_changed_dict(self):
+        owner = AddressOwner(address=self.ad_dict)
+        address = owner.address
+        owner.address = dict(self.ad_dict, street_number="2")
+        self.assertNotEqual(owner.address.pk, address.pk)
+        self.assertEqual(owner.address.street_number, "2")
+        owner.address = dict(self.ad_dict, postal_code="3071")
+        self.assertEqual(owner.address.locality.postal_code, "3071")
+
+    def test_fingerprint(self):
+        address = to_python(self.ad_dict)
+        self.assertEqual(address.fingerprint(), Address.objects.get(pk=address.pk).fingerprint())
+        self.assertEqual(to_python({"raw": "Somewhere"}).fingerprint(), ("raw", "Somewhere"))
+        self.assertEqual(
+            to_python({"raw": "Somewhere", "route": "Some Street"}).fingerprint(),
+            ("address", "", "", "", "", "", "Some Street"),
+        )
+
+
+class ConcurrentInsertTestCase(TestCase):
+    def setUp(self):
+        self.ad_dict = {
+            "raw": "1 Somewhere Street, Northcote, Victoria 3070, VIC, AU",
+            "street_number": "1",
+            "route": "Somewhere Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+
+    def test_rows_inserted_by_another_worker(self):
+        # Simulate another request creating the hierarchy between our lookup
+        # and insert by hiding the existing rows from the lookup.
+        existing = to_python(self.ad_dict)
+
+        def missing(model, key, **lookup):
+            raise model.DoesNotExist
+
+        with mock.patch("address.models._cached_get", missing):
+            address = to_python(dict(self.ad_dict, street_number="2"))
+        self.assertEqual(address.locality.pk, existing.locality.pk)
+        self.assertEqual(address.locality.state.pk, existing.locality.state.pk)
+        self.assertEqual(address.locality.state.country.pk, existing.locality.state.country.pk)
+        self.assertEqual(Country.objects.count(), 1)
+        self.assertEqual(Locality.objects.count(), 1)
+
+
+class ToPythonManyTestCase(TestCase):
+    def setUp(self):
+        self.au = Country.objects.create(name="Australia", code="AU")
+        self.vic = State.objects.create(name="Victoria", code="VIC", country=self.au)
+        self.nco = Locality.objects.create(name="Northcote", postal_code="3070", state=self.vic)
+        self.existing = Address.objects.create(
+            street_number="1", route="Somewhere Street", locality=self.nco, raw="1 Somewhere Street"
+        )
+        self.values = [
+            {
+                "raw": "1 Somewhere Street, Northcote, Victoria 3070, VIC, AU",
+                "street_number": "1",
+                "route": "Somewhere Street",
+                "locality": "Northcote",
+                "postal_code": "3070",
+                "state": "Victoria",
+                "state_code": "VIC",
+                "country": "Australia",
+                "country_code": "AU",
+            },
+            None,
+            {
+                "raw": "209 Joralemon Street, Brooklyn, NY, United States",
+                "street_number": "209",
+                "route": "Joralemon St",
+                "sublocality": "Brooklyn",
+                "postal_code": "11201",
+                "state": "New York",
+                "state_code": "NY",
+                "country": "United States",
+                "country_code": "US",
+            },
+            {
+                "raw": "High Street, Leamington Spa",
+                "route": "High Street",
+                "postal_town": "Leamington Spa",
+                "state": "England",
+                "state_code": "England",
+                "country": "United Kingdom",
+                "country_code": "GB",
+                "postal_code": "CV31",
+            },
+            {"raw": "Somewhere"},
+            {"raw": "Inconsistent", "locality": "Northcote"},
+            {
+                "raw": "2 Somewhere Street, Fitzroy, Victoria, AU",
+                "street_number": "2",
+                "route": "Somewhere Street",
+                "locality": "Fitzroy",
+                "state": "Victoria",
+                "country": "Australia",
+            },
+        ]
+
+    def test_matches_to_python(self):
+        results = to_python_many(self.values)
+        self.assertEqual(len(results), len(self.values))
+        self.assertEqual(results[0].pk, self.existing.pk)
+        self.assertIsNone(results[1])
+        self.assertEqual(results[2].locality.name, "Brooklyn")
+        self.assertEqual(results[2].locality.state.country.code, "US")
+        self.assertEqual(results[3].locality.name, "Leamington Spa")
+        self.assertEqual(results[3].locality.state.code, "England")
+        self.assertIsNone(results[4].locality)
+        self.assertIsNone(results[5].locality)
+        self.assertEqual(results[5].raw, "Inconsistent")
+        self.assertEqual(results[6].locality.state, self.vic)
+        self.assertEqual(results[6].formatted, "2 Somewhere Street, Fitzroy, Victoria, Australia")
+        # Inconsistent values always get a new raw address, so leave them out.
+        for value, result in zip(self.values[:5] + self.values[6:], results[:5] + results[6:]):
+            if value is not None:
+                self.assertEqual(to_python(value).pk, result.pk)
+
+    def test_repeated_values_resolve_once(self):
+        results = to_python_many([self.values[2]] * 3)
+        self.assertEqual(len(set(r.pk for r in results)), 1)
+        self.assertEqual(Address.objects.filter(route="Joralemon St").count(), 1)
+
+    def test_query_count_is_independent_of_size(self):
+        # A lookup per level, plus an insert and read back for each level with
+        # missing rows. Addresses take one insert each if the backend can't
+        # return bulk inserted primary keys.
+        with CaptureQueriesContext(connection) as queries:
+            to_python_many(self.values[2:4])
+        self.assertLessEqual(len(queries), 12)
+        with self.assertNumQueries(4):
+            to_python_many(self.values[2:4] * 10)
+
+    def test_invalid_code(self):
+        values = [dict(self.values[2], country="Nowhere", country_code="Not a code"), self.values[2]]
+        self.assertRaises(ValueError, to_python_many, values)
+        errors = []
+        results = to_python_many(values, on_error=lambda index, exc: errors.append((index, exc)))
+        self.assertIsNone(results[0])
+        self.assertEqual(results[1].locality.name, "Brooklyn")
+        self.assertEqual([index for index, exc in errors], [0])
+        self.assertFalse(Country.objects.filter(name="Nowhere").exists())
+
+    def test_invalid_code_for_existing_country(self):
+        results = to_python_many([dict(self.values[0], country_code="Not a code")])
+        self.assertEqual(results[0].pk, self.existing.pk)
+
+    def test_strict(self):
+        errors = []
+        results = to_python_many(self.values[5:6], strict=True, on_error=lambda index, exc: errors.append(exc))
+        self.assertEqual(results, [None])
+        self.assertIsInstance(errors[0], InconsistentDictError)
+
+
+class AddressQuerySetTestCase(TestCase):
+    def setUp(self):
+        self.au = Country.objects.create(name="Australia", code="AU")
+        self.vic = State.objects.create(name="Victoria", code="VIC", country=self.au)
+        self.mel = Locality.objects.create(name="Melbourne", postal_code="3000", state=self.vic)
+        Address.objects.create(
+            street_number="1",
+            route="Some Street",
+            locality=self.mel,
+            raw="1 Some Street, Victoria, Melbourne",
+            latitude=-37.8,
+            longitude=144.9,
+        )
+        Address.objects.create(raw="Out the back")
+
+    def test_as_dicts(self):
+        with self.assertNumQueries(1):
+            dicts = list(Address.objects.order_by("pk").as_dicts())
+        self.assertEqual(dicts, [a.as_dict() for a in Address.objects.order_by("pk")])
+        self.assertEqual(list(dicts[0]), list(Address.objects.order_by("pk")[0].as_dict()))
+
+    def test_with_hierarchy(self):
+        Locality.objects.create(name="Fitzroy", state=self.vic)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [str(a) for a in Address.objects.with_hierarchy().order_by("pk")],
+                ["1 Some Street, Melbourne, Victoria 3000, Australia", "Out the back"],
+            )
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [str(loc) for loc in Locality.objects.with_hierarchy()],
+                ["Fitzroy, Victoria, Australia", "Melbourne, Victoria 3000, Australia"],
+            )
+        with self.assertNumQueries(1):
+            self.assertEqual([str(st) for st in State.objects.with_hierarchy()], ["Victoria, Australia"])
+
+    def test_as_strings(self):
+        coded = Locality.objects.create(
+            name="", state=State.objects.create(code="NSW", country=Country.objects.create(code="XX"))
+        )
+        unnamed = Locality.objects.create(name="Nowhere", state=State.objects.create(country=self.au))
+        for locality in (self.mel, coded, unnamed):
+            Address.objects.create(street_number="2", route="Other Street", locality=locality, raw="x")
+            Address.objects.create(street_number="3", locality=locality, raw="x")
+            Address.objects.create(route="No Number Street", locality=locality, raw="x")
+        Address.objects.create(formatted="Formatted", locality=self.mel, raw="x")
+        addresses = Address.objects.order_by("pk")
+        with self.assertNumQueries(1):
+            strings = list(addresses.as_strings())
+        self.assertEqual(strings, [str(a) for a in addresses])
+        self.assertEqual(strings[2], "2 Other Street, Melbourne, Victoria 3000, Australia")
+        self.assertEqual(strings[5], "2 Other Street, NSW, XX")
+
+
+@override_settings(ADDRESS_SYNC_FORMATTED=True)
+class SyncFormattedTestCase(TestCase):
+    def setUp(self):
+        self.au = Country.objects.create(name="Australia", code="AU")
+        self.vic = State.objects.create(name="Victoria", code="VIC", country=self.au)
+        self.mel = Locality.objects.create(name="Melbourne", postal_code="3000", state=self.vic)
+        self.fitzroy = Locality.objects.create(name="Fitzroy", postal_code="3065", state=self.vic)
+        self.derived = Address.objects.create(street_number="1", route="Some Street", locality=self.mel, raw="x")
+        self.numberless = Address.objects.create(route="Some Street", locality=self.fitzroy, raw="x")
+        self.google = Address.objects.create(formatted="1 Some St, Melbourne VIC 3000", locality=self.mel, raw="x")
+
+    def formatted(self, address):
+        return Address.objects.get(pk=address.pk).formatted
+
+    def test_filled_on_save(self):
+        self.assertEqual(self.formatted(self.derived), "1 Some Street, Melbourne, Victoria 3000, Australia")
+        self.assertEqual(self.formatted(self.numberless), "Fitzroy, Victoria 3065, Australia")
+        self.assertEqual(self.formatted(Address.objects.create(raw="Out the back")), "")
+        with override_settings(ADDRESS_SYNC_FORMATTED=False):
+            self.assertEqual(self.formatted(Address.objects.create(locality=self.mel, raw="x")), "")
+
+    def test_address_edited(self):
+        address = Address.objects.get(pk=self.derived.pk)
+        address.street_number = "2"
+        address.save(update_fields=["street_number"])
+        self.assertEqual(self.formatted(address), "2 Some Street, Melbourne, Victoria 3000, Australia")
+        address.formatted = "Custom"
+        address.save()
+        address.route = "Other Street"
+        address.save()
+        self.assertEqual(self.formatted(address), "Custom")
+
+    def test_locality_renamed(self):
+        self.mel.name = "Naarm"
+        self.mel.save()
+        self.assertEqual(self.formatted(self.derived), "1 Some Street, Naarm, Victoria 3000, Australia")
+        self.assertEqual(self.formatted(self.google), "1 Some St, Melbourne VIC 3000")
+        self.assertEqual(self.formatted(self.numberless), "Fitzroy, Victoria 3065, Australia")
+
+    def test_country_renamed(self):
+        Address.objects.filter(pk=self.numberless.pk).update(formatted="")
+        with CaptureQueriesContext(connection) as queries:
+            self.au.name = "Commonwealth of Australia"
+            self.au.save()
+        updates = [q for q in queries if q["sql"].startswith('UPDATE "address_address"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(
+            self.formatted(self.derived), "1 Some Street, Melbourne, Victoria 3000, Commonwealth of Australia"
+        )
+        self.assertEqual(self.formatted(self.numberless), "Fitzroy, Victoria 3065, Commonwealth of Australia")
+        self.assertEqual(self.formatted(self.google), "1 Some St, Melbourne VIC 3000")
+
+    def test_state_renamed(self):
+        self.vic.name = ""
+        self.vic.save()
+        self.assertEqual(self.formatted(self.derived), "1 Some Street, Melbourne, VIC 3000, Australia")
+        self.assertEqual(self.formatted(self.numberless), "Fitzroy, VIC 3065, Australia")
+
+
+class GeoQueryTestCase(TestCase):
+    def setUp(self):
+        self.points = {
+            "flinders": (-37.8183, 144.9671),
+            "carlton": (-37.8001, 144.9671),
+            "st_kilda": (-37.8676, 144.9809),
+            "sydney": (-33.8688, 151.2093),
+            "suva": (-18.1416, 178.4419),
+            "apia": (-13.8333, -171.7667),
+            "nowhere": (None, None),
+        }
+        for raw, (latitude, longitude) in self.points.items():
+            Address.objects.create(raw=raw, latitude=latitude, longitude=longitude)
+
+    def raws(self, qs):
+        return sorted(a.raw for a in qs)
+
+    def test_in_bbox(self):
+        self.assertEqual(self.raws(Address.objects.in_bbox(-38, 144, -37, 146)), ["carlton", "flinders", "st_kilda"])
+
+    def test_in_bbox_across_antimeridian(self):
+        self.assertEqual(self.raws(Address.objects.in_bbox(-20, 170, -10, -170)), ["apia", "suva"])
+
+    def test_within_radius(self):
+        qs = Address.objects.within_radius(-37.8136, 144.9631, 5).order_by("distance")
+        self.assertEqual([a.raw for a in qs], ["flinders", "carlton"])
+        self.assertAlmostEqual(qs[1].distance, 1.54, places=2)
+
+    def test_within_radius_across_antimeridian(self):
+        self.assertEqual(self.raws(Address.objects.within_radius(-16, 180, 1000)), ["apia", "suva"])
+
+    def test_within_radius_near_pole(self):
+        self.assertEqual(len(Address.objects.within_radius(-89, 0, 10000)), 6)
+        self.assertEqual(len(Address.objects.within_radius(-89, 0, 6000)), 3)
+
+    def test_geohash(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+        self.assertEqual(Address.objects.get(raw="flinders").geohash, geohash.encode(-37.8183, 144.9671))
+        self.assertEqual(Address.objects.get(raw="nowhere").geohash, "")
+
+    def test_geohash_saved_with_coordinates(self):
+        address = Address.objects.get(raw="nowhere")
+        address.latitude, address.longitude = -33.8688, 151.2093
+        address.save(update_fields=["latitude", "longitude"])
+        self.assertEqual(Address.objects.get(pk=address.pk).geohash, geohash.encode(-33.8688, 151.2093))
+
+    def test_neighbours(self):
+        cell = geohash.encode(-37.8136, 144.9631, 5)
+        self.assertEqual(len(set(geohash.neighbours(cell))), 8)
+        self.assertEqual(len(geohash.neighbours(geohash.encode(89.99, 0, 3))), 5)
+
+    def brute_force(self, latitude, longitude, k):
+        qs = Address.objects.exclude(latitude=None).annotate(distance=_haversine(latitude, longitude))
+        return [a.raw for a in qs.order_by("distance")[:k]]
+
+    def test_nearest(self):
+        found = Address.objects.nearest(-37.8136, 144.9631, 2)
+        self.assertEqual([a.raw for a in found], ["flinders", "carlton"])
+        self.assertAlmostEqual(found[1].distance, 1.54, places=2)
+
+    def test_nearest_matches_brute_force(self):
+        for latitude, longitude in [(-37.8136, 144.9631), (-16, 180), (-16, -179.9), (60, 10), (-89, 0)]:
+            for k in (1, 3, 6):
+                found = Address.objects.nearest(latitude, longitude, k)
+                self.assertEqual([a.raw for a in found], self.brute_force(latitude, longitude, k))
+
+    def test_nearest_too_few(self):
+        self.assertEqual(len(Address.objects.nearest(0, 0, 10)), 6)
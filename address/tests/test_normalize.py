@@ -0,0 +1,40 @@
+from django.test import SimpleTestCase
+
+from address.normalize import address_key, fold, normalize_route, normalize_text, parse_number, raw_key
+
+
+class NormalizeTestCase(SimpleTestCase):
+    def test_fold(self):
+        self.assertEqual(fold("Émile Straße Ørsted"), "emile strasse orsted")
+
+    def test_normalize_route(self):
+        for route in ("N. Main St", "north main street", "NORTH  MAIN ST.", "N Main Street"):
+            self.assertEqual(normalize_route(route), "north main street")
+        self.assertEqual(normalize_route("Main St NW"), normalize_route("Main Street Northwest"))
+        self.assertEqual(normalize_route("St Kilda Rd"), "st kilda road")
+        self.assertEqual(normalize_route("E St"), "e street")
+        self.assertEqual(normalize_route("N Street NW"), "n street northwest")
+        self.assertEqual(normalize_route("Avenue N"), "avenue n")
+        self.assertNotEqual(normalize_route("E St"), normalize_route("East St"))
+        self.assertEqual(normalize_route("N Main"), "north main")
+        self.assertEqual(normalize_route("Mt Alexander Rd"), "mount alexander road")
+        self.assertEqual(normalize_route("O'Connell St"), "oconnell street")
+        self.assertEqual(normalize_route("Rue Émile-Zola"), "rue emile zola")
+        self.assertEqual(normalize_route(""), "")
+
+    def test_parse_number(self):
+        for number in ("Unit 3, 12 A", "3/12a", "3 / 12A", "Apt 3 12a", "#3 12A"):
+            self.assertEqual(parse_number(number), ("3", "12a"))
+        self.assertEqual(parse_number("12 - 14"), ("", "12-14"))
+        self.assertEqual(parse_number("12"), ("", "12"))
+        self.assertEqual(parse_number(""), ("", ""))
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text("12 Smith St., Northcote  VIC 3070,"), "12 smith street, northcote vic 3070")
+
+    def test_keys(self):
+        self.assertEqual(address_key("12", "Smith St", 1), address_key("12", "Smith Street", 1))
+        self.assertNotEqual(address_key("12", "Smith St", 1), address_key("12", "Smith St", 2))
+        self.assertNotEqual(address_key("12", "Smith St", None), address_key("3/12", "Smith St", None))
+        self.assertEqual(raw_key("12 Smith St, Northcote"), raw_key("12 smith street,northcote"))
+        self.assertNotEqual(raw_key("12 Smith St"), address_key("12", "Smith St", None))
@@ -0,0 +1,89 @@
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from address.models import Country, State, to_python, to_python_many
+from address.regions import get_regions, reference_regions, reset_regions, seed_regions
+
+
+class SeedRegionsTestCase(TestCase):
+    def test_reference_regions(self):
+        countries, subdivisions = reference_regions()
+        self.assertIn(("AU", "Australia"), countries)
+        self.assertIn(("VIC", "Victoria"), subdivisions["AU"])
+        self.assertTrue(all(len(name) <= 40 for _, name in countries))
+
+    def test_seed(self):
+        australia = Country.objects.create(name="australia", code="")
+        vic = State.objects.create(name="Vic.", code="VIC", country=australia)
+        State.objects.create(name="Victoria", code="", country=Country.objects.create(name="Seychelles", code="SC"))
+        # A few statements however many states, plus reading back the new
+        # country where inserts don't report primary keys.
+        with CaptureQueriesContext(connection) as queries:
+            counts = seed_regions(countries=["au", "nz"])
+        self.assertLessEqual(len(queries), 8)
+        self.assertEqual(counts, (1, 1, 24, 0))
+        australia.refresh_from_db()
+        self.assertEqual((australia.name, australia.code), ("australia", "AU"))
+        self.assertEqual(State.objects.get(country=australia, code="VIC"), vic)
+        self.assertEqual(State.objects.filter(country=australia).count(), 8)
+        self.assertEqual(Country.objects.get(code="NZ").name, "New Zealand")
+        self.assertEqual(seed_regions(countries=["AU", "NZ"]), (0, 0, 0, 0))
+
+    def test_command(self):
+        out = StringIO()
+        call_command("seed_regions", "--country", "AU", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Created 1 and updated 0 countries, created 8 and updated 0 states.")
+        with self.assertRaises(CommandError):
+            call_command("seed_regions", "--country", "XX", stdout=out)
+
+
+@override_settings(ADDRESS_SEEDED_REGIONS=True)
+class SeededRegionsTestCase(TestCase):
+    def setUp(self):
+        reset_regions()
+        self.addCleanup(reset_regions)
+        with self.captureOnCommitCallbacks(execute=True):
+            seed_regions(countries=["AU"])
+        self.victoria = State.objects.get(code="VIC")
+        self.value = {
+            "raw": "12 Smith Street, Northcote",
+            "street_number": "12",
+            "route": "Smith Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Vic",
+            "state_code": "VIC",
+            "country": "Commonwealth of Australia",
+            "country_code": "AU",
+        }
+
+    def test_to_python(self):
+        get_regions()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_regions().state(self.victoria.country_id, "victoria"), self.victoria)
+        address = to_python(self.value)
+        self.assertEqual(address.locality.state, self.victoria)
+        self.assertEqual(address.locality.state.country.name, "Australia")
+        self.assertEqual(Country.objects.count(), 1)
+        self.assertEqual(State.objects.count(), 8)
+
+    def test_to_python_many(self):
+        [address] = to_python_many([self.value])
+        self.assertEqual(address.locality.state, self.victoria)
+        self.assertEqual(State.objects.count(), 8)
+
+    def test_unseeded_still_created(self):
+        address = to_python(dict(self.value, country="New Zealand", country_code="NZ", state="Auckland"))
+        self.assertEqual(address.locality.state.country.code, "NZ")
+        self.assertEqual(Country.objects.count(), 2)
+
+    def test_reloaded_after_changes(self):
+        regions = get_regions()
+        with self.captureOnCommitCallbacks(execute=True):
+            State.objects.create(name="Jervis Bay Territory", code="JBT", country=self.victoria.country)
+        self.assertIsNot(get_regions(), regions)
+        self.assertIsNotNone(get_regions().state(self.victoria.country, "", "JBT"))
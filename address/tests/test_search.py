@@ -0,0 +1,80 @@
+from io import StringIO
+
+from django.contrib.admin.sites import site
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from address.models import Address, AddressTrigram, to_python, to_python_many
+from address.search import trigrams
+
+
+@override_settings(ADDRESS_SEARCH_INDEX=True)
+class SearchTestCase(TestCase):
+    def setUp(self):
+        self.components = {
+            "street_number": "12",
+            "route": "Smith Street",
+            "locality": "Northcote",
+            "postal_code": "3070",
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+        self.smith = to_python(dict(self.components, raw="12 Smith Street, Northcote"))
+        self.high = Address.objects.create(raw="1 High Street, Preston")
+        self.station = Address.objects.create(raw="Flinders Street Station", formatted="Flinders St, Melbourne")
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams("St."), {"  s", " st", "st "})
+        self.assertEqual(trigrams("Émile"), trigrams("emile"))
+
+    def test_search(self):
+        results = Address.objects.search("12 Smtih Stret")
+        self.assertEqual(results[0], self.smith)
+        self.assertGreater(results[0].similarity, 0.5)
+        self.assertLessEqual(results[0].similarity, 1)
+        self.assertEqual(Address.objects.search("flinders melbourne")[0], self.station)
+        self.assertEqual(Address.objects.search("Nowhere at all"), [])
+        self.assertEqual(Address.objects.search("  "), [])
+        self.assertEqual(len(Address.objects.search("street", limit=2, threshold=0.1)), 2)
+
+    def test_search_queryset(self):
+        self.assertNotIn(self.smith, Address.objects.exclude(pk=self.smith.pk).search("12 Smith Street"))
+        self.assertEqual(Address.objects.filter(locality=None).search("high street preston"), [self.high])
+
+    def test_maintained_on_save(self):
+        self.high.raw = "7 Plenty Road, Preston"
+        self.high.save()
+        self.assertEqual(Address.objects.search("high street preston"), [])
+        self.assertEqual(Address.objects.search("plenty road preston"), [self.high])
+        with self.assertNumQueries(1):
+            self.high.save(update_fields=["latitude"])
+        self.high.delete()
+        self.assertFalse(AddressTrigram.objects.filter(address_id=self.high.pk).exists())
+
+    def test_bulk_inserts_indexed(self):
+        many = to_python_many([dict(self.components, raw="5 Smith Street", street_number="5")])
+        self.assertEqual(Address.objects.search("5 Smith Street")[0], many[0])
+
+    def test_admin(self):
+        model_admin = site._registry[Address]
+        model_admin.similar_search_limit = 1
+        self.addCleanup(delattr, model_admin, "similar_search_limit")
+        results, _ = model_admin.get_search_results(None, Address.objects.all(), "Street")
+        self.assertEqual(set(results), {self.smith, self.high, self.station})
+        results, _ = model_admin.get_search_results(None, Address.objects.all(), "12 Smtih Stret")
+        self.assertEqual(list(results), [self.smith])
+
+    def test_rebuild(self):
+        AddressTrigram.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_search_index", "--chunk-size", "2", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Indexed 3 addresses for search.")
+        self.assertEqual(Address.objects.search("high street preston"), [self.high])
+
+    @override_settings(ADDRESS_SEARCH_INDEX=False)
+    def test_unavailable(self):
+        with self.assertRaises(ImproperlyConfigured):
+            Address.objects.search("12 Smith Street")
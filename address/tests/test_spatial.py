@@ -0,0 +1,83 @@
+import random
+import unittest
+
+from django.test import TestCase
+
+from address.models import Address
+from address.spatial import SpatialIndex, np
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class SpatialIndexTestCase(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.points = [(-37.81, 144.96), (-33.87, 151.21), (-16.0, 179.99), (-16.0, -179.99), (89.9, 10.0)]
+        self.points += [(-37.81 + rng.gauss(0, 0.1), 144.96 + rng.gauss(0, 0.1)) for _ in range(200)]
+        self.points += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(100)]
+        for i, (latitude, longitude) in enumerate(self.points):
+            Address.objects.create(raw="Address %d" % i, latitude=latitude, longitude=longitude)
+        Address.objects.create(raw="Nowhere")
+        self.queries = [(-37.8, 145.0), (-16.0, 180.0), (90.0, 0.0), (0.0, 0.0), (51.5, -0.1)]
+
+    def distances(self, latitude, longitude):
+        rows = Address.objects.exclude(latitude=None).values_list("pk", "latitude", "longitude")
+        ids, latitudes, longitudes = zip(*rows)
+        phi, lam = np.radians(latitudes), np.radians(longitudes)
+        a = (
+            np.sin((phi - np.radians(latitude)) / 2) ** 2
+            + np.cos(phi) * np.cos(np.radians(latitude)) * np.sin((lam - np.radians(longitude)) / 2) ** 2
+        )
+        return np.array(ids), 2 * 6371.0088 * np.arcsin(np.sqrt(a))
+
+    def test_load(self):
+        index = SpatialIndex.load()
+        self.assertEqual(len(index), len(self.points))
+        southern = SpatialIndex.load(Address.objects.filter(latitude__lt=0))
+        self.assertEqual(len(southern), len([p for p in self.points if p[0] < 0]))
+
+    def test_within_radius(self):
+        index = SpatialIndex.load()
+        for km in (1, 50, 3000):
+            results = index.within_radius(self.queries, km)
+            for (latitude, longitude), found in zip(self.queries, results):
+                ids, distances = self.distances(latitude, longitude)
+                self.assertEqual(sorted(found), sorted(ids[distances <= km]))
+
+    def test_nearest(self):
+        index = SpatialIndex.load(cell_km=5)
+        ids, distances = index.nearest(self.queries, k=10)
+        self.assertEqual(ids.shape, (5, 10))
+        for row, (latitude, longitude) in enumerate(self.queries):
+            expected_ids, expected = self.distances(latitude, longitude)
+            order = np.argsort(expected)[:10]
+            self.assertEqual(list(ids[row]), list(expected_ids[order]))
+            np.testing.assert_allclose(distances[row], expected[order], rtol=1e-6)
+
+    def test_nearest_more_than_indexed(self):
+        ids, distances = SpatialIndex.load(Address.objects.filter(raw="Address 0")).nearest([(0, 0)], k=3)
+        self.assertEqual(ids.shape, (1, 1))
+        ids, distances = SpatialIndex([], [], []).nearest([(0, 0)], k=3)
+        self.assertEqual(ids.shape, (1, 0))
+
+    def test_refresh(self):
+        index = SpatialIndex.load()
+        moved = Address.objects.get(raw="Address 0")
+        moved.latitude, moved.longitude = 51.5, -0.1
+        moved.save()
+        added = Address.objects.create(raw="Added", latitude=51.6, longitude=-0.1)
+        cleared = Address.objects.get(raw="Address 1")
+        cleared.latitude = None
+        cleared.save()
+        deleted = Address.objects.get(raw="Address 2")
+        Address.objects.filter(pk=deleted.pk).delete()
+
+        index.refresh()
+        self.assertEqual(len(index), len(self.points) - 1)
+        ids, _ = index.nearest([(51.5, -0.1)], k=2)
+        self.assertEqual(list(ids[0]), [moved.pk, added.pk])
+        self.assertNotIn(cleared.pk, index.ids)
+        self.assertNotIn(deleted.pk, index.ids)
+
+        Address.objects.filter(pk=added.pk).delete()
+        index.refresh(prune=False)
+        self.assertIn(added.pk, index.ids)
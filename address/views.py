@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
+
+from .autocomplete import autocomplete_hints, autocomplete_index, prefix_key
+
+__all__ = ["autocomplete"]
+
+# The most suggestions a client may ask for.
+MAX_LIMIT = 20
+
+
+def can_suggest_addresses(user):
+    """
+    Whether `user` may be shown stored addresses, rather than only
+    localities. Addresses belong to people, so this needs permission to
+    view them unless `ADDRESS_AUTOCOMPLETE_PUBLIC` is set.
+    """
+    if getattr(settings, "ADDRESS_AUTOCOMPLETE_PUBLIC", False):
+        return True
+    return user is not None and user.has_perm("address.view_address")
+
+
+@require_GET
+def autocomplete(request):
+    """
+    Suggest stored localities and addresses starting with the `q` parameter
+    as JSON, along with the hints from `autocomplete_hints`.
+    """
+    q = request.GET.get("q", "")
+    try:
+        limit = min(max(int(request.GET.get("limit", 10)), 1), MAX_LIMIT)
+    except ValueError:
+        limit = 10
+    hints = autocomplete_hints()
+    results = []
+    if len(prefix_key(q)) >= hints["min_length"]:
+        results = autocomplete_index.suggest(q, limit, addresses=can_suggest_addresses(getattr(request, "user", None)))
+    response = JsonResponse(dict(hints, query=q, results=results))
+    # Suggestions depend on the user, so may only be cached by their browser.
+    patch_cache_control(response, private=True, max_age=60)
+    return response
@@ -1,11 +1,16 @@
 import django
 from django import forms
 from django.conf import settings
+from django.urls import NoReverseMatch, reverse
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
+from .autocomplete import autocomplete_hints
+from .cache import address_cache
 from .models import Address
 
+__all__ = ["AddressWidget", "prefetch_addresses"]
+
 USE_DJANGO_JQUERY = getattr(settings, "USE_DJANGO_JQUERY", False)
 JQUERY_URL = getattr(
     settings,
@@ -57,6 +62,9 @@ class AddressWidget(forms.TextInput):
             js.extend(jquery_paths)
 
     def __init__(self, *args, **kwargs):
+        # Dictionaries of addresses by primary key, filled in by
+        # `prefetch_addresses` and shared between widgets.
+        self.address_dicts = {}
         attrs = kwargs.get("attrs", {})
         classes = attrs.get("class", "")
         classes += (" " if classes else "") + "address"
@@ -64,39 +72,107 @@ class AddressWidget(forms.TextInput):
         kwargs["attrs"] = attrs
         super(AddressWidget, self).__init__(*args, **kwargs)
 
+    def __deepcopy__(self, memo):
+        # Each form gets its own copy of the widget, which mustn't hold on to
+        # addresses prefetched for another.
+        obj = super(AddressWidget, self).__deepcopy__(memo)
+        obj.address_dicts = {}
+        return obj
+
     def render(self, name, value, attrs=None, **kwargs):
 
-        # Can accept None, a dictionary of values or an Address object.
+        # Can accept None, a dictionary of values, an Address object or the
+        # primary key of one, which is looked up among any prefetched
+        # addresses first.
         if value in (None, ""):
             ad = {}
         elif isinstance(value, dict):
             ad = value
         elif isinstance(value, int):
-            ad = Address.objects.get(pk=value)
-            ad = ad.as_dict()
+            ad = self.address_dicts.get(value)
+            if ad is None:
+                ad = address_cache.dicts([value]).get(value)
+                if ad is None:
+                    raise Address.DoesNotExist("Address matching query does not exist.")
         else:
-            ad = value.as_dict()
+            ad = dict(value.as_dict(), id=value.pk)
 
         # Generate the elements. We should create a suite of hidden fields
         # For each individual component, and a visible field for the raw
         # input. Begin by generating the raw input.
+        attrs = dict(self.autocomplete_attrs(), **(attrs or {}))
         elems = [super(AddressWidget, self).render(name, escape(ad.get("formatted", "")), attrs, **kwargs)]
 
-        # Now add the hidden fields.
-        elems.append('<div id="%s_components" style="display: none;">' % name)
-        for com in self.components:
-            elems.append(
-                '<input type="hidden" name="%s_%s" data-geo="%s" value="%s" />'
-                % (name, com[0], com[1], escape(ad.get(com[0], "")))
-            )
-        elems.append("</div>")
+        # Now add the hidden fields for each component, and remember which
+        # address was rendered, so an unchanged submission can reuse it
+        # without resolving the components again.
+        values = dict((com[0], escape(ad.get(com[0], ""))) for com in self.components)
+        values.update(name=name, id=escape(ad.get("id", "")))
+        elems.append(self._hidden_template() % values)
 
         return mark_safe("\n".join(elems))
 
+    def autocomplete_attrs(self):
+        """
+        Point the widget's script at the autocomplete view, when its URLs
+        are included, so stored addresses are suggested before asking
+        Google.
+        """
+        try:
+            url = reverse("address:autocomplete")
+        except NoReverseMatch:
+            return {}
+        hints = autocomplete_hints()
+        return {
+            "data-autocomplete-url": url,
+            "data-autocomplete-debounce": hints["debounce"],
+            "data-autocomplete-min-length": hints["min_length"],
+        }
+
+    @classmethod
+    def _hidden_template(cls):
+        """
+        The markup of the hidden inputs, with placeholders for the widget
+        name and each value. Built once for each widget class.
+        """
+        template = cls.__dict__.get("_compiled_hidden_template")
+        if template is None:
+            elems = ['<div id="%(name)s_components" style="display: none;">']
+            for key, geo in cls.components:
+                hidden = '<input type="hidden" name="%%(name)s_%s" data-geo="%s" value="%%(%s)s" />'
+                elems.append(hidden % (key, geo, key))
+            elems.append('<input type="hidden" name="%(name)s_id" value="%(id)s" />')
+            elems.append("</div>")
+            template = cls._compiled_hidden_template = "\n".join(elems)
+        return template
+
     def value_from_datadict(self, data, files, name):
         raw = data.get(name, "")
         if not raw:
             return raw
         ad = dict([(c[0], data.get(name + "_" + c[0], "")) for c in self.components])
         ad["raw"] = raw
+        ad["id"] = data.get(name + "_id", "")
         return ad
+
+
+def prefetch_addresses(forms):
+    """
+    Load the addresses shown by every `AddressWidget` in `forms`, which may
+    be a form, a formset or a list of forms, with a single query. Rendering
+    the widgets afterwards doesn't query the database at all.
+    """
+    if hasattr(forms, "fields"):
+        forms = [forms]
+    widgets = []
+    pks = set()
+    for form in forms:
+        for name, field in form.fields.items():
+            if isinstance(field.widget, AddressWidget):
+                widgets.append(field.widget)
+                value = form[name].value()
+                if isinstance(value, int):
+                    pks.add(value)
+    dicts = address_cache.dicts(pks)
+    for widget in widgets:
+        widget.address_dicts = dicts
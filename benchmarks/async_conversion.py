@@ -0,0 +1,85 @@
+"""
+Time concurrent requests that each convert a few address dictionaries from
+async code: one `sync_to_async(to_python)` hop per field, `ato_python` per
+field, and one `ato_python_many` per request. Most dictionaries name
+addresses that already exist, as repeat customers would.
+
+    python benchmarks/async_conversion.py --requests 2000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import random
+
+from common import setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--fields", type=int, default=3)
+    parser.add_argument("--localities", type=int, default=50)
+    parser.add_argument("--new", type=float, default=0.05, help="Fraction of addresses not seen before.")
+    args = parser.parse_args()
+
+    setup()
+    from asgiref.sync import sync_to_async
+
+    from address.models import ato_python, ato_python_many, to_python
+
+    rng = random.Random(0)
+
+    def value(i):
+        n = rng.randrange(args.localities)
+        return {
+            "raw": "%d Some Street, Suburb %d" % (i, n),
+            "street_number": str(i),
+            "route": "Some Street",
+            "locality": "Suburb %d" % n,
+            "postal_code": str(3000 + n),
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+
+    known = [value(i) for i in range(1000)]
+    for v in known + known:
+        to_python(v)
+
+    def workload(start):
+        def fields(offset):
+            return [value(offset + i) if rng.random() < args.new else rng.choice(known) for i in range(args.fields)]
+
+        return [fields(offset) for offset in range(start, start + args.requests * args.fields, args.fields)]
+
+    async def hop(values):
+        return [await sync_to_async(to_python)(v) for v in values]
+
+    async def native(values):
+        return [await ato_python(v) for v in values]
+
+    async def batch(values):
+        return await ato_python_many(values)
+
+    async def serve(handler, requests):
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def request(values):
+            async with semaphore:
+                return await handler(values)
+
+        return await asyncio.gather(*[request(values) for values in requests])
+
+    offset = 10**6
+    for label, handler in (("sync_to_async(to_python)", hop), ("ato_python", native), ("ato_python_many", batch)):
+        requests = workload(offset)
+        offset += args.requests * args.fields
+        with timer("%s, %d requests" % (label, args.requests), args.requests):
+            results = asyncio.run(serve(handler, requests))
+        assert all(a.pk for r in results for a in r)
+
+
+if __name__ == "__main__":
+    main()
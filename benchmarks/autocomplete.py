@@ -0,0 +1,63 @@
+"""
+Time building the autocomplete index of localities and suggesting
+addresses for typed prefixes, first and repeated. Addresses are looked up
+with a query, so the index stays the size of the localities however many
+addresses there are.
+
+    python benchmarks/autocomplete.py --rows 100000 --queries 1000
+"""
+
+import argparse
+import random
+import tracemalloc
+
+from common import setup, timer
+from search import TYPES, name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    setup()
+    from address.autocomplete import AutocompleteIndex
+    from address.models import Address, Country, Locality, State, _insert_addresses
+
+    rng = random.Random(0)
+    streets = ["%s %s" % (name(rng), rng.choice(TYPES)) for _ in range(args.rows // 20)]
+    suburbs = [name(rng) for _ in range(500)]
+    raws = ["%d %s, %s" % (rng.randrange(1, 300), rng.choice(streets), rng.choice(suburbs)) for _ in range(args.rows)]
+    if Address.objects.count() < args.rows:
+        with timer("insert %d addresses" % args.rows, args.rows):
+            for start in range(0, len(raws), 5000):
+                _insert_addresses([Address(raw=raw) for raw in raws[start : start + 5000]])  # noqa: E203
+
+    if not Locality.objects.exists():
+        country = Country.objects.create(name="Australia", code="AU")
+        state = State.objects.create(name="Victoria", code="VIC", country=country)
+        Locality.objects.bulk_create(
+            [Locality(name=suburb, postal_code="3%03d" % i, state=state) for i, suburb in enumerate(suburbs)],
+            ignore_conflicts=True,
+        )
+
+    index = AutocompleteIndex(cache_size=4096)
+    tracemalloc.start()
+    with timer("build index", Locality.objects.count()):
+        index.suggest("x", addresses=False)
+    print("  %.1f MB" % (tracemalloc.get_traced_memory()[0] / 2**20))
+    tracemalloc.stop()
+
+    # What someone has typed a few keystrokes into an address.
+    queries = [rng.choice(raws)[: rng.randint(4, 12)] for _ in range(args.queries)]
+    with timer("suggest, %d queries" % args.queries, args.queries):
+        for q in queries:
+            index.suggest(q)
+    with timer("suggest again, %d queries" % args.queries, args.queries):
+        for q in queries:
+            index.suggest(q)
+
+
+if __name__ == "__main__":
+    main()
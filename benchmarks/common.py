@@ -0,0 +1,65 @@
+"""
+Shared setup for the benchmarks. Django is configured with the example
+site's settings against `DATABASE_URL`, which defaults to a throwaway
+SQLite file, and the database is migrated before the benchmark runs.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup():
+    import django
+    from django.core.management import call_command
+
+    sys.path[:0] = [ROOT, os.path.join(ROOT, "example_site")]
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "example_site.settings")
+    os.environ.setdefault("DATABASE_URL", "sqlite:///%s" % os.path.join(tempfile.mkdtemp(), "benchmark.db"))
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+# Addresses are scattered around these cities, as real data would be.
+CITIES = [(-37.81, 144.96), (-33.87, 151.21), (40.71, -74.01), (51.51, -0.13), (35.68, 139.69), (-23.55, -46.63)]
+
+
+def random_point(rng):
+    latitude, longitude = rng.choice(CITIES)
+    return latitude + rng.gauss(0, 0.2), longitude + rng.gauss(0, 0.2)
+
+
+def populate(rows):
+    """
+    Make sure there are at least `rows` addresses with coordinates, so an
+    existing database given in `DATABASE_URL` can be reused between runs.
+    """
+    from address.models import Address, _insert_addresses
+
+    existing = Address.objects.count()
+    rng = random.Random(existing)
+    with timer("insert %d addresses" % max(rows - existing, 0), rows - existing):
+        batch = []
+        for i in range(existing, rows):
+            latitude, longitude = random_point(rng)
+            batch.append(Address(raw="Address %d" % i, latitude=latitude, longitude=longitude))
+            if len(batch) == 5000:
+                _insert_addresses(batch)
+                batch = []
+        _insert_addresses(batch)
+
+
+@contextmanager
+def timer(label, count=None):
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    if count and count > 0:
+        print("%-40s %9.3fs  %10.1f/s" % (label, elapsed, count / elapsed))
+    else:
+        print("%-40s %9.3fs" % (label, elapsed))
@@ -0,0 +1,66 @@
+"""
+Compare formatting addresses with `str()` against `as_strings()`, with and
+without `with_hierarchy()`, checking all three give the same strings.
+Half of the addresses have no `formatted` value, so their string is built
+from the hierarchy.
+
+    python benchmarks/formatting.py --rows 50000
+"""
+
+import argparse
+import random
+
+from common import setup, timer
+
+
+def populate(rows):
+    from address.models import Address, Country, Locality, State
+
+    existing = Address.objects.filter(raw__startswith="Formatting ").count()
+    if existing >= rows:
+        return
+    rng = random.Random(existing)
+    country, _ = Country.objects.get_or_create(name="Formatting", code="FM")
+    localities = []
+    for i in range(10):
+        state, _ = State.objects.get_or_create(name="State %d" % i, code="S%d" % i, country=country)
+        for j in range(50):
+            locality, _ = Locality.objects.get_or_create(name="Locality %d" % j, postal_code="%04d" % j, state=state)
+            localities.append(locality)
+    with timer("insert %d addresses" % (rows - existing), rows - existing):
+        batch = []
+        for i in range(existing, rows):
+            locality = rng.choice(localities)
+            address = Address(
+                street_number=str(rng.randint(1, 200)),
+                route="Street %d" % rng.randint(1, 100),
+                locality=locality,
+                raw="Formatting %d" % i,
+            )
+            if i % 2:
+                address.formatted = str(address)
+            batch.append(address)
+        Address.objects.bulk_create(batch, batch_size=5000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    setup()
+    from address.models import Address
+
+    populate(args.rows)
+    addresses = Address.objects.filter(raw__startswith="Formatting ").order_by("pk")
+    with timer("str()", args.rows):
+        lazy = [str(a) for a in addresses]
+    with timer("str() with with_hierarchy()", args.rows):
+        joined = [str(a) for a in addresses.with_hierarchy()]
+    with timer("as_strings()", args.rows):
+        strings = list(addresses.as_strings())
+    print("results match: %s" % (lazy == joined == strings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Time batch geocoding against a backend with fixed latency, one string at a
+time and through `CachedGeocoder`, where repeated strings are answered from
+the cache and the rest are spread over a thread pool.
+
+    python benchmarks/geocoding.py --strings 500 --unique 200 --latency 0.02
+"""
+
+import argparse
+import random
+
+from common import setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--strings", type=int, default=500)
+    parser.add_argument("--unique", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    setup()
+    from address.geocoders import CachedGeocoder, FakeGeocoder
+
+    results = {"%d Some Street, Northcote" % i: {"street_number": str(i)} for i in range(args.unique)}
+    rng = random.Random(0)
+    raws = [rng.choice(list(results)) for _ in range(args.strings)]
+
+    fake = FakeGeocoder(results, delay=args.latency)
+    with timer("sequential, %d strings" % args.strings, args.strings):
+        expected = fake.geocode_many(raws)
+    print("  %d backend calls" % len(fake.calls))
+
+    fake = FakeGeocoder(results, delay=args.latency)
+    with timer("cached, %d workers" % args.workers, args.strings):
+        found = CachedGeocoder(fake, workers=args.workers).geocode_many(raws)
+    print("  %d backend calls" % len(fake.calls))
+    print("results match: %s" % (found == expected))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Measure the memory taken by a `LocalityIndex` of generated localities and
+time its lookups, against the same lookups as queries on a database of
+`--db-rows` localities.
+
+    python benchmarks/localities.py --rows 1000000 --db-rows 20000
+"""
+
+import argparse
+import random
+import tracemalloc
+from itertools import islice
+
+from common import setup, timer
+from search import name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--db-rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100000)
+    args = parser.parse_args()
+
+    setup()
+    from address.localities import LocalityIndex
+    from address.models import Country, Locality, State
+
+    # Localities spread over 50 states, with names often reused between
+    # states and a few localities sharing each postal code, as in real data.
+    rng = random.Random(0)
+    names = [name(rng) for _ in range(args.rows // 4)]
+    rows = [(i, rng.choice(names), "%05d" % (i // 3), i % 50) for i in range(1, args.rows + 1)]
+    states = [(i, "State %d" % i, "S%d" % i, 1) for i in range(50)]
+
+    tracemalloc.start()
+    with timer("build index of %d localities" % args.rows, args.rows):
+        index = LocalityIndex(rows, states, [(1, "Country", "CC")])
+    print("  %.1f MB" % (tracemalloc.get_traced_memory()[0] / 2**20))
+    tracemalloc.stop()
+
+    queries = [rng.choice(rows) for _ in range(args.queries)]
+    with timer("by_postal_code, %d queries" % args.queries, args.queries):
+        for _, _, postal_code, state_id in queries:
+            index.by_postal_code(postal_code, state_id)
+    with timer("by_name_state, %d queries" % args.queries, args.queries):
+        for _, locality, _, state_id in queries:
+            index.by_name_state(locality, "S%d" % state_id)
+
+    country = Country.objects.get_or_create(name="Country", code="CC")[0]
+    state = State.objects.get_or_create(name="State", code="S", country=country)[0]
+    existing = Locality.objects.count()
+    Locality.objects.bulk_create(
+        [
+            Locality(name="%s %d" % (n, i), postal_code=p, state=state)
+            for i, n, p, _ in islice(rows, existing, args.db_rows)
+        ]
+    )
+    queries = queries[: args.queries // 10]
+    with timer("postal code query, %d queries" % len(queries), len(queries)):
+        for _, _, postal_code, _ in queries:
+            list(Locality.objects.filter(postal_code=postal_code, state__code="S").values_list("pk", "name"))
+
+
+if __name__ == "__main__":
+    main()
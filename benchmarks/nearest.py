@@ -0,0 +1,42 @@
+"""
+Compare `Address.objects.nearest` with a brute force scan ordering every
+address by distance, for query points near the addresses.
+
+    python benchmarks/nearest.py --rows 1000000
+"""
+
+import argparse
+import random
+
+from common import populate, random_point, setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    setup()
+    from address.models import Address, _haversine
+
+    populate(args.rows)
+    rng = random.Random(1)
+    points = [random_point(rng) for _ in range(args.queries)]
+    with timer("nearest, %d queries" % args.queries, args.queries):
+        found = [[a.pk for a in Address.objects.nearest(lat, lng, args.k)] for lat, lng in points]
+    with timer("brute force, %d queries" % args.queries, args.queries):
+        expected = [
+            list(
+                Address.objects.annotate(distance=_haversine(lat, lng))
+                .order_by("distance", "pk")
+                .values_list("pk", flat=True)[: args.k]
+            )
+            for lat, lng in points
+        ]
+    print("results match: %s" % (found == expected))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Time computing canonical keys for street addresses and raw strings, as an
+import would, with the route and number caches cold and warm.
+
+    python benchmarks/normalize.py --rows 200000 --routes 5000
+"""
+
+import argparse
+import random
+
+from common import setup, timer
+
+TYPES = ["St", "Street", "Rd", "Road", "Ave", "Avenue", "Pde", "Cres", "Ct", "Hwy"]
+NAMES = ["Smith", "High", "Église", "O'Connell", "Station", "Park", "Mt Alexander", "N. Main", "Church", "King"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--routes", type=int, default=5000)
+    args = parser.parse_args()
+
+    setup()
+    from address.normalize import address_key, normalize_route, parse_number, raw_key
+
+    rng = random.Random(0)
+    routes = ["%s %d %s" % (rng.choice(NAMES), i, rng.choice(TYPES)) for i in range(args.routes)]
+    rows = []
+    for _ in range(args.rows):
+        number = str(rng.randrange(1, 300))
+        if rng.random() < 0.1:
+            number = "%d/%s" % (rng.randrange(1, 20), number)
+        rows.append((number, rng.choice(routes), rng.randrange(1000)))
+    raws = ["%s %s, Suburb %d" % row for row in rows]
+
+    normalize_route.cache_clear()
+    parse_number.cache_clear()
+    with timer("address_key, cold caches", args.rows):
+        for number, route, locality in rows:
+            address_key(number, route, locality)
+    with timer("address_key, warm caches", args.rows):
+        for number, route, locality in rows:
+            address_key(number, route, locality)
+    with timer("raw_key", args.rows):
+        for raw in raws:
+            raw_key(raw)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Time seeding every reference country and state, then converting address
+dictionaries spread over many countries with and without
+`ADDRESS_SEEDED_REGIONS`, counting the queries each conversion takes.
+
+    python benchmarks/regions.py --values 2000
+"""
+
+import argparse
+import random
+
+from common import setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--values", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.db import connection
+
+    from address.cache import hierarchy_cache
+    from address.models import Country, State, to_python
+    from address.regions import reference_regions, reset_regions, seed_regions
+
+    countries, subdivisions = reference_regions()
+    with timer("seed_regions"):
+        counts = seed_regions()
+    print("  created %d and updated %d countries, created %d and updated %d states" % counts)
+
+    # Browsers send Google's names, which often differ from ISO's, along
+    # with the ISO codes.
+    rng = random.Random(0)
+    regions = [(c, n, s) for c, n in countries for s in subdivisions.get(c, ())]
+
+    def values(label):
+        for i in range(args.values):
+            code, name, (state_code, state) = rng.choice(regions)
+            yield {
+                "raw": "%d %s Street, %s" % (i, label, state),
+                "street_number": str(i),
+                "route": "%s Street" % label,
+                "locality": "Town %d" % rng.randrange(20),
+                "postal_code": "",
+                "state": "%s Region" % state,
+                "state_code": state_code,
+                "country": "The %s" % name,
+                "country_code": code,
+            }
+
+    # Seeded first, as the rows created without it would make codes ambiguous.
+    for seeded in (True, False):
+        settings.ADDRESS_SEEDED_REGIONS = seeded
+        reset_regions()
+        hierarchy_cache.clear()
+        label = "seeded" if seeded else "unseeded"
+        queries = []
+        regions_before = Country.objects.count() + State.objects.count()
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            with timer("to_python, %s, %d values" % (label, args.values), args.values):
+                for value in values(label):
+                    to_python(value)
+        print(
+            "  %.1f queries each, %d countries and states created"
+            % (len(queries) / args.values, Country.objects.count() + State.objects.count() - regions_before)
+        )
+
+
+if __name__ == "__main__":
+    main()
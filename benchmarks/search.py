@@ -0,0 +1,71 @@
+"""
+Time `Address.objects.search` against the admin's `icontains` search, on
+addresses with street-like raw strings. Without PostgreSQL's pg_trgm the
+portable trigram table is used, built here with `rebuild_search_index`.
+
+    python benchmarks/search.py --rows 100000 --queries 100
+"""
+
+import argparse
+import random
+
+from common import setup, timer
+
+# Street and suburb names are made of random syllables, giving roughly the
+# spread of trigrams found in real names.
+SYLLABLES = [c + v for c in "bcdfghklmnprstvwyz" for v in "aeiou"] + ["ton", "ley", "wood", "ham", "field"]
+TYPES = ["Street", "Road", "Avenue", "Parade", "Crescent", "Lane", "Court", "Drive"]
+
+
+def name(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def typo(rng, text):
+    i = rng.randrange(len(text) - 1)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2 :]  # noqa: E203
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db.models import Q
+
+    from address.models import Address, _insert_addresses
+
+    settings.ADDRESS_SEARCH_INDEX = False
+    rng = random.Random(0)
+    streets = ["%s %s" % (name(rng), rng.choice(TYPES)) for _ in range(args.rows // 20)]
+    suburbs = [name(rng) for _ in range(500)]
+    raws = []
+    for i in range(args.rows):
+        raws.append("%d %s, %s" % (rng.randrange(1, 300), rng.choice(streets), rng.choice(suburbs)))
+    if Address.objects.count() < args.rows:
+        with timer("insert %d addresses" % args.rows, args.rows):
+            for start in range(0, len(raws), 5000):
+                _insert_addresses([Address(raw=raw) for raw in raws[start : start + 5000]])  # noqa: E203
+    settings.ADDRESS_SEARCH_INDEX = True
+    with timer("rebuild_search_index", args.rows):
+        call_command("rebuild_search_index", "--chunk-size", "5000")
+
+    originals = [rng.choice(raws).split(",")[0] for _ in range(args.queries)]
+    queries = [typo(rng, original) for original in originals]
+    with timer("search, %d queries" % args.queries, args.queries):
+        results = [Address.objects.search(q, limit=10) for q in queries]
+    found = sum(any(r.raw.split(",")[0] == original for r in rs) for rs, original in zip(results, originals))
+    print("  %d of %d found the misspelt address" % (found, len(queries)))
+
+    with timer("icontains, %d queries" % args.queries, args.queries):
+        for q in queries:
+            matches = Q(street_number__icontains=q) | Q(route__icontains=q) | Q(raw__icontains=q)
+            list(Address.objects.filter(matches)[:10])
+
+
+if __name__ == "__main__":
+    main()
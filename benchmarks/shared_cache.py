@@ -0,0 +1,70 @@
+"""
+Time repeated conversions of a few popular address dictionaries with and
+without `ADDRESS_CACHE_ALIAS`, counting the queries each takes, both in a
+warm process and as if each conversion ran in a freshly started one.
+
+    python benchmarks/shared_cache.py --values 5000 --popular 50
+"""
+
+import argparse
+import random
+
+from common import setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--values", type=int, default=5000)
+    parser.add_argument("--popular", type=int, default=50)
+    args = parser.parse_args()
+
+    setup()
+    from django.conf import settings
+    from django.core.cache import caches
+    from django.db import connection
+
+    from address.cache import hierarchy_cache
+    from address.models import to_python
+
+    popular = [
+        {
+            "raw": "%d Warehouse Road, Town %d" % (i, i % 10),
+            "street_number": str(i),
+            "route": "Warehouse Road",
+            "locality": "Town %d" % (i % 10),
+            "postal_code": "3%03d" % (i % 10),
+            "state": "Victoria",
+            "state_code": "VIC",
+            "country": "Australia",
+            "country_code": "AU",
+        }
+        for i in range(args.popular)
+    ]
+    for value in popular:
+        to_python(value)
+    rng = random.Random(0)
+    values = [rng.choice(popular) for _ in range(args.values)]
+
+    for alias in (None, "default"):
+        settings.ADDRESS_CACHE_ALIAS = alias
+        caches["default"].clear()
+        for cold in (False, True):
+            hierarchy_cache.clear()
+            label = "%s, %s" % ("shared cache" if alias else "no shared cache", "cold" if cold else "warm")
+            queries = []
+
+            def count(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count):
+                with timer("to_python, %s" % label, args.values):
+                    for value in values:
+                        if cold:
+                            hierarchy_cache.clear()
+                        to_python(value)
+            print("  %.2f queries each" % (len(queries) / args.values))
+
+
+if __name__ == "__main__":
+    main()
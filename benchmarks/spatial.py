@@ -0,0 +1,62 @@
+"""
+Time loading a `SpatialIndex` and answering batches of radius and nearest
+neighbour queries, checking a sample of the answers against a brute force
+NumPy scan.
+
+    python benchmarks/spatial.py --rows 1000000
+"""
+
+import argparse
+import datetime
+import random
+
+import numpy as np
+
+from common import populate, random_point, setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=10000)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--km", type=float, default=1.0)
+    args = parser.parse_args()
+
+    setup()
+    from address.models import Address
+    from address.spatial import SpatialIndex, _chord, _points
+
+    populate(args.rows)
+    with timer("load %d addresses" % args.rows, args.rows):
+        index = SpatialIndex.load()
+
+    rng = random.Random(1)
+    points = [random_point(rng) for _ in range(args.queries)]
+    with timer("within %gkm, %d queries" % (args.km, args.queries), args.queries):
+        within = index.within_radius(points, args.km)
+    with timer("nearest %d, %d queries" % (args.k, args.queries), args.queries):
+        ids, _ = index.nearest(points, args.k)
+
+    sample = min(20, args.queries)
+    with timer("brute force nearest, %d queries" % sample, sample):
+        for row, vector in enumerate(_points(points[:sample])):
+            distances = np.sqrt(((index.vectors - vector) ** 2).sum(axis=1))
+            closest = np.argsort(distances, kind="stable")[: args.k]
+            assert set(index.ids[closest]) == set(ids[row]), row
+            assert set(index.ids[distances <= _chord(args.km)]) == set(within[row]), row
+    print("results match: True")
+
+    for address in Address.objects.filter(pk__in=list(ids[0])):
+        address.save()
+    # No overlap, so only the saved rows are read even if the table was
+    # populated moments ago.
+    overlap = datetime.timedelta(0)
+    with timer("refresh after saving %d addresses" % len(ids[0])):
+        index.refresh(overlap=overlap)
+    with timer("refresh without pruning"):
+        index.refresh(prune=False, overlap=overlap)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Time rendering a formset of address widgets given address primary keys, as
+a model formset would, with and without `prefetch_addresses`.
+
+    python benchmarks/widget.py --forms 300
+"""
+
+import argparse
+
+from common import setup, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--forms", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup()
+    from django import forms
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from address.forms import AddressField
+    from address.models import Address, to_python
+    from address.widgets import prefetch_addresses
+
+    class AddressForm(forms.Form):
+        address = AddressField()
+
+    FormSet = forms.formset_factory(AddressForm, extra=0)
+    pks = list(Address.objects.filter(raw__startswith="Widget ").values_list("pk", flat=True)[: args.forms])
+    for i in range(len(pks), args.forms):
+        pks.append(
+            to_python(
+                {
+                    "raw": "Widget %d" % i,
+                    "street_number": str(i),
+                    "route": "Some Street",
+                    "locality": "Northcote",
+                    "postal_code": "3070",
+                    "state": "Victoria",
+                    "state_code": "VIC",
+                    "country": "Australia",
+                    "country_code": "AU",
+                }
+            ).pk
+        )
+    initial = [{"address": pk} for pk in pks]
+
+    def render(prefetch):
+        formset = FormSet(initial=initial)
+        if prefetch:
+            prefetch_addresses(formset)
+        return [str(form["address"]) for form in formset]
+
+    results = []
+    for prefetch in (False, True):
+        label = "with prefetch" if prefetch else "without prefetch"
+        with CaptureQueriesContext(connection) as queries:
+            results.append(render(prefetch))
+        with timer("%s, %d forms x %d" % (label, args.forms, args.repeat), args.forms * args.repeat):
+            for _ in range(args.repeat):
+                render(prefetch)
+        print("  %d queries per formset" % len(queries))
+    print("results match: %s" % (results[0] == results[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 
 from person import views as person
 
 urlpatterns = [
     path("", person.home, name="home"),
     path("admin/", admin.site.urls),
+    path("address/", include("address.urls")),
 ]
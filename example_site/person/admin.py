@@ -12,5 +12,6 @@ class PersonAdmin(admin.ModelAdmin):
         "first_name",
         "address",
     )
+    list_select_related = ("address__locality__state__country",)
 
     formfield_overrides = {AddressField: {"widget": AddressWidget(attrs={"style": "width: 300px;"})}}
@@ -42,5 +42,6 @@ setup(
     include_package_data=True,
     package_data={"": ["*.txt", "*.js", "*.html", "*.*"]},
     install_requires=["setuptools"],
+    extras_require={"spatial": ["numpy"]},
     zip_safe=False,
 )